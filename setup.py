@@ -47,7 +47,8 @@ setuptools.setup(
     entry_points={'console_scripts': ['fab=fab.builder:entry',  # Alias
                                       'fab-build=fab.builder:entry',
                                       'fab-grab=fab.grabber:entry',
-                                      'fab-dump=fab.dumper:entry'],
+                                      'fab-dump=fab.dumper:entry',
+                                      'fab-worker=fab.remote:entry'],
                   'gui_scripts': ['fab-explorer=fab.explorer:entry']},
     python_requires='>=3.6, <4',
     install_requires=[],
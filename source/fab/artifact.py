@@ -6,10 +6,14 @@
 
 from pathlib import Path
 from abc import ABC
-from typing import Type, List, Optional, Union
-from zlib import adler32
+import hashlib
+from sys import intern
+from typing import \
+    Callable, Dict, Iterator, Type, List, Optional, Tuple, Union
+import zlib
 
-from fab.reader import FileTextReader
+from fab import FabException
+from fab.reader import read_source, shared_content
 
 
 # Classes representing possible states of an Artifact
@@ -78,7 +82,168 @@ class Executable(FileType):
     pass
 
 
+def _subclass_named(base: type, name: str) -> type:
+    candidates: List[type] = base.__subclasses__()
+    while candidates:
+        candidate = candidates.pop()
+        if candidate.__name__ == name:
+            return candidate
+        candidates.extend(candidate.__subclasses__())
+    raise ValueError(f"No {base.__name__} called '{name}'")
+
+
+def filetype_named(name: str) -> Type[FileType]:
+    """
+    Finds a filetype from its name, as recorded in the state database.
+    """
+    return _subclass_named(FileType, name)
+
+
+def state_named(name: str) -> Type[State]:
+    """
+    Finds a state from its name, as recorded in the state database.
+    """
+    return _subclass_named(State, name)
+
+
+# Most source files are read in one go
+_BLOCK_SIZE = 1024 * 1024
+
+
+def _blocks(location: Path) -> Iterator[bytes]:
+    # A file already read by the current job is hashed from its buffer.
+    # Otherwise it is read afresh, so that a change is seen however well
+    # hidden, and a small one kept for whatever reads it next
+    content = shared_content(location)
+    if content is None and location.stat().st_size <= _BLOCK_SIZE:
+        content = read_source(location, fresh=True)
+    if content is not None:
+        yield content
+        return
+    with location.open('rb') as stream:
+        yield from iter(lambda: stream.read(_BLOCK_SIZE), b'')
+
+
+def _blake2b(location: Path) -> int:
+    hasher = hashlib.blake2b(digest_size=8)
+    for block in _blocks(location):
+        hasher.update(block)
+    # Kept to 63 bits so as to fit an SQLite integer
+    return int.from_bytes(hasher.digest(), 'big') >> 1
+
+
+def _checksum(function: Callable[[bytes, int], int],
+              start: int) -> Callable[[Path], int]:
+    def checksum(location: Path) -> int:
+        result = start
+        for block in _blocks(location):
+            result = function(block, result)
+        return result
+    return checksum
+
+
+# Going by Experimental/BenchmarkHashes adler32 is the quickest, crc32 close
+# behind and less prone to collisions between short files. blake2b is much
+# the slowest but for practical purposes never collides.
+#
+HASH_ALGORITHMS: Dict[str, Callable[[Path], int]] = {
+    'adler32': _checksum(zlib.adler32, 1),
+    'crc32': _checksum(zlib.crc32, 0),
+    'blake2b': _blake2b,
+}
+
+_hash_algorithm = 'adler32'
+
+
+def use_hash_algorithm(name: str) -> None:
+    """
+    Chooses how files are hashed from now on, by this process and any
+    worker processes it goes on to start.
+
+    :param name: One of HASH_ALGORITHMS.
+    """
+    global _hash_algorithm
+    if name not in HASH_ALGORITHMS:
+        raise FabException(f'Unknown hash algorithm "{name}"')
+    _hash_algorithm = name
+
+
+def hash_algorithm() -> str:
+    """
+    :return: Name of the algorithm files are hashed with.
+    """
+    return _hash_algorithm
+
+
+def file_hash(location: Path) -> int:
+    """
+    :return: Hash of the contents of a file.
+    """
+    return HASH_ALGORITHMS[_hash_algorithm](location)
+
+
+# Small codes standing in for the filetypes and states of artifacts sent
+# between processes. Any others, such as those of tests, are sent as they
+# are.
+#
+_FILETYPES: Tuple[Type[FileType], ...] = (Unknown, FortranSource, CSource,
+                                          CHeader, BinaryObject, Executable)
+_STATES: Tuple[Type[State], ...] = (New, Seen, HeadersAnalysed, Modified,
+                                    Raw, Analysed, Compiled, Linked)
+_FILETYPE_CODES = {filetype: code for code, filetype in enumerate(_FILETYPES)}
+_STATE_CODES = {state: code for code, state in enumerate(_STATES)}
+
+
+# Each file's path is made once by a process however many times artifacts
+# for it arrive.
+#
+_paths: Dict[Tuple[str, str], Path] = {}
+
+
+def _decode_path(directory: str, name: str) -> Path:
+    path = _paths.get((directory, name))
+    if path is None:
+        path = _paths.setdefault((directory, name), Path(directory, name))
+    return path
+
+
+def _encode_path(path: Path) -> Tuple[str, str]:
+    # Directories are shared between many files. Interned they are pickled
+    # once however many files of a message are in them.
+    return intern(str(path.parent)), path.name
+
+
+def _decode_artifact(location: Tuple[str, str],
+                     filetype: Union[int, Type[FileType]],
+                     state: Union[int, Type[State]],
+                     defines: Tuple[str, ...],
+                     depends_on: Tuple[str, ...],
+                     paths: int,
+                     hash: Optional[int]) -> 'Artifact':
+    artifact = Artifact(_decode_path(*location),
+                        _FILETYPES[filetype]
+                        if isinstance(filetype, int) else filetype,
+                        _STATES[state] if isinstance(state, int) else state)
+    artifact._defines = [intern(definition) for definition in defines]
+    artifact._depends_on = [Path(dependency) if paths & (1 << index)
+                            else intern(dependency)
+                            for index, dependency in enumerate(depends_on)]
+    artifact._hash = hash
+    return artifact
+
+
 class Artifact(object):
+    """
+    A file at some stage of the build.
+
+    Artifacts are made in great numbers and sent between processes so are
+    kept small. Names of units are interned, being shared between those
+    which define them and those which depend on them, and artifacts are
+    pickled as a tuple of plain values.
+    """
+    __slots__ = ('_location', '_filetype', '_state', '_defines',
+                 '_depends_on', '_hash')
+
     def __init__(self,
                  location: Path,
                  filetype: Type[FileType],
@@ -91,6 +256,22 @@ class Artifact(object):
         self._depends_on: List[Union[str, Path]] = []
         self._hash: Optional[int] = None
 
+    def __reduce__(self):
+        # Paths of dependencies are sent as strings, with a bit set for each
+        # dependency which is a path rather than a name
+        paths = 0
+        for index, dependency in enumerate(self._depends_on):
+            if isinstance(dependency, Path):
+                paths |= 1 << index
+        return (_decode_artifact,
+                (_encode_path(self._location),
+                 _FILETYPE_CODES.get(self._filetype, self._filetype),
+                 _STATE_CODES.get(self._state, self._state),
+                 tuple(self._defines),
+                 tuple(str(dependency) for dependency in self._depends_on),
+                 paths,
+                 self._hash))
+
     @property
     def location(self) -> Path:
         return self._location
@@ -116,14 +297,18 @@ class Artifact(object):
         # If this is the first access of the property calculate the hash
         # and cache it for later accesses
         if self._hash is None:
-            self._hash = 1
-            reader = FileTextReader(self.location)
-            for line in reader.line_by_line():
-                self._hash = adler32(bytes(line, encoding='utf-8'), self._hash)
+            self._hash = file_hash(self.location)
         return self._hash
 
+    @hash.setter
+    def hash(self, value: int) -> None:
+        # Where the hash is already known the file need not be read
+        self._hash = value
+
     def add_dependency(self, dependency: Union[str, Path]) -> None:
+        if isinstance(dependency, str):
+            dependency = intern(dependency)
         self._depends_on.append(dependency)
 
     def add_definition(self, definition: str) -> None:
-        self._defines.append(definition)
+        self._defines.append(intern(definition))
@@ -4,11 +4,29 @@
 # which you should have received as part of this distribution
 ##############################################################################
 import logging
+import os
 from pathlib import Path
+from typing import \
+    Dict, \
+    Iterator, \
+    List, \
+    Mapping, \
+    Optional, \
+    Sequence, \
+    Set, \
+    Tuple, \
+    Type, \
+    Union
 
-from fab.database import SqliteStateDatabase, FileInfoDatabase
+from fab import FabException
+from fab.database import \
+    SqliteStateDatabase, \
+    FileInfoDatabase, \
+    DerivedFileDatabase
 from fab.artifact import \
     Artifact, \
+    FileType, \
+    State, \
     FortranSource, \
     CSource, \
     CHeader, \
@@ -18,7 +36,10 @@ from fab.artifact import \
     Modified, \
     Raw, \
     Analysed, \
-    Compiled
+    Compiled, \
+    HASH_ALGORITHMS, \
+    use_hash_algorithm
+from fab.layout import FlatLayout, TreeLayout, WorkspaceLayout
 from fab.tasks.common import Linker, HeaderAnalyser
 from fab.tasks.fortran import \
     FortranWorkingState, \
@@ -32,10 +53,20 @@ from fab.tasks.c import \
     CAnalyser, \
     CCompiler
 from fab.source_tree import \
-    TreeDescent, \
-    SourceVisitor
+    TreeDescent
+from fab.cache import ObjectCache
+from fab.governor import LoadGovernor
 from fab.queue import QueueManager
+from fab.remote import \
+    KEY_VARIABLE, \
+    RemoteWorker, \
+    get_key, \
+    parse_address
+from fab.graph import CriticalPath, TargetPruning
+from fab.plan import BuildPlan, Planner
 from fab.engine import Engine, PathMap
+from fab.tasks import Task
+from fab.trace import Trace
 
 
 def entry() -> None:
@@ -67,10 +98,88 @@ def entry() -> None:
     parser.add_argument('-w', '--workspace', metavar='PATH', type=Path,
                         default=Path.cwd() / 'working',
                         help='Directory for working files.')
-    parser.add_argument('--nprocs', action='store', type=int, default=2,
-                        choices=range(2, multiprocessing.cpu_count()),
+
+    def processors(text: str) -> Optional[int]:
+        if text == 'auto':
+            return None
+        try:
+            n_procs = int(text)
+        except ValueError:
+            n_procs = 0
+        if n_procs not in range(2, multiprocessing.cpu_count()):
+            message = f'must be "auto" or from 2 to ' \
+                      f'{multiprocessing.cpu_count() - 1}'
+            raise argparse.ArgumentTypeError(message)
+        return n_procs
+
+    parser.add_argument('--nprocs', action='store', type=processors,
+                        default=2, metavar='{N,auto}',
                         help='Provide number of processors available for use,'
-                             'default is 2 if not set.')
+                             'default is 2 if not set. With "auto" work is '
+                             'taken on as the machine has room for it.')
+    parser.add_argument('--max-load', metavar='LOAD', type=float, default=1.0,
+                        help='With --nprocs auto, take on less work when the '
+                             'load average per processor exceeds this, '
+                             'default is 1.0 if not set.')
+    parser.add_argument('--min-memory', metavar='MB', type=int, default=512,
+                        help='With --nprocs auto, take on less work when '
+                             'available memory falls below this, default is '
+                             '512 MB if not set.')
+    parser.add_argument('--critical-path', action='store_true',
+                        help='Start work with the longest chain of dependents '
+                             'first, based on the previous build')
+    parser.add_argument('--incremental', action='store_true',
+                        help='Reuse the results of the previous build for '
+                             'files which have not changed')
+    parser.add_argument('--trust-stat', action='store_true',
+                        help='With --incremental take files whose '
+                             'modification time, size and inode are as '
+                             'they were when last hashed to be unchanged, '
+                             'without reading them')
+    parser.add_argument('--prune', action='store_true',
+                        help='Leave out unchanged files which the previous '
+                             'build found the target does not need')
+    parser.add_argument('--batch', metavar='SIZE', type=int, default=1,
+                        help='Compile up to this many independent files with '
+                             'each call of a compiler, default is 1 if not '
+                             'set.')
+    parser.add_argument('--archive', action='store_true',
+                        help='Link by way of a static archive of the '
+                             'objects in each directory, updating only the '
+                             'members which have changed')
+    parser.add_argument('--layout', choices=['flat', 'tree'],
+                        default='flat',
+                        help='How files are arranged in the workspace. '
+                             '"tree" mirrors the source tree so that no '
+                             'directory grows too large and files of the '
+                             'same name may be built, default is "flat" if '
+                             'not set.')
+    parser.add_argument('--hash', choices=list(HASH_ALGORITHMS),
+                        default='adler32',
+                        help='How files are hashed to tell whether they '
+                             'have changed. Changing it makes every file '
+                             'look new. Default is "adler32" if not set.')
+    parser.add_argument('--cache', metavar='PATH', type=Path,
+                        help='Directory of compiled objects which may be '
+                             'shared between workspaces')
+    parser.add_argument('--cache-size', metavar='MB', type=int, default=1024,
+                        help='Limit on the size of the cache, default is '
+                             '1024 MB if not set.')
+    parser.add_argument('--remote', metavar='HOST:PORT', type=parse_address,
+                        action='append', default=[],
+                        help='Also compile using the fab-worker at this '
+                             'address. May be given more than once, '
+                             'including for the same worker to have it '
+                             'compile several files at once. The key '
+                             f'shared with workers is taken from '
+                             f'{KEY_VARIABLE}.')
+    parser.add_argument('--trace', metavar='PATH', type=Path,
+                        help='Write a timeline of the build to this file, '
+                             'in the Chrome trace event format')
+    parser.add_argument('--plan', action='store_true',
+                        help='Print what the build would do, from what is '
+                             'known of the previous build, without doing '
+                             'it')
     parser.add_argument('source', type=Path,
                         help='The path of the source tree to build')
     parser.add_argument('conf_file', type=Path, default='config.ini',
@@ -82,84 +191,197 @@ def entry() -> None:
     else:
         logger.setLevel(logging.WARNING)
 
+    remotes: List[RemoteWorker] = []
+    if arguments.remote:
+        try:
+            key = get_key()
+        except FabException as err:
+            parser.error(str(err))
+        remotes = [RemoteWorker(address, key)
+                   for address in arguments.remote]
+
     config = configparser.ConfigParser(allow_no_value=True)
     configfile = arguments.conf_file
     config.read(configfile)
     settings = config['settings']
     flags = config['flags']
 
-    # If not provided, name the exec after the target
-    if settings['exec-name'] == '':
-        settings['exec-name'] = settings['target']
+    # Several targets may be given, each linked into its own executable.
+    # If not provided, name each exec after its target
+    targets = settings['target'].split()
+    exec_names = settings['exec-name'].split() or targets
+    if len(exec_names) != len(targets):
+        parser.error('exec-name must name an executable for each target')
 
     application = Fab(arguments.workspace,
-                      settings['target'],
-                      settings['exec-name'],
+                      targets,
+                      exec_names,
                       flags['fpp-flags'],
                       flags['fc-flags'],
                       flags['ld-flags'],
-                      arguments.nprocs)
-    application.run(arguments.source)
+                      arguments.nprocs,
+                      critical_path=arguments.critical_path,
+                      incremental=arguments.incremental,
+                      trust_stat=arguments.trust_stat,
+                      prune=arguments.prune,
+                      batch_size=arguments.batch,
+                      archive=arguments.archive,
+                      layout=arguments.layout,
+                      hash_algorithm=arguments.hash,
+                      cache=arguments.cache,
+                      cache_size=arguments.cache_size * 1024 * 1024,
+                      max_load=arguments.max_load,
+                      min_memory=arguments.min_memory * 1024 * 1024,
+                      remotes=remotes,
+                      trace=arguments.trace)
+    if arguments.plan:
+        application.plan(arguments.source).report()
+    else:
+        try:
+            application.run(arguments.source)
+        except FabException as err:
+            sys.exit(str(err))
 
 
-class Fab(object):
+class EngineRecipe(object):
+    """
+    What the engine is made from, being no more than a few names and
+    numbers.
+
+    Worker processes are sent this in place of the engine and make their
+    own from it, once, keeping its tasks and their database connections
+    for as long as they run. What is sent does not grow with the task map
+    and need not be picklable beyond these few values.
+    """
     def __init__(self,
                  workspace: Path,
-                 target: str,
-                 exec_name: str,
+                 targets: Sequence[str],
+                 exec_names: Sequence[str],
                  fpp_flags: str,
                  fc_flags: str,
                  ld_flags: str,
-                 n_procs: int):
+                 incremental: bool = False,
+                 trust_stat: bool = False,
+                 batch_size: int = 1,
+                 archive: bool = False,
+                 layout: str = 'flat',
+                 cache: Optional[Path] = None,
+                 cache_size: int = 1024 ** 3,
+                 hash_algorithm: str = 'adler32'):
+        if layout not in ['flat', 'tree']:
+            raise FabException(f'Unknown workspace layout "{layout}"')
+        self.workspace = workspace
+        self.targets = list(targets)
+        self.exec_names = list(exec_names)
+        self.fpp_flags = fpp_flags
+        self.fc_flags = fc_flags
+        self.ld_flags = ld_flags
+        self.incremental = incremental
+        self.trust_stat = trust_stat
+        self.batch_size = batch_size
+        self.archive = archive
+        self.layout = layout
+        self.cache = cache
+        self.cache_size = cache_size
+        self.hash_algorithm = hash_algorithm
+        # Root of the source tree, once known, for the tree layout
+        self.source: Optional[Path] = None
 
-        self._workspace = workspace
-        if not workspace.exists():
-            workspace.mkdir(parents=True)
+    def __call__(self) -> Engine:
+        """
+        Makes the engine, as each worker process does for itself.
+        """
+        use_hash_algorithm(self.hash_algorithm)
+        task_map, linkers, _, layout = self.tasks()
+        if isinstance(layout, TreeLayout):
+            layout.source = self.source
+        return self.engine(task_map, linkers)
 
-        self._state = SqliteStateDatabase(workspace)
+    @property
+    def fpp_command(self) -> List[str]:
+        return ['cpp', '-traditional-cpp', '-P'] + self.fpp_flags.split()
 
+    @property
+    def fc_command(self) -> List[str]:
+        return ['gfortran', '-c', '-J', str(self.workspace)] \
+            + self.fc_flags.split()
+
+    @property
+    def settings(self) -> str:
+        """
+        Results from a previous build may only be reused if they were
+        produced in the same way. Linking is always repeated so its flags
+        do not matter. Nor may they be found if the workspace is laid out
+        differently.
+        """
+        return '\n'.join([' '.join(self.fpp_command),
+                          ' '.join(self.fc_command),
+                          f'layout {self.layout}'])
+
+    @staticmethod
+    def path_maps() -> List[PathMap]:
         # Path maps tell the engine what filetype and starting state
         # the Artifacts representing any files encountered by the
         # initial descent should have
-        path_maps = [
+        return [
             PathMap(r'.*\.f90', FortranSource, Raw),
             PathMap(r'.*\.F90', FortranSource, Seen),
             PathMap(r'.*\.c', CSource, Seen),
             PathMap(r'.*\.h', CHeader, Seen),
         ]
 
+    def tasks(self) -> Tuple[Dict[Tuple[Type[FileType], Type[State]], Task],
+                             Dict[str, Linker],
+                             Optional[ObjectCache],
+                             WorkspaceLayout]:
+        """
+        :return: The task map, the linker for each target, and the object
+                 cache and workspace layout the tasks share.
+        """
+        workspace = self.workspace
+        layout: WorkspaceLayout = TreeLayout(workspace) \
+            if self.layout == 'tree' else FlatLayout(workspace)
+        cache: Optional[ObjectCache] = None
+        if self.cache is not None:
+            cache = ObjectCache(self.cache, self.cache_size)
+
         # Initialise the required Tasks, providing them with any static
         # properties such as flags to use, workspace location etc
         # TODO: Eventually the tasks may instead access many of these
         # properties via the configuration (at Task runtime, to allow for
         # file-specific overrides?)
+        fpp_command = self.fpp_command
         fortran_preprocessor = FortranPreProcessor(
-            'cpp', ['-traditional-cpp', '-P'] + fpp_flags.split(), workspace
+            fpp_command[0], fpp_command[1:], workspace, layout
         )
         fortran_analyser = FortranAnalyser(workspace)
+        fc_command = self.fc_command
         fortran_compiler = FortranCompiler(
-            'gfortran',
-            ['-c', '-J', str(workspace)] + fc_flags.split(), workspace
+            fc_command[0], fc_command[1:], workspace, cache, layout
         )
 
-        header_analyser = HeaderAnalyser(workspace)
-        c_pragma_injector = CPragmaInjector(workspace)
+        header_analyser = HeaderAnalyser(workspace, layout)
+        c_pragma_injector = CPragmaInjector(workspace, layout)
         c_preprocessor = CPreProcessor(
-            'cpp', [], workspace
+            'cpp', [], workspace, layout
         )
         c_analyser = CAnalyser(workspace)
         c_compiler = CCompiler(
-            'gcc', ['-c'], workspace
+            'gcc', ['-c'], workspace, cache, layout
         )
 
-        linker = Linker(
-            'gcc', ['-lc', '-lgfortran'] + ld_flags.split(),
-            workspace, exec_name
-        )
+        linkers: Dict[str, Linker] = {
+            name: Linker(
+                'gcc', ['-lc', '-lgfortran'] + self.ld_flags.split(),
+                workspace, executable, 'ar' if self.archive else None
+            )
+            for name, executable in zip(self.targets, self.exec_names)
+        }
+        linker = linkers[self.targets[0]]
 
         # The Task map tells the engine what Task it should be using
         # to deal with Artifacts depending on their type and state
-        task_map = {
+        task_map: Dict[Tuple[Type[FileType], Type[State]], Task] = {
             (FortranSource, Seen): fortran_preprocessor,
             (FortranSource, Raw): fortran_analyser,
             (FortranSource, Analysed): fortran_compiler,
@@ -172,27 +394,249 @@ class Fab(object):
             (CSource, Analysed): c_compiler,
             (BinaryObject, Compiled): linker,
         }
+        return task_map, linkers, cache, layout
+
+    def engine(self,
+               task_map: Mapping[Tuple[Type[FileType], Type[State]], Task],
+               linkers: Mapping[str, Task]) -> Engine:
+        return Engine(self.workspace,
+                      self.targets,
+                      self.path_maps(),
+                      task_map,
+                      self.incremental,
+                      self.batch_size,
+                      linkers,
+                      self.trust_stat)
+
+
+class Fab(object):
+    def __init__(self,
+                 workspace: Path,
+                 target: Union[str, Sequence[str]],
+                 exec_name: Union[str, Sequence[str]],
+                 fpp_flags: str,
+                 fc_flags: str,
+                 ld_flags: str,
+                 n_procs: Optional[int],
+                 critical_path: bool = False,
+                 incremental: bool = False,
+                 trust_stat: bool = False,
+                 prune: bool = False,
+                 batch_size: int = 1,
+                 archive: bool = False,
+                 layout: str = 'flat',
+                 hash_algorithm: str = 'adler32',
+                 cache: Optional[Path] = None,
+                 cache_size: int = 1024 ** 3,
+                 max_load: float = 1.0,
+                 min_memory: int = 512 * 1024 ** 2,
+                 remotes: Sequence[RemoteWorker] = (),
+                 trace: Optional[Path] = None):
+        """
+        :param target: Program unit or symbol to build an executable for,
+                       or several of them. Anything they have in common is
+                       compiled once and their executables are linked side
+                       by side.
+        :param exec_name: Name of the executable for each target.
+        :param archive: Link from static archives which are kept up to
+                        date between builds, rather than from every object.
+        :param layout: "flat" to put every file produced in the top of the
+                       workspace or "tree" to mirror the source tree.
+        :param hash_algorithm: How files are hashed, one of
+                               HASH_ALGORITHMS. Files last hashed another
+                               way are taken to have changed.
+        :param trust_stat: Take files which look untouched since they were
+                           last hashed, going by their modification time,
+                           size and inode, to be unchanged without reading
+                           them.
+        :param prune: Leave out unchanged files which the target did not
+                      need in the previous build. Should a file which has
+                      changed turn out to need one it is brought back.
+        :param n_procs: Processors to use, one of which coordinates. If
+                        None the work in progress is varied to suit the load
+                        on the machine, up to a worker per processor.
+        :param max_load: Load average per processor above which less work
+                         is taken on, when varying the work in progress.
+        :param min_memory: Bytes of available memory below which less work
+                           is taken on, when varying the work in progress.
+        :param remotes: Workers on other machines to share compilation
+                        with.
+        :param trace: File to write a timeline of the build to.
+        """
+
+        targets = [target] if isinstance(target, str) else list(target)
+        exec_names = [exec_name] if isinstance(exec_name, str) \
+            else list(exec_name)
+        if len(exec_names) != len(targets):
+            raise FabException('An executable name is needed for each target')
+
+        # Worker processes choose it for themselves, from the recipe
+        use_hash_algorithm(hash_algorithm)
+
+        self._workspace = workspace
+        self._targets = targets
+        self._prune = prune
+        self._pruning: Optional[TargetPruning] = None
+        self._pruned: List[Artifact] = []
+        if not workspace.exists():
+            workspace.mkdir(parents=True)
+
+        self._state = SqliteStateDatabase(workspace)
+
+        self._recipe = EngineRecipe(workspace,
+                                    targets,
+                                    exec_names,
+                                    fpp_flags,
+                                    fc_flags,
+                                    ld_flags,
+                                    incremental=incremental,
+                                    trust_stat=trust_stat,
+                                    batch_size=batch_size,
+                                    archive=archive,
+                                    layout=layout,
+                                    cache=cache,
+                                    cache_size=cache_size,
+                                    hash_algorithm=hash_algorithm)
+        task_map, linkers, self._cache, self._layout = self._recipe.tasks()
+
+        # The records are only checked here, being forgotten on a change of
+        # settings when the build is run
+        self._settings = self._recipe.settings
+        if not DerivedFileDatabase(self._state) \
+                .settings_match(self._settings):
+            self._recipe.incremental = False
+        self._planner = Planner(workspace,
+                                targets,
+                                self._recipe.path_maps(),
+                                task_map,
+                                self._recipe.incremental,
+                                linkers,
+                                trust_stat)
 
-        engine = Engine(workspace,
-                        target,
-                        path_maps,
-                        task_map)
-        self._queue = QueueManager(n_procs - 1, engine)
+        self._unchanged: Set[Path] = set()
+        self._engine = self._recipe.engine(task_map, linkers)
+        ranking = None
+        if critical_path:
+            ranking = CriticalPath(self._analysed_units())
+        governor = None
+        if n_procs is None:
+            governor = LoadGovernor(os.cpu_count() or 1,
+                                    max_load=max_load,
+                                    min_memory=min_memory)
+            n_workers = governor.ceiling
+        else:
+            n_workers = n_procs - 1
+        self._trace_file = trace
+        self._trace: Optional[Trace] = None
+        if trace is not None:
+            self._trace = Trace()
+        self._queue = QueueManager(n_workers,
+                                   self._engine,
+                                   ranking,
+                                   governor,
+                                   remotes,
+                                   self._trace,
+                                   bootstrap=self._recipe)
+
+    def _analysed_units(self) -> Iterator[Tuple[str, Path, List[str]]]:
+        for fortran_info in FortranWorkingState(self._state):
+            yield (fortran_info.unit.name,
+                   fortran_info.unit.found_in,
+                   fortran_info.depends_on)
+        for c_info in CWorkingState(self._state):
+            yield (c_info.symbol.name,
+                   c_info.symbol.found_in,
+                   c_info.depends_on)
+
+    def _target_pruning(self) -> TargetPruning:
+        derived = DerivedFileDatabase(self._state)
+        return TargetPruning(self._targets,
+                             self._analysed_units(),
+                             ((source, info.filename, info.state)
+                              for source, info in derived))
 
     def _extend_queue(self, artifact: Artifact) -> None:
+        if self._pruning is not None \
+                and not self._pruning.needs(artifact.location) \
+                and artifact.location in self._unchanged:
+            self._pruned.append(artifact)
+            return
         self._queue.add_to_queue(artifact)
 
-    def run(self, source: Path):
+    def plan(self, source: Path) -> BuildPlan:
+        """
+        Works out what running the build would do, without doing it.
+        """
+        pruning = self._target_pruning() if self._prune else None
+        return self._planner.plan(source, self._analysed_units(), pruning)
 
-        self._queue.run()
+    def run(self, source: Path):
+        DerivedFileDatabase(self._state).check_settings(self._settings)
+        self._recipe.source = source
+        if isinstance(self._layout, TreeLayout):
+            self._layout.source = source
+        if self._prune:
+            self._pruning = self._target_pruning()
 
-        visitor = SourceVisitor(self._extend_queue)
+        # Every file is hashed as the tree is descended, so what has changed
+        # is known before any work is scheduled
         descender = TreeDescent(source)
-        descender.descend(visitor)
+        artifacts, unchanged = self._engine.survey(descender.files())
+        self._unchanged = set(unchanged)
+        if self._recipe.incremental:
+            self._queue.unchanged(unchanged)
+
+        self._queue.run()
+        for artifact in artifacts:
+            self._extend_queue(artifact)
 
         self._queue.check_queue_done()
+
+        # Files left out which changes elsewhere have come to need are
+        # brought back, along with whatever they in turn need
+        while self._pruning is not None and self._pruned:
+            unresolved = self._queue.unresolved()
+            admitted = [artifact for artifact in self._pruned
+                        if self._pruning.provides(artifact.location,
+                                                  unresolved)]
+            if not admitted:
+                break
+            for artifact in admitted:
+                self._pruned.remove(artifact)
+                self._queue.add_to_queue(artifact)
+            self._queue.check_queue_done()
+        if self._pruning is not None:
+            logging.getLogger(__name__).info(
+                'Left out %d files not needed by any target',
+                len(self._pruned))
+
         self._queue.shutdown()
 
+        if self._trace_file is not None and self._trace is not None:
+            self._trace.write(self._trace_file)
+
+        if self._cache is not None:
+            statistics = self._cache.statistics()
+            logging.getLogger(__name__).info(
+                'Object cache holds %d entries in %d bytes, '
+                '%d hits and %d misses to date',
+                statistics.entries, statistics.size,
+                statistics.hits, statistics.misses)
+
+        # Anything which failed leaves whatever depends on it held back, so
+        # the targets cannot have been built
+        failures = self._queue.failures()
+        blocked = self._queue.blocked()
+        if failures or blocked:
+            reasons = [f'{location}: {error}'
+                       for location, error in failures]
+            reasons.extend(
+                '{0}: waiting on {1}'.format(
+                    location,
+                    ', '.join(sorted(str(item) for item in outstanding)))
+                for location, outstanding in sorted(blocked.items()))
+            raise FabException('Build failed\n  ' + '\n  '.join(reasons))
+
         file_db = FileInfoDatabase(self._state)
         for file_info in file_db:
             print(file_info.filename)
@@ -201,7 +645,7 @@ class Fab(object):
             if file_info.filename.match(f'{self._workspace}/*'):
                 print('    hash: --hidden-- (generated file)')
             else:
-                print(f'    hash: {file_info.adler32}')
+                print(f'    hash: {file_info.hash}')
 
         fortran_db = FortranWorkingState(self._state)
         for fortran_info in fortran_db:
@@ -0,0 +1,319 @@
+##############################################################################
+# (c) Crown copyright Met Office. All rights reserved.
+# For further details please refer to the file COPYRIGHT
+# which you should have received as part of this distribution
+##############################################################################
+'''
+Compiled objects kept between builds and shared between workspaces.
+'''
+import hashlib
+import logging
+import os
+from pathlib import Path
+import re
+import shutil
+import subprocess
+import tempfile
+import time
+from typing import Dict, List, Match, Optional, Sequence
+
+from fab.database import \
+    DatabaseDecorator, \
+    SqliteStateDatabase, \
+    StateDatabase
+from fab.reader import read_source
+
+
+# Line markers left by the C preprocessor, such as
+#   # 12 "/path/to/file.h" 2
+# or the #line directive.
+#
+_LINE_MARKER = re.compile(rb'^(#(?:line)?[ \t]*\d+[ \t]+")([^"\n]*)"',
+                          re.MULTILINE)
+
+
+def _strip_directory(match: Match[bytes]) -> bytes:
+    return match.group(1) + match.group(2).rsplit(b'/', 1)[-1] + b'"'
+
+
+class CacheStatistics(object):
+    def __init__(self, hits: int, misses: int, entries: int, size: int):
+        self.hits = hits
+        self.misses = misses
+        self.entries = entries
+        self.size = size
+
+    def __eq__(self, other):
+        if not isinstance(other, CacheStatistics):
+            message = 'Cannot compare CacheStatistics with none ' \
+                      'CacheStatistics'
+            raise ValueError(message)
+        return (other.hits == self.hits) \
+            and (other.misses == self.misses) \
+            and (other.entries == self.entries) \
+            and (other.size == self.size)
+
+
+class ObjectCacheDatabase(DatabaseDecorator):
+    """
+    Index of the cache entries along with when they were last used.
+    """
+    KEY_LENGTH = 64
+
+    def __init__(self, database: StateDatabase):
+        super().__init__(database)
+
+        queries = [f'''create table if not exists cache_entry (
+                          key character({self.KEY_LENGTH}) primary key,
+                          size integer not null,
+                          last_used real not null
+                          )''',
+                   '''create index if not exists idx_cache_entry_last_used
+                          on cache_entry(last_used)''',
+                   '''create table if not exists cache_statistic (
+                          name character(16) primary key,
+                          count integer not null
+                          )''',
+                   '''insert or ignore into cache_statistic (name, count)
+                          values ('hits', 0), ('misses', 0)''']
+        self.execute(queries, {})
+
+    def use_entry(self, key: str) -> bool:
+        """
+        Notes the use of an entry, keeping it from eviction a while longer.
+
+        :return: Whether the entry is known.
+        """
+        self.execute('''update cache_entry set last_used = :now
+                        where key = :key''',
+                     {'key': key, 'now': str(time.time())})
+        rows = self.execute('select key from cache_entry where key = :key',
+                            {'key': key})
+        return len(list(rows)) > 0
+
+    def add_entry(self, key: str, size: int) -> None:
+        self.execute('''insert or replace into cache_entry
+                          (key, size, last_used)
+                        values (:key, :size, :now)''',
+                     {'key': key,
+                      'size': str(size),
+                      'now': str(time.time())})
+
+    def remove_entry(self, key: str) -> None:
+        self.execute('delete from cache_entry where key = :key',
+                     {'key': key})
+
+    def least_recently_used(self, max_size: int) -> List[str]:
+        """
+        :return: Entries, oldest first, which must go for the cache to fit.
+        """
+        rows = self.execute('''select key, size from cache_entry
+                               order by last_used desc''', {})
+        evict: List[str] = []
+        total = 0
+        for row in rows:
+            total += int(row['size'])
+            if total > max_size:
+                evict.append(row['key'])
+        evict.reverse()
+        return evict
+
+    def count(self, name: str) -> None:
+        self.execute('''update cache_statistic set count = count + 1
+                        where name = :name''',
+                     {'name': name})
+
+    def get_statistics(self) -> CacheStatistics:
+        rows = self.execute('select name, count from cache_statistic', {})
+        counts = {row['name']: int(row['count']) for row in rows}
+        row = next(self.execute('''select count(key) as entries,
+                                          total(size) as size
+                                   from cache_entry''', {}))
+        return CacheStatistics(counts.get('hits', 0),
+                               counts.get('misses', 0),
+                               int(row['entries']),
+                               int(row['size']))
+
+
+class ObjectCache(object):
+    """
+    Content addressed store of the results of compilation.
+
+    Entries are keyed on everything which affects the result of compiling a
+    file: the compiler, its version and flags, the file itself and any
+    module files it uses. A compilation with a matching key may take the
+    results from the cache rather than running the compiler.
+
+    The cache is kept within a size limit by discarding the least recently
+    used entries. Any number of builds may use a cache at the same time.
+    """
+    # Within an entry the object file is stored under a fixed name, module
+    # files under their own.
+    #
+    OBJECT_NAME = 'object.o'
+
+    def __init__(self, directory: Path, max_size: int):
+        """
+        :param directory: Where the cache is kept.
+        :param max_size: Limit on the size of the cache in bytes.
+        """
+        self._directory = directory
+        self._max_size = max_size
+        self._versions: Dict[str, str] = {}
+
+        # Database connections must not be shared between processes so
+        # each one makes its own on first use.
+        #
+        self._database: Optional[ObjectCacheDatabase] = None
+        self._pid: Optional[int] = None
+
+    @property
+    def directory(self) -> Path:
+        return self._directory
+
+    def key(self,
+            compiler: str,
+            flags: Sequence[str],
+            source: Path,
+            prerequisites: Sequence[Path] = (),
+            line_markers: bool = False) -> str:
+        """
+        Identifies a compilation by everything which goes into it.
+
+        :param compiler: Compiler command.
+        :param flags: Arguments to the compiler. These should not include
+                      anything specific to a particular workspace.
+        :param source: File being compiled.
+        :param prerequisites: Module files used by the compilation. Those
+                              which do not exist are taken to be provided
+                              by the compiler.
+        :param line_markers: Whether the source is preprocessor output whose
+                             line markers name files by their path. Only the
+                             last part of each name is taken into account so
+                             that the same file preprocessed in different
+                             places has the same key.
+        :return: Key for the compilation.
+        """
+        digest = hashlib.sha256()
+
+        def add(item: bytes) -> None:
+            digest.update(str(len(item)).encode())
+            digest.update(b':')
+            digest.update(item)
+
+        add((shutil.which(compiler) or compiler).encode())
+        add(self._version(compiler).encode())
+        for flag in flags:
+            add(flag.encode())
+        content = read_source(source)
+        if line_markers:
+            content = _LINE_MARKER.sub(_strip_directory, content)
+        add(content)
+        for prerequisite in sorted(prerequisites):
+            add(prerequisite.name.encode())
+            if prerequisite.exists():
+                add(read_source(prerequisite))
+        return digest.hexdigest()
+
+    def fetch(self,
+              key: str,
+              object_file: Path,
+              module_directory: Path) -> bool:
+        """
+        Copies the results of a compilation out of the cache.
+
+        :param key: Compilation to look for.
+        :param object_file: Where the object file should be put.
+        :param module_directory: Where any module files should be put.
+        :return: Whether the compilation was found.
+        """
+        database = self._get_database()
+        entry = self._entry(key)
+        found = database.use_entry(key)
+        if found:
+            try:
+                for cached in sorted(entry.iterdir()):
+                    if cached.name == self.OBJECT_NAME:
+                        destination = object_file
+                    else:
+                        destination = module_directory / cached.name
+                    shutil.copyfile(str(cached), str(destination))
+            except FileNotFoundError:
+                # Evicted while we were looking at it
+                found = False
+        database.count('hits' if found else 'misses')
+        return found
+
+    def store(self,
+              key: str,
+              object_file: Path,
+              module_files: Sequence[Path] = ()) -> None:
+        """
+        Copies the results of a compilation into the cache.
+
+        :param key: Compilation the results came from.
+        :param object_file: Object file produced.
+        :param module_files: Module files produced.
+        """
+        database = self._get_database()
+        entry = self._entry(key)
+        entry.parent.mkdir(parents=True, exist_ok=True)
+
+        # Entries are assembled off to one side then moved into place, so
+        # they are never seen incomplete.
+        #
+        staging = Path(tempfile.mkdtemp(dir=str(self._directory)))
+        try:
+            size = 0
+            for source, name in \
+                    [(object_file, self.OBJECT_NAME)] \
+                    + [(module, module.name) for module in module_files]:
+                shutil.copyfile(str(source), str(staging / name))
+                size += source.stat().st_size
+            try:
+                staging.rename(entry)
+            except OSError:
+                pass  # Already stored by somebody else
+            database.add_entry(key, size)
+        finally:
+            if staging.exists():
+                shutil.rmtree(str(staging))
+
+        for evicted in database.least_recently_used(self._max_size):
+            database.remove_entry(evicted)
+            # Moved aside first so nobody copies out a partial entry
+            #
+            doomed = Path(tempfile.mkdtemp(dir=str(self._directory)))
+            try:
+                self._entry(evicted).rename(doomed / evicted)
+            except OSError:
+                pass  # Already gone
+            shutil.rmtree(str(doomed), ignore_errors=True)
+
+    def statistics(self) -> CacheStatistics:
+        return self._get_database().get_statistics()
+
+    def _entry(self, key: str) -> Path:
+        return self._directory / 'objects' / key[:2] / key
+
+    def _version(self, compiler: str) -> str:
+        if compiler not in self._versions:
+            try:
+                process = subprocess.run([compiler, '--version'],
+                                         stdout=subprocess.PIPE,
+                                         stderr=subprocess.DEVNULL,
+                                         universal_newlines=True)
+                self._versions[compiler] = process.stdout
+            except OSError as err:
+                logging.getLogger(__name__).warning(
+                    'Unable to determine version of "%s": %s', compiler, err)
+                self._versions[compiler] = ''
+        return self._versions[compiler]
+
+    def _get_database(self) -> ObjectCacheDatabase:
+        if self._database is None or self._pid != os.getpid():
+            self._directory.mkdir(parents=True, exist_ok=True)
+            self._database \
+                = ObjectCacheDatabase(SqliteStateDatabase(self._directory))
+            self._pid = os.getpid()
+        return self._database
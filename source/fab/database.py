@@ -7,11 +7,24 @@
 Working state which is either per-build or persistent between builds.
 '''
 from abc import ABC, abstractmethod
+import os
 from pathlib import Path
 import sqlite3
-from typing import Dict, Iterator, Optional, Sequence, Union
+import threading
+import time
+from typing import \
+    Dict, \
+    Iterable, \
+    Iterator, \
+    List, \
+    Optional, \
+    Sequence, \
+    Set, \
+    Tuple, \
+    Union
 
 from fab import FabException
+from fab.artifact import hash_algorithm
 
 
 class WorkingStateException(Exception):
@@ -19,15 +32,42 @@ class WorkingStateException(Exception):
 
 
 class FileInfo(object):
-    def __init__(self, filename: Path, adler32: int):
+    def __init__(self,
+                 filename: Path,
+                 hash: int,
+                 algorithm: str = 'adler32',
+                 mtime: Optional[int] = None,
+                 size: Optional[int] = None,
+                 inode: Optional[int] = None):
+        """
+        :param mtime: Modification time of the file in nanoseconds when it
+                      was hashed, if it may be trusted.
+        :param size: Size of the file in bytes when it was hashed.
+        :param inode: Inode of the file when it was hashed.
+        """
         self.filename = filename
-        self.adler32 = adler32
+        self.hash = hash
+        self.algorithm = algorithm
+        self.mtime = mtime
+        self.size = size
+        self.inode = inode
 
     def __eq__(self, other):
         if not isinstance(other, FileInfo):
             raise ValueError('Cannot compare FileInfo with none FileInfo')
         return (str(other.filename) == str(self.filename)) \
-            and (other.adler32 == self.adler32)
+            and (other.hash == self.hash) \
+            and (other.algorithm == self.algorithm)
+
+    def matches_stat(self, status: os.stat_result) -> bool:
+        """
+        Whether the file looks untouched since it was hashed, going by its
+        modification time, size and inode.
+        """
+        return self.mtime is not None \
+            and self.mtime == status.st_mtime_ns \
+            and self.size == status.st_size \
+            and self.inode == status.st_ino
 
 
 class DatabaseRows(Iterator[Dict[str, str]]):
@@ -50,6 +90,14 @@ class StateDatabase(ABC):
                 inserts: Dict[str, str]) -> DatabaseRows:
         raise NotImplementedError('Abstract methods must be implemented.')
 
+    @abstractmethod
+    def execute_many(self, query: Union[Sequence[str], str],
+                     inserts: Sequence[Dict[str, Optional[str]]]) -> None:
+        """
+        Runs queries once for each set of inserts, all in one transaction.
+        """
+        raise NotImplementedError('Abstract methods must be implemented.')
+
 
 class DatabaseDecorator(StateDatabase):
     def __init__(self, database: StateDatabase):
@@ -59,6 +107,10 @@ class DatabaseDecorator(StateDatabase):
                 inserts: Dict[str, str]) -> DatabaseRows:
         return self._database.execute(query, inserts)
 
+    def execute_many(self, query: Union[Sequence[str], str],
+                     inserts: Sequence[Dict[str, Optional[str]]]) -> None:
+        self._database.execute_many(query, inserts)
+
 
 class FileInfoDatabase(DatabaseDecorator):
     # The Posix standard specifies a value PATH_MAX but requires only that it
@@ -70,40 +122,566 @@ class FileInfoDatabase(DatabaseDecorator):
     #
     PATH_LENGTH = 1024 * 4
 
+    # Files modified this recently may be modified again within the
+    # resolution of the file system's clock, leaving the modification time
+    # unchanged, so their metadata is not recorded.
+    #
+    RACY_SECONDS = 2.0
+
     def __init__(self, database: StateDatabase):
         super().__init__(database)
 
+        # Records from before the algorithm was noted cannot be compared
+        # with anything, so are started afresh
+        columns = [row['name'] for row
+                   in self.execute('pragma table_info(file_info)', {})]
+        if columns and 'algorithm' not in columns:
+            self.execute('drop table file_info', {})
+            columns = []
+
         queries = ['''create table if not exists file_info (
                           id integer primary key,
                           filename character({filename_length}) not null,
-                          adler32 integer not null
+                          hash integer not null,
+                          algorithm character(16) not null,
+                          mtime integer,
+                          size integer,
+                          inode integer
                           )'''.format(filename_length=self.PATH_LENGTH),
-                   '''create index if not exists idx_file_info_adler32
-                          on file_info(adler32)''']
+                   '''create index if not exists idx_file_info_filename
+                          on file_info(filename)''']
+        if columns:
+            queries.extend(f'alter table file_info add column {column} '
+                           'integer'
+                           for column in ['mtime', 'size', 'inode']
+                           if column not in columns)
         self.execute(queries, {})
 
+    @staticmethod
+    def _file_info(row: Dict[str, str]) -> FileInfo:
+        def optional(value: Optional[str]) -> Optional[int]:
+            return None if value is None else int(value)
+        return FileInfo(Path(row['filename']),
+                        int(row['hash']),
+                        row['algorithm'],
+                        optional(row['mtime']),
+                        optional(row['size']),
+                        optional(row['inode']))
+
     def __iter__(self) -> Iterator[FileInfo]:
-        query = ['select filename, adler32 from file_info order by filename']
+        query = ['''select filename, hash, algorithm, mtime, size, inode
+                    from file_info order by filename''']
         rows: DatabaseRows = self.execute(query, {})
         for row in rows:
-            yield FileInfo(Path(row['filename']), int(row['adler32']))
+            yield self._file_info(row)
+
+    def add_file_info(self,
+                      filename: Path,
+                      hash: int,
+                      algorithm: Optional[str] = None,
+                      status: Optional[os.stat_result] = None) -> None:
+        """
+        :param algorithm: How the hash was made, if not with the algorithm
+                          currently in use.
+        :param status: Status of the file taken before it was hashed, by
+                       which it may later be seen to be unchanged without
+                       hashing it again.
+        """
+        self._add([self._row(filename, hash, algorithm, status)])
+
+    def add_file_infos(self,
+                       files: Iterable[Tuple[Path, int, os.stat_result]]
+                       ) -> None:
+        """
+        Records many files at once, being much quicker than recording them
+        one at a time.
 
-    def add_file_info(self, filename: Path, adler32: int) -> None:
+        :param files: Name, hash, by the algorithm currently in use, and
+                      status taken before it was hashed of each file.
+        """
+        self._add([self._row(filename, hash, None, status)
+                   for filename, hash, status in files])
+
+    def _row(self,
+             filename: Path,
+             hash: int,
+             algorithm: Optional[str],
+             status: Optional[os.stat_result]) -> Dict[str, Optional[str]]:
+        row: Dict[str, Optional[str]] = {
+            'filename': str(filename),
+            'hash': str(hash),
+            'algorithm': algorithm or hash_algorithm(),
+            'mtime': None,
+            'size': None,
+            'inode': None
+        }
+        if status is not None \
+                and time.time() - status.st_mtime > self.RACY_SECONDS:
+            row.update({'mtime': str(status.st_mtime_ns),
+                        'size': str(status.st_size),
+                        'inode': str(status.st_ino)})
+        return row
+
+    def _add(self, rows: Sequence[Dict[str, Optional[str]]]) -> None:
         queries = ['delete from file_info where filename=:filename',
-                   '''insert into file_info (filename, adler32)
-                         values (:filename, :adler32)''']
-        self.execute(queries,
-                     {'filename': str(filename),
-                      'adler32': str(adler32)})
+                   '''insert into file_info
+                          (filename, hash, algorithm, mtime, size, inode)
+                          values (:filename, :hash, :algorithm,
+                                  :mtime, :size, :inode)''']
+        self.execute_many(queries, rows)
 
     def get_file_info(self, filename: Path) -> FileInfo:
-        queries = ['''select filename, adler32 from file_info
-                      where filename = :filename order by filename''']
+        """
+        A file hashed with an algorithm other than the one currently in use
+        is treated as not being in the database.
+        """
+        queries = ['''select filename, hash, algorithm, mtime, size, inode
+                      from file_info
+                      where filename = :filename and algorithm = :algorithm
+                      order by filename''']
         try:
-            row = next(self.execute(queries, {'filename': str(filename)}))
+            row = next(self.execute(queries,
+                                    {'filename': str(filename),
+                                     'algorithm': hash_algorithm()}))
         except StopIteration:
             raise FabException(f"file '{filename}' not in database")
-        return FileInfo(Path(row['filename']), int(row['adler32']))
+        return self._file_info(row)
+
+
+class DerivedFile(object):
+    def __init__(self, filename: Path, filetype: str, state: str):
+        self.filename = filename
+        self.filetype = filetype
+        self.state = state
+
+    def __eq__(self, other):
+        if not isinstance(other, DerivedFile):
+            message = 'Cannot compare DerivedFile with none DerivedFile'
+            raise ValueError(message)
+        return (str(other.filename) == str(self.filename)) \
+            and (other.filetype == self.filetype) \
+            and (other.state == self.state)
+
+
+class DerivedFileDatabase(DatabaseDecorator):
+    """
+    Records the files each task produced from the file it was given.
+
+    This allows the results of a previous build to be reused when nothing
+    has changed. The records are only valid for the build settings they were
+    made with, so a change of settings forgets them all.
+
+    Records may be marked stale, when what they were produced from is
+    changing, rather than forgotten. Stale records cannot be reused but
+    should what they were produced from turn out the same after all they
+    may be revived.
+    """
+    # File types and states are recorded by class name.
+    #
+    NAME_LENGTH = 63
+
+    def __init__(self, database: StateDatabase):
+        super().__init__(database)
+
+        queries = [f'''create table if not exists derived_file (
+                          id integer primary key,
+                          source character({FileInfoDatabase.PATH_LENGTH})
+                              not null,
+                          source_state character({self.NAME_LENGTH}) not null,
+                          filename character({FileInfoDatabase.PATH_LENGTH})
+                              not null,
+                          filetype character({self.NAME_LENGTH}) not null,
+                          state character({self.NAME_LENGTH}) not null,
+                          stamp character({self.NAME_LENGTH}) not null
+                          )''',
+                   '''create index if not exists idx_derived_file_source
+                          on derived_file(source, source_state)''',
+                   f'''create table if not exists derived_prerequisite (
+                          id integer primary key,
+                          source character({FileInfoDatabase.PATH_LENGTH})
+                              not null,
+                          prerequisite character({self.NAME_LENGTH})
+                              not null,
+                          stamp character({self.NAME_LENGTH}) not null
+                          )''',
+                   '''create index if not exists idx_derived_prerequisite
+                          on derived_prerequisite(source)''',
+                   f'''create table if not exists derived_stale (
+                          id integer primary key,
+                          source character({FileInfoDatabase.PATH_LENGTH})
+                              not null,
+                          source_state character({self.NAME_LENGTH}) not null
+                          )''',
+                   '''create index if not exists idx_derived_stale
+                          on derived_stale(source, source_state)''',
+                   '''create table if not exists derived_settings (
+                          settings text not null
+                          )''']
+        self.execute(queries, {})
+
+    def __iter__(self) -> Iterator[Tuple[Path, DerivedFile]]:
+        """
+        :return: Each file given to a task along with a file it produced.
+        """
+        query = '''select source, filename, filetype, state
+                   from derived_file order by id'''
+        rows = self.execute(query, {})
+        for row in rows:
+            yield (Path(row['source']),
+                   DerivedFile(Path(row['filename']),
+                               row['filetype'],
+                               row['state']))
+
+    def settings_match(self, settings: str) -> bool:
+        """
+        :param settings: Description of the current build settings.
+        :return: Whether the records were made with these settings.
+        """
+        rows = self.execute('select settings from derived_settings', {})
+        return [row['settings'] for row in rows] == [settings]
+
+    def check_settings(self, settings: str) -> bool:
+        """
+        Forgets all records if they were made with different settings.
+
+        :param settings: Description of the current build settings.
+        :return: Whether the existing records remain valid.
+        """
+        if self.settings_match(settings):
+            return True
+        queries = ['delete from derived_file',
+                   'delete from derived_prerequisite',
+                   'delete from derived_stale',
+                   'delete from derived_settings',
+                   '''insert into derived_settings (settings)
+                         values (:settings)''']
+        self.execute(queries, {'settings': settings})
+        return False
+
+    def add_derived_files(self,
+                          source: Path,
+                          source_state: str,
+                          derived: Sequence[DerivedFile],
+                          stamp: str = '') -> None:
+        """
+        Records the files produced from a source file in a given state.
+
+        :param source: File given to the task.
+        :param source_state: State of that file when it was given.
+        :param derived: Files produced by the task.
+        :param stamp: Identifies this particular production of the files,
+                      where that is of interest.
+        """
+        self.execute(['''delete from derived_file
+                         where source = :source
+                         and source_state = :source_state''',
+                      '''delete from derived_stale
+                         where source = :source
+                         and source_state = :source_state'''],
+                     {'source': str(source), 'source_state': source_state})
+        for derived_file in derived:
+            self.execute('''insert into derived_file
+                              (source, source_state,
+                               filename, filetype, state, stamp)
+                            values (:source, :source_state,
+                                    :filename, :filetype, :state, :stamp)''',
+                         {'source': str(source),
+                          'source_state': source_state,
+                          'filename': str(derived_file.filename),
+                          'filetype': derived_file.filetype,
+                          'state': derived_file.state,
+                          'stamp': stamp})
+
+    def get_derived_files(self,
+                          source: Path,
+                          source_state: str,
+                          stale: bool = False) -> List[DerivedFile]:
+        """
+        :param stale: Include stale records, which are otherwise as good as
+                      forgotten.
+        """
+        inserts = {'source': str(source), 'source_state': source_state}
+        if not stale and self._is_stale(inserts):
+            return []
+        query = '''select filename, filetype, state from derived_file
+                   where source = :source and source_state = :source_state
+                   order by id'''
+        rows = self.execute(query, inserts)
+        return [DerivedFile(Path(row['filename']),
+                            row['filetype'],
+                            row['state'])
+                for row in rows]
+
+    def get_stamp(self, source: Path, source_state: str) -> str:
+        """
+        :return: Stamp of the files last produced, even if they are stale.
+        """
+        query = '''select stamp from derived_file
+                   where source = :source and source_state = :source_state'''
+        try:
+            row = next(self.execute(query, {'source': str(source),
+                                            'source_state': source_state}))
+        except StopIteration:
+            return ''
+        return row['stamp']
+
+    def add_prerequisite_stamps(self,
+                                source: Path,
+                                stamps: Dict[str, str]) -> None:
+        """
+        Records the particular prerequisites a file was produced against.
+
+        :param source: File given to the task.
+        :param stamps: Stamp of each prerequisite when the task was run.
+        """
+        self.execute('delete from derived_prerequisite where source = :source',
+                     {'source': str(source)})
+        for prerequisite, stamp in stamps.items():
+            self.execute('''insert into derived_prerequisite
+                              (source, prerequisite, stamp)
+                            values (:source, :prerequisite, :stamp)''',
+                         {'source': str(source),
+                          'prerequisite': prerequisite,
+                          'stamp': stamp})
+
+    def get_prerequisite_stamps(self, source: Path) -> Dict[str, str]:
+        query = '''select prerequisite, stamp from derived_prerequisite
+                   where source = :source'''
+        rows = self.execute(query, {'source': str(source)})
+        return {row['prerequisite']: row['stamp'] for row in rows}
+
+    def mark_stale(self, source: Path, source_state: str) -> None:
+        """
+        Marks what was produced from a file, directly or indirectly, as
+        stale.
+
+        :param source: File which is being reprocessed.
+        :param source_state: State of that file when it is reprocessed.
+        """
+        for inserts in self._produced_from(source, source_state):
+            if not self._is_stale(inserts):
+                self.execute('''insert into derived_stale
+                                  (source, source_state)
+                                values (:source, :source_state)''',
+                             inserts)
+
+    def revive(self, source: Path, source_state: str) -> None:
+        """
+        Undoes the marking of what was produced from a file as stale.
+
+        :param source: File which has been reprocessed with the same result
+                       as before.
+        :param source_state: State of that file when it was reprocessed.
+        """
+        for inserts in self._produced_from(source, source_state):
+            self.execute('''delete from derived_stale
+                            where source = :source
+                            and source_state = :source_state''',
+                         inserts)
+
+    def _is_stale(self, inserts: Dict[str, str]) -> bool:
+        rows = self.execute('''select id from derived_stale
+                               where source = :source
+                               and source_state = :source_state''',
+                            inserts)
+        return next(rows, None) is not None
+
+    def _produced_from(self,
+                       source: Path,
+                       source_state: str) -> List[Dict[str, str]]:
+        # The record of a file along with those of everything produced from
+        # it in turn, each file being known by the state it was produced in
+        found: List[Dict[str, str]] = []
+        to_visit = [(str(source), source_state)]
+        while to_visit:
+            filename, state = to_visit.pop()
+            inserts = {'source': filename, 'source_state': state}
+            if inserts in found:
+                continue
+            found.append(inserts)
+            rows = self.execute('''select filename, state from derived_file
+                                   where source = :source
+                                   and source_state = :source_state''',
+                                inserts)
+            to_visit.extend((row['filename'], row['state']) for row in rows)
+        return found
+
+    def remove_derived_files(self, source: Path, source_state: str) -> None:
+        """
+        Forgets everything produced from a file, directly or indirectly.
+
+        :param source: File which is about to be reprocessed.
+        :param source_state: State of that file when it is reprocessed.
+        """
+        inserts = {'source': str(source), 'source_state': source_state}
+        rows = self.execute('''select filename from derived_file
+                               where source = :source
+                               and source_state = :source_state''',
+                            inserts)
+        to_remove = [row['filename'] for row in rows]
+        self.execute('''delete from derived_file
+                        where source = :source
+                        and source_state = :source_state''',
+                     inserts)
+
+        # Whatever was produced from those files, in whatever state, goes too
+        #
+        removed: Set[str] = set()
+        while to_remove:
+            filename = to_remove.pop()
+            if filename in removed:
+                continue
+            removed.add(filename)
+            rows = self.execute('''select filename from derived_file
+                                   where source = :source''',
+                                {'source': filename})
+            to_remove.extend(row['filename'] for row in rows)
+            self.execute(['delete from derived_file where source = :source',
+                          '''delete from derived_prerequisite
+                             where source = :source''',
+                          'delete from derived_stale where source = :source'],
+                         {'source': filename})
+
+
+class TaskMetric(object):
+    """
+    Cost of running a task on a file.
+    """
+    def __init__(self,
+                 filename: Path,
+                 stage: str,
+                 wall: float,
+                 cpu: float,
+                 peak_rss: int,
+                 bytes_read: int,
+                 bytes_written: int,
+                 shared_by: int = 1):
+        """
+        :param filename: File the task was run on.
+        :param stage: Name of the task.
+        :param wall: Seconds the run took.
+        :param cpu: Seconds of processor time used by the task and any
+                    programs it ran.
+        :param peak_rss: Most bytes of memory used at once by any program
+                         the task ran.
+        :param bytes_read: Bytes read by the task and its programs.
+        :param bytes_written: Bytes written by the task and its programs.
+        :param shared_by: Number of files the run was shared between, the
+                          costs having been divided evenly between them.
+        """
+        self.filename = filename
+        self.stage = stage
+        self.wall = wall
+        self.cpu = cpu
+        self.peak_rss = peak_rss
+        self.bytes_read = bytes_read
+        self.bytes_written = bytes_written
+        self.shared_by = shared_by
+
+    def __eq__(self, other):
+        if not isinstance(other, TaskMetric):
+            message = 'Cannot compare TaskMetric with none TaskMetric'
+            raise ValueError(message)
+        return (str(other.filename) == str(self.filename)) \
+            and (other.stage == self.stage) \
+            and (other.wall == self.wall) \
+            and (other.cpu == self.cpu) \
+            and (other.peak_rss == self.peak_rss) \
+            and (other.bytes_read == self.bytes_read) \
+            and (other.bytes_written == self.bytes_written) \
+            and (other.shared_by == self.shared_by)
+
+
+class MetricsDatabase(DatabaseDecorator):
+    """
+    Records what each task cost for each file over recent builds.
+    """
+    NAME_LENGTH = 63
+
+    # Runs remembered for each file and task.
+    #
+    HISTORY = 10
+
+    def __init__(self, database: StateDatabase):
+        super().__init__(database)
+
+        queries = [f'''create table if not exists task_metric (
+                          id integer primary key,
+                          filename character({FileInfoDatabase.PATH_LENGTH})
+                              not null,
+                          stage character({self.NAME_LENGTH}) not null,
+                          wall real not null,
+                          cpu real not null,
+                          peak_rss integer not null,
+                          bytes_read integer not null,
+                          bytes_written integer not null,
+                          shared_by integer not null
+                          )''',
+                   '''create index if not exists idx_task_metric_filename
+                          on task_metric(filename, stage)''']
+        self.execute(queries, {})
+
+    def add_metric(self, metric: TaskMetric) -> None:
+        inserts = {'filename': str(metric.filename),
+                   'stage': metric.stage,
+                   'wall': str(metric.wall),
+                   'cpu': str(metric.cpu),
+                   'peak_rss': str(metric.peak_rss),
+                   'bytes_read': str(metric.bytes_read),
+                   'bytes_written': str(metric.bytes_written),
+                   'shared_by': str(metric.shared_by),
+                   'history': str(self.HISTORY)}
+        self.execute(['''insert into task_metric
+                           (filename, stage, wall, cpu, peak_rss,
+                            bytes_read, bytes_written, shared_by)
+                         values (:filename, :stage, :wall, :cpu, :peak_rss,
+                                 :bytes_read, :bytes_written, :shared_by)''',
+                      '''delete from task_metric
+                         where filename = :filename and stage = :stage
+                         and id not in (select id from task_metric
+                                        where filename = :filename
+                                        and stage = :stage
+                                        order by id desc
+                                        limit :history)'''],
+                     inserts)
+
+    def get_metrics(self, filename: Path, stage: str) -> List[TaskMetric]:
+        """
+        :return: Costs of the remembered runs, most recent first.
+        """
+        rows = self.execute('''select * from task_metric
+                               where filename = :filename and stage = :stage
+                               order by id desc''',
+                            {'filename': str(filename), 'stage': stage})
+        return [self._metric(row) for row in rows]
+
+    def __iter__(self) -> Iterator[Tuple[TaskMetric, int, float]]:
+        """
+        :return: Most recent cost of each task on each file, along with the
+                 number of runs remembered and their mean wall time.
+        """
+        rows = self.execute('''select task_metric.*, runs, mean_wall
+                               from task_metric
+                               join (select max(id) as latest,
+                                            count(id) as runs,
+                                            avg(wall) as mean_wall
+                                     from task_metric
+                                     group by filename, stage)
+                                 on id = latest
+                               order by wall desc, filename, stage''', {})
+        for row in rows:
+            yield self._metric(row), int(row['runs']), float(row['mean_wall'])
+
+    @staticmethod
+    def _metric(row: Dict[str, str]) -> TaskMetric:
+        return TaskMetric(Path(row['filename']),
+                          row['stage'],
+                          float(row['wall']),
+                          float(row['cpu']),
+                          int(row['peak_rss']),
+                          int(row['bytes_read']),
+                          int(row['bytes_written']),
+                          int(row['shared_by']))
 
 
 class SqliteStateDatabase(StateDatabase):
@@ -115,18 +693,30 @@ class SqliteStateDatabase(StateDatabase):
     '''
     def __init__(self, working_directory: Path):
         self._working_directory: Path = working_directory
-        self._connection: Optional[sqlite3.Connection] = None
+        # SQLite connections may be shared neither between threads nor
+        # between processes so each gets its own.
+        #
+        self._local = threading.local()
 
     def __del__(self):
-        if self._connection is not None:
-            self._connection.close()
+        connection = self._current_connection()
+        if connection is not None:
+            connection.close()
+
+    def _current_connection(self) -> Optional[sqlite3.Connection]:
+        if getattr(self._local, 'pid', None) != os.getpid():
+            return None
+        return self._local.connection
 
     def _get_connection(self) -> sqlite3.Connection:
-        if self._connection is None:
-            self._connection \
+        connection = self._current_connection()
+        if connection is None:
+            connection \
                 = sqlite3.connect(str(self._working_directory / 'state.db'))
-            self._connection.row_factory = sqlite3.Row
-        return self._connection
+            connection.row_factory = sqlite3.Row
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
 
     def execute(self, query: Union[Sequence[str], str],
                 inserts: Dict[str, str]) -> DatabaseRows:
@@ -142,3 +732,17 @@ class SqliteStateDatabase(StateDatabase):
         connection.commit()
 
         return DatabaseRows(cursor)
+
+    def execute_many(self, query: Union[Sequence[str], str],
+                     inserts: Sequence[Dict[str, Optional[str]]]) -> None:
+        connection = self._get_connection()
+        if isinstance(query, str):
+            query_list: Sequence[str] = [query]
+        else:
+            query_list = query
+
+        # Each set of inserts has every query run for it before the next
+        for values in inserts:
+            for command in query_list:
+                connection.execute(command, values)
+        connection.commit()
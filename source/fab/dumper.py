@@ -10,7 +10,10 @@ import logging
 from pathlib import Path
 import sys
 
-from fab.database import FileInfoDatabase, SqliteStateDatabase
+from fab.database import \
+    FileInfoDatabase, \
+    MetricsDatabase, \
+    SqliteStateDatabase
 from fab.tasks.fortran import FortranWorkingState
 from fab.tasks.c import CWorkingState
 
@@ -40,6 +43,9 @@ def entry() -> None:
     parser.add_argument('-w', '--workspace', metavar='PATH', type=Path,
                         default=Path.cwd() / 'working',
                         help='Directory for working files.')
+    parser.add_argument('--metrics', action='store_true',
+                        help='Show what each task cost for each file, '
+                             'most costly first')
     arguments = parser.parse_args()
 
     if arguments.verbose:
@@ -48,7 +54,10 @@ def entry() -> None:
         logger.setLevel(logging.WARNING)
 
     application = Dump(arguments.workspace)
-    application.run()
+    if arguments.metrics:
+        application.run_metrics()
+    else:
+        application.run()
 
 
 class Dump(object):
@@ -66,7 +75,8 @@ class Dump(object):
             if file_info.filename.match(f'{self._workspace}/*'):
                 print('    Hash : --hidden-- (generated file)')
             else:
-                print(f"    Hash : {file_info.adler32}", file=stream)
+                print(f"    Hash : {file_info.hash}",
+                      file=stream)
 
         fortran_view = FortranWorkingState(self._state)
         header = False
@@ -89,3 +99,20 @@ class Dump(object):
             print(f"    Found in      : {info.symbol.found_in}", file=stream)
             print(f"    Prerequisites : {', '.join(info.depends_on)}",
                   file=stream)
+
+    def run_metrics(self, stream=sys.stdout):
+        metrics_view = MetricsDatabase(self._state)
+        print("Metrics View", file=stream)
+        for metric, runs, mean_wall in metrics_view:
+            print(f"  File            : {metric.filename}", file=stream)
+            print(f"    Stage         : {metric.stage}", file=stream)
+            print(f"    Wall time     : {metric.wall:.3f} s "
+                  f"(mean {mean_wall:.3f} s over {runs} runs)", file=stream)
+            print(f"    CPU time      : {metric.cpu:.3f} s", file=stream)
+            print(f"    Peak RSS      : {metric.peak_rss // 1024} KiB",
+                  file=stream)
+            print(f"    Bytes read    : {metric.bytes_read}", file=stream)
+            print(f"    Bytes written : {metric.bytes_written}", file=stream)
+            if metric.shared_by > 1:
+                print(f"    Shared by     : {metric.shared_by} files",
+                      file=stream)
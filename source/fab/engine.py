@@ -4,16 +4,24 @@
 # which you should have received as part of this distribution
 ##############################################################################
 
+from concurrent.futures import Future, ThreadPoolExecutor
+from enum import Enum, auto
+import logging
+import os
 import re
 from pathlib import Path
+import time
 from typing import \
+    Dict, \
+    Hashable, \
+    Iterable, \
     List, \
     Mapping, \
+    Optional, \
     Tuple, \
     Type, \
-    Dict
-from enum import Enum, auto
-from multiprocessing.synchronize import Lock as LockT
+    Union
+from uuid import uuid4
 
 from fab.artifact import \
     Artifact, \
@@ -23,17 +31,39 @@ from fab.artifact import \
     Unknown, \
     Analysed, \
     Compiled, \
-    Linked
-from fab.tasks import Task
+    Linked, \
+    file_hash, \
+    filetype_named, \
+    hash_algorithm, \
+    state_named
+from fab.tasks import \
+    Resource, \
+    Task, \
+    measure_children, \
+    read_io, \
+    subprocess_time
+from fab.reader import shared_reads
+from fab.trace import Span
+from fab.graph import DependencyGraph
+from fab import FabException
 from fab.database import \
     SqliteStateDatabase, \
-    FileInfoDatabase
+    FileInfo, \
+    FileInfoDatabase, \
+    DerivedFile, \
+    DerivedFileDatabase, \
+    MetricsDatabase, \
+    TaskMetric
+
+# Processor time and I/O of the calling thread alone, where available.
+#
+_thread_time = getattr(time, 'thread_time', time.process_time)
+_THREAD_IO = Path('/proc/thread-self/io')
 
 
-class DiscoveryState(Enum):
-    AWARE_OF = auto()
-    SEEN = auto()
-    COMPILED = auto()
+def _content_stamp(hashes: Iterable[int]) -> str:
+    # Identifies files written by a task from their contents
+    return ' '.join(str(file_hash) for file_hash in hashes)
 
 
 class PathMap(object):
@@ -65,134 +95,275 @@ class PathMap(object):
         return matched
 
 
+class Action(Enum):
+    IDENTIFY = auto()
+    COMPILE = auto()
+    LINK = auto()
+    PROCESS = auto()
+
+
+class Job(object):
+    """
+    Work to be done on an artifact, and then its results.
+
+    Jobs are decided upon and their results recorded by whoever holds the
+    dependency graph. Anything the work needs to know of the graph is
+    taken along with the job, allowing it to be done elsewhere.
+    """
+    def __init__(self, action: Action, artifact: Artifact):
+        self.action = action
+        self.artifact = artifact
+
+        # What the graph knows at the outset.
+        #
+        self.prerequisites: Dict[str, str] = {}
+        self.unchanged = False
+        self.target: Optional[str] = None
+        self.objects: List[Artifact] = []
+
+        # Other jobs of the same kind done along with this one.
+        #
+        self.batch: List[Job] = []
+
+        # Whether the work is sent to another machine.
+        #
+        self.remote = False
+
+        # Who did the work and when, for those interested in timings.
+        #
+        self.ready = 0.0
+        self.worker = 0
+        self.spans: List[Span] = []
+
+        # What the work results in.
+        #
+        self.outputs: List[Artifact] = []
+        self.stamps: Dict[str, str] = {}
+        self.reused = False
+
+
 class Engine(object):
     def __init__(self,
                  workspace: Path,
-                 target: str,
+                 target: Union[str, Iterable[str]],
                  pathmaps: List[PathMap],
                  taskmap: Mapping[
                      Tuple[Type[FileType], Type[State]],
-                     Task]) -> None:
+                     Task],
+                 incremental: bool = False,
+                 batch_size: int = 1,
+                 linkers: Optional[Mapping[str, Task]] = None,
+                 trust_stat: bool = False) -> None:
+        """
+        :param target: Program unit or symbol the build is for, or several
+                       of them, each being linked once everything it needs
+                       is compiled.
+        :param linkers: Task to link each target with, where it is not that
+                        of the task map for compiled objects.
+        :param trust_stat: Take a file whose modification time, size and
+                           inode are as they were when it was last hashed
+                           to be unchanged, without hashing it again.
+        """
         self._workspace = workspace
         self._target = target
+        self._targets = [target] if isinstance(target, str) else list(target)
         self._pathmaps = pathmaps
         self._taskmap = taskmap
+        self._incremental = incremental
+        self._batch_size = batch_size
+        self._linkers = dict(linkers or {})
+        self._trust_stat = trust_stat
         self._database = SqliteStateDatabase(workspace)
 
     @property
-    def target(self) -> str:
+    def target(self) -> Union[str, Iterable[str]]:
         return self._target
 
+    @property
+    def batch_size(self) -> int:
+        return self._batch_size
+
+    def batch_key(self, job: Job) -> Optional[Hashable]:
+        """
+        Jobs with the same key may be done together, one with no key may
+        only be done alone.
+        """
+        if self._batch_size < 2 or job.action is not Action.COMPILE:
+            return None
+        key = (job.artifact.filetype, job.artifact.state)
+        if not self._taskmap[key].batchable:
+            return None
+        return key
+
+    def is_portable(self, job: Job) -> bool:
+        """
+        :return: Whether the job may be done on another machine.
+        """
+        if job.action is not Action.COMPILE:
+            return False
+        key = (job.artifact.filetype, job.artifact.state)
+        return self._taskmap[key].portable
+
+    def identify(self, location: Path) -> Optional[Artifact]:
+        """
+        Uses the pathmap list to work out the filetype and starting state of
+        a file.
+
+        :return: Artifact for the file, or None if it is of no use to the
+                 build.
+        """
+        identified = None
+        for pathmap in self._pathmaps:
+            if location in pathmap:
+                identified = Artifact(location,
+                                      pathmap.filetype,
+                                      pathmap.state)
+        return identified
+
+    def survey(self,
+               locations: Iterable[Path],
+               threads: Optional[int] = None) -> Tuple[List[Artifact],
+                                                       List[Path]]:
+        """
+        Identifies and hashes files ahead of the build, doing the hashing in
+        a pool of threads which carries on while more files are found. The
+        hashes are recorded all at once when every file is done.
+
+        :param locations: Files found, which may still be being looked for.
+        :param threads: Number of threads to hash with, by default suiting
+                        the processors of the machine.
+        :return: Artifacts for those files of use to the build, ready for
+                 their first task, and which of them are unchanged since the
+                 previous build.
+        """
+        file_info = FileInfoDatabase(self._database)
+        algorithm = hash_algorithm()
+        recorded = {info.filename: info for info in file_info
+                    if info.algorithm == algorithm}
+
+        examined: List[Tuple[Artifact, Future]] = []
+        with ThreadPoolExecutor(threads) as pool:
+            for location in locations:
+                artifact = self.identify(location)
+                if artifact is not None:
+                    examined.append((artifact,
+                                     pool.submit(self._examine,
+                                                 artifact,
+                                                 recorded.get(location))))
+
+        artifacts: List[Artifact] = []
+        unchanged: List[Path] = []
+        records: List[Tuple[Path, int, os.stat_result]] = []
+        for artifact, examination in examined:
+            try:
+                status, reused, untouched = examination.result()
+            except OSError as err:
+                logging.getLogger(__name__).error(
+                    'Failed to hash "%s": %s', artifact.location, err)
+                continue
+            artifacts.append(artifact)
+            if reused:
+                unchanged.append(artifact.location)
+            if not (reused and untouched):
+                records.append((artifact.location, artifact.hash, status))
+        file_info.add_file_infos(records)
+        return artifacts, unchanged
+
+    def _examine(self,
+                 artifact: Artifact,
+                 previous: Optional[FileInfo]) -> Tuple[os.stat_result,
+                                                        bool,
+                                                        bool]:
+        # Hashes a file unless, trusting its status, the previous hash will
+        # do. The status is taken first so any later change will be noticed.
+        #
+        # Returns the status and whether the file is unchanged, and whether
+        # its status is, since the previous build.
+        #
+        status = artifact.location.stat()
+        if previous is None:
+            _ = artifact.hash
+            return status, False, False
+        untouched = previous.matches_stat(status)
+        if self._trust_stat and untouched:
+            artifact.hash = previous.hash
+        return status, previous.hash == artifact.hash, untouched
+
+    def resource(self, artifact: Artifact) -> Resource:
+        """
+        :return: What processing the artifact will mostly involve.
+        """
+        task = self._taskmap.get((artifact.filetype, artifact.state))
+        if task is None:
+            # Without a task there is nothing more to do than read the
+            # file, which need not hold the interpreter either
+            return Resource.SUBPROCESS
+        return task.resource
+
     def process(self,
                 artifact: Artifact,
-                discovery: Dict[str, DiscoveryState],
-                objects: List[Artifact],
-                lock: LockT) -> List[Artifact]:
+                graph: DependencyGraph) -> List[Artifact]:
+        """
+        Moves an artifact on a step, all in one go.
+
+        :return: Artifacts resulting from this one or released by it.
+        """
+        job, new_artifacts = self.prepare(artifact, graph)
+        if job is not None:
+            new_artifacts.extend(self.complete(self.execute(job), graph))
+        return new_artifacts
+
+    def prepare(self,
+                artifact: Artifact,
+                graph: DependencyGraph) -> Tuple[Optional[Job],
+                                                 List[Artifact]]:
+        """
+        Decides what, if anything, is to be done with an artifact.
+
+        Only the holder of the dependency graph may do this.
 
+        :return: Work to be done, if any, and artifacts which this one
+                 reveals to be needed.
+        """
         new_artifacts: List[Artifact] = []
-        new_discovery: Dict[str, DiscoveryState] = {}
-        new_objects: List[Artifact] = []
+        job = None
         # Identify tasks that are completely new
         if (artifact.state is New
                 and artifact.filetype is Unknown):
-            # Use the pathmap list to work out the
-            # filetype and starting state
-            new_artifact = None
-            for pathmap in self._pathmaps:
-                if artifact.location in pathmap:
-                    new_artifact = Artifact(artifact.location,
-                                            pathmap.filetype,
-                                            pathmap.state)
-            # Assuming we found a match and were able
-            # to create the artifact, return it so that
-            # it can be added to the queue
-            if new_artifact is not None:
-                # Also store its hash in the file database
-                file_info = FileInfoDatabase(self._database)
-                file_info.add_file_info(artifact.location,
-                                        new_artifact.hash)
-                new_artifacts.append(new_artifact)
+            job = Job(Action.IDENTIFY, artifact)
 
         elif artifact.state is Analysed:
 
-            # Work out whether this artifact needs to be
-            # included in the build or not - if any of its
-            # definitions are mentioned in the (shared)
-            # discovery mapping, or if it is defining
-            # the target of the build then it should be included
-
-            # TODO: Looping through a list of what could
-            # eventually contain every unit/symbol in the build has
-            # the potential to become an issue for performance.
-            # Longer term we probably want to drop using the shared
-            # discovery array in favour of database lookups
-            required = False
-            for definition in artifact.defines:
-                # Is this the target?
-                if (definition == self.target
-                        or definition in discovery):
-                    required = True
-                    break
+            # The dependency graph works out whether this artifact
+            # is needed by the build and, if so, whether everything
+            # it depends on has been compiled. If not it is held
+            # by the graph and handed back when the last of its
+            # prerequisites is compiled
+            ready, claimed = graph.schedule(artifact)
+            new_artifacts.extend(claimed)
 
-            if required:
-                # Update the discovery list to indicate that
-                # the definitions from this Artifact are present
-                # (but not yet compiled)
-                for definition in artifact.defines:
-                    if definition not in discovery:
-                        new_discovery[definition] = DiscoveryState.SEEN
-
-                # Now check whether the Artifact's dependencies
-                # have already been seen and compiled
-                compiled = [False]*len(artifact.depends_on)
-                for idep, dependency in enumerate(artifact.depends_on):
-                    # Only applies to str dependencies
-                    if isinstance(dependency, Path):
-                        continue
-                    if dependency in discovery:
-                        # Are the dependencies compiled?
-                        if discovery[dependency] == DiscoveryState.COMPILED:
-                            compiled[idep] = True
-                    else:
-                        # If the dependency isn't in the list at all yet
-                        # then add an entry so the system knows we are
-                        # expecting it later (for the above check)
-                        new_discovery[dependency] = DiscoveryState.AWARE_OF
-
-                # If the dependencies are satisfied (or there weren't
-                # any) then this file can be compiled now
-                if len(compiled) == 0 or all(compiled):
-                    for definition in artifact.defines:
-                        task = self._taskmap[(artifact.filetype,
-                                              artifact.state)]
-                        new_artifacts.extend(task.run([artifact]))
-                        new_discovery[definition] = DiscoveryState.COMPILED
-                else:
-                    # If the dependencies weren't all satisfied then
-                    # back on the queue for another pass later
-                    new_artifacts.append(artifact)
-            else:
-                # If it wasn't required it could be later, so
-                # put it back on the queue, unless the target
-                # has been compiled, in which case it wasn't
-                # needed at all!
-                if (self._target not in discovery
-                        or discovery[self._target] != DiscoveryState.COMPILED):
-                    new_artifacts.append(artifact)
+            if ready:
+                # An unchanged file need only be recompiled if what it
+                # sees of its prerequisites has changed, which their
+                # stamps reveal
+                job = Job(Action.COMPILE, artifact)
+                job.prerequisites = graph.stamps(
+                    [dependency for dependency in artifact.depends_on
+                     if isinstance(dependency, str)
+                     and dependency not in artifact.defines])
+                job.unchanged = graph.is_unchanged([artifact.location])
 
         elif artifact.state is Compiled:
-            # Begin populating the list for linking
-            new_objects.append(artifact)
-            # But do not return a new artifact - this object
-            # is "done" as far as the processing is concerned
-
-            # But, if this is the file containing the target
-            # that means everything must have been compiled
-            # by this point; so we can do the linking step
-            if self._target in artifact.defines:
-                task = self._taskmap[(artifact.filetype,
-                                      artifact.state)]
-                new_artifacts.extend(task.run(objects + [artifact]))
+            # The object was recorded by the graph when it was
+            # compiled. If this is the file containing a target
+            # that means everything it needs must have been compiled
+            # by this point; so we can do its linking step
+            for target in self._targets:
+                if target in artifact.defines:
+                    job = Job(Action.LINK, artifact)
+                    job.target = target
+                    job.objects = graph.objects(target)
+                    break
 
         elif artifact.state is Linked:
             # Nothing to do at present with the final linked
@@ -200,35 +371,304 @@ class Engine(object):
             pass
         else:
             # If the object specifies any paths in its dependencies
-            # then these must exist before it can be processed
-            # TODO: This needs more thorough logic and to come from
-            # the database eventually
+            # then these must be produced before it can be processed
             ready = True
-            for dependency in artifact.depends_on:
-                if isinstance(dependency, Path):
-                    if not dependency.exists():
-                        ready = False
+            paths = [dependency for dependency in artifact.depends_on
+                     if isinstance(dependency, Path)]
+            if paths:
+                ready = graph.await_files(artifact, paths)
 
-            if ready:
-                # An artifact with a filetype and state set
-                # will have an appropriate task that should
-                # be used to run it (though unlike the old
-                # implementation this is probably returning
-                # the instance of the Task not the class)
-                if ((artifact.filetype, artifact.state)
-                        in self._taskmap):
-                    task = self._taskmap[(artifact.filetype,
-                                          artifact.state)]
-
-                    new_artifacts.extend(task.run([artifact]))
-            else:
-                new_artifacts.append(artifact)
+            # An artifact with a filetype and state set
+            # will have an appropriate task that should
+            # be used to run it (though unlike the old
+            # implementation this is probably returning
+            # the instance of the Task not the class)
+            if (ready and (artifact.filetype, artifact.state)
+                    in self._taskmap):
+                job = Job(Action.PROCESS, artifact)
+                job.unchanged \
+                    = graph.is_unchanged([artifact.location] + paths)
+
+        return job, new_artifacts
+
+    def execute(self, job: Job) -> Job:
+        """
+        Does the work decided upon for an artifact.
+
+        This needs no access to the dependency graph so may be done anywhere.
+
+        :return: The job with its results filled in.
+        """
+        # Stages of a job looking at the same file share one read of it
+        with shared_reads():
+            return self._execute(job)
 
-        # Update shared arrays
-        lock.acquire()
-        objects.extend(new_objects)
-        for key, value in new_discovery.items():
-            discovery[key] = value
-        lock.release()
+    def _execute(self, job: Job) -> Job:
+        artifact = job.artifact
+        if job.action is Action.IDENTIFY:
+            new_artifact = self.identify(artifact.location)
+            # Assuming we found a match and were able
+            # to create the artifact, return it so that
+            # it can be added to the queue
+            if new_artifact is not None:
+                # Also store its hash in the file database, noting
+                # whether it has changed since the last build
+                file_info = FileInfoDatabase(self._database)
+                previous: Optional[FileInfo] = None
+                if self._incremental:
+                    try:
+                        previous = file_info.get_file_info(artifact.location)
+                    except FabException:
+                        pass  # Not seen before
+                status, job.reused, untouched \
+                    = self._examine(new_artifact, previous)
+                if not (job.reused and untouched):
+                    file_info.add_file_info(artifact.location,
+                                            new_artifact.hash,
+                                            status=status)
+                job.outputs.append(new_artifact)
+
+        elif job.action is Action.COMPILE:
+            self._compile([job] + job.batch)
+
+        elif job.action is Action.LINK:
+            task = self._linkers.get(job.target or '') \
+                or self._taskmap[(artifact.filetype, artifact.state)]
+            job.outputs.extend(self._run_task([job], task, job.objects))
+
+        else:
+            task = self._taskmap[(artifact.filetype,
+                                  artifact.state)]
 
+            # Files which are the same as last time, and include
+            # only files which are the same as last time, need not
+            # be processed again if the results are still around
+            outputs = None
+            if self._incremental and job.unchanged and self._intact(artifact):
+                outputs = self._restore(artifact, task)
+            job.reused = outputs is not None
+            if outputs is None:
+                outputs = self._process(job, task)
+            job.outputs.extend(outputs)
+
+        return job
+
+    def complete(self,
+                 job: Job,
+                 graph: DependencyGraph) -> List[Artifact]:
+        """
+        Records the results of a job.
+
+        Only the holder of the dependency graph may do this.
+
+        :return: Artifacts resulting from the job or released by it.
+        """
+        new_artifacts: List[Artifact] = list(job.outputs)
+        if job.action is Action.IDENTIFY:
+            if job.reused:
+                graph.unchanged([job.artifact.location])
+        elif job.action is Action.COMPILE:
+            for batched in job.batch:
+                new_artifacts.extend(batched.outputs)
+            for compilation in [job] + job.batch:
+                new_artifacts.extend(
+                    graph.compiled(compilation.artifact.defines,
+                                   compilation.outputs,
+                                   compilation.stamps))
+        elif job.action is Action.PROCESS:
+            new_artifacts.extend(
+                graph.produced([output.location for output in job.outputs],
+                               job.reused))
         return new_artifacts
+
+    def _compile(self, jobs: List[Job]) -> None:
+        task = self._taskmap[(jobs[0].artifact.filetype,
+                              jobs[0].artifact.state)]
+        derived = DerivedFileDatabase(self._database)
+
+        # An unchanged file need only be recompiled if what it sees of its
+        # prerequisites has changed, which their stamps reveal
+        to_run: List[Job] = []
+        for job in jobs:
+            artifact = job.artifact
+            compiled = None
+            stamp = ''
+            if (self._incremental
+                    and job.unchanged
+                    and derived.get_prerequisite_stamps(
+                        artifact.location) == job.prerequisites):
+                compiled = self._restore(artifact, task)
+                stamp = derived.get_stamp(artifact.location,
+                                          artifact.state.__name__)
+            if compiled is None or not stamp:
+                to_run.append(job)
+            else:
+                job.outputs.extend(compiled)
+                job.stamps = self._stamps(task, artifact, stamp)
+
+        # Files compiled together produce an object each
+        stamps: List[str] = []
+        if len(to_run) == 1:
+            stamp = uuid4().hex
+            to_run[0].outputs.extend(self._run(to_run[0], task, stamp))
+            stamps.append(stamp)
+        elif to_run:
+            for job in to_run:
+                derived.remove_derived_files(job.artifact.location,
+                                             job.artifact.state.__name__)
+            outputs = self._run_task(to_run,
+                                     task,
+                                     [job.artifact for job in to_run])
+            for job, output in zip(to_run, outputs):
+                stamp = uuid4().hex
+                derived.add_derived_files(
+                    job.artifact.location,
+                    job.artifact.state.__name__,
+                    [DerivedFile(output.location,
+                                 output.filetype.__name__,
+                                 output.state.__name__)],
+                    stamp)
+                job.outputs.append(output)
+                stamps.append(stamp)
+        for job, stamp in zip(to_run, stamps):
+            derived.add_prerequisite_stamps(job.artifact.location,
+                                            job.prerequisites)
+            job.stamps = self._stamps(task, job.artifact, stamp)
+
+    def _stamps(self,
+                task: Task,
+                artifact: Artifact,
+                stamp: str) -> Dict[str, str]:
+        # Where the task can say what dependents see of the result they may
+        # be spared recompilation when that has not changed, otherwise any
+        # compilation counts
+        stamps = task.fingerprints(artifact)
+        if stamps is None:
+            stamps = {definition: stamp for definition in artifact.defines}
+        return stamps
+
+    def _run(self,
+             job: Job,
+             task: Task,
+             stamp: str = '') -> List[Artifact]:
+        # Anything previously produced from this artifact is out of date
+        # from here on, whether or not the task succeeds
+        artifact = job.artifact
+        derived = DerivedFileDatabase(self._database)
+        derived.remove_derived_files(artifact.location,
+                                     artifact.state.__name__)
+        outputs = self._run_task([job], task, [artifact])
+        derived.add_derived_files(
+            artifact.location,
+            artifact.state.__name__,
+            [DerivedFile(output.location,
+                         output.filetype.__name__,
+                         output.state.__name__) for output in outputs],
+            stamp)
+        return outputs
+
+    def _process(self, job: Job, task: Task) -> List[Artifact]:
+        # The files a task results in are identified by their contents.
+        # Whatever was made from them previously is stale until they turn out
+        # differently, which they may not, as when a change is only to
+        # comments. Everything after is then spared.
+        artifact = job.artifact
+        state = artifact.state.__name__
+        derived = DerivedFileDatabase(self._database)
+        previous = derived.get_derived_files(artifact.location, state,
+                                             stale=True)
+        previous_stamp = derived.get_stamp(artifact.location, state)
+        derived.mark_stale(artifact.location, state)
+        outputs = self._run_task([job], task, [artifact])
+
+        # Should a task not leave behind the files it says it has then they
+        # cannot be compared
+        try:
+            hashes = [file_hash(output.location) for output in outputs]
+        except OSError:
+            hashes = []
+        stamp = _content_stamp(hashes) if hashes else ''
+        job.reused = self._incremental \
+            and stamp != '' \
+            and stamp == previous_stamp \
+            and [info.filename for info in previous] \
+            == [output.location for output in outputs]
+        if job.reused:
+            derived.revive(artifact.location, state)
+        derived.add_derived_files(
+            artifact.location,
+            state,
+            [DerivedFile(output.location,
+                         output.filetype.__name__,
+                         output.state.__name__) for output in outputs],
+            stamp)
+        return outputs
+
+    def _intact(self, artifact: Artifact) -> bool:
+        # Files written by a task may since have been overwritten by
+        # another, as happens where a later task works in place
+        derived = DerivedFileDatabase(self._database)
+        state = artifact.state.__name__
+        stamp = derived.get_stamp(artifact.location, state)
+        if not stamp:
+            return True
+        try:
+            hashes = [file_hash(info.filename)
+                      for info in derived.get_derived_files(artifact.location,
+                                                            state)]
+        except OSError:
+            return False
+        return _content_stamp(hashes) == stamp
+
+    def _run_task(self,
+                  jobs: List[Job],
+                  task: Task,
+                  artifacts: List[Artifact]) -> List[Artifact]:
+        # Each run is noted against the first job, and its costs shared
+        # between them all, even should it fail
+        start = time.time()
+        waited = subprocess_time()
+        cpu = _thread_time()
+        read, written = read_io(_THREAD_IO)
+        with measure_children() as children:
+            try:
+                return task.run(artifacts)
+            finally:
+                duration = time.time() - start
+                jobs[0].spans.append(Span(type(task).__name__,
+                                          [artifact.location
+                                           for artifact in artifacts],
+                                          start,
+                                          duration,
+                                          subprocess_time() - waited))
+
+                cpu = _thread_time() - cpu
+                now_read, now_written = read_io(_THREAD_IO)
+                share = len(jobs)
+                metrics = MetricsDatabase(self._database)
+                for job in jobs:
+                    metrics.add_metric(TaskMetric(
+                        job.artifact.location,
+                        type(task).__name__,
+                        duration / share,
+                        (cpu + children.cpu) / share,
+                        children.peak_rss,
+                        (now_read - read + children.bytes_read) // share,
+                        (now_written - written + children.bytes_written)
+                        // share,
+                        share))
+
+    def _restore(self,
+                 artifact: Artifact,
+                 task: Task) -> Optional[List[Artifact]]:
+        derived = DerivedFileDatabase(self._database)
+        previous = derived.get_derived_files(artifact.location,
+                                             artifact.state.__name__)
+        if len(previous) == 0 \
+                or not all(info.filename.exists() for info in previous):
+            return None
+        return task.restore(artifact,
+                            [Artifact(info.filename,
+                                      filetype_named(info.filetype),
+                                      state_named(info.state))
+                             for info in previous])
@@ -155,7 +155,7 @@ class FileInfoFrame(tk.Frame):
     def select(self, filename: Path):
         info = self._file_db.get_file_info(filename)
         self._hash_field.delete(0, tk.END)
-        self._hash_field.insert(0, str(info.adler32))
+        self._hash_field.insert(0, str(info.hash))
 
 
 class FortranTab(tk.Frame):
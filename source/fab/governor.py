@@ -0,0 +1,141 @@
+##############################################################################
+# (c) Crown copyright Met Office. All rights reserved.
+# For further details please refer to the file COPYRIGHT
+# which you should have received as part of this distribution
+##############################################################################
+'''
+Adjustment of the amount of work in progress to suit the machine.
+'''
+import logging
+import os
+from pathlib import Path
+import time
+from typing import Callable, Optional, Tuple
+
+
+class LoadGovernor(object):
+    """
+    Decides how many jobs may be in progress at once from how busy the
+    machine is.
+
+    Every so often the system is looked at. Should the load per processor
+    exceed a limit, or the memory available fall below one, a slot is given
+    up. Should processors be sitting idle with neither limit reached a slot
+    is added. Otherwise things stay as they are. There is always at least
+    one slot so the build keeps moving, and never more than the number of
+    workers there are to fill them.
+
+    Figures are taken from the /proc filesystem where it is available.
+    Elsewhere the load average stands in for idleness and memory is not
+    considered.
+    """
+    def __init__(self,
+                 ceiling: int,
+                 max_load: float = 1.0,
+                 min_memory: int = 512 * 1024 ** 2,
+                 min_idle: float = 0.2,
+                 interval: float = 2.0,
+                 clock: Callable[[], float] = time.monotonic):
+        """
+        :param ceiling: Most slots which may be allowed.
+        :param max_load: Load average per processor above which slots are
+                         given up.
+        :param min_memory: Bytes of available memory below which slots are
+                           given up.
+        :param min_idle: Fraction of processor time spent idle above which
+                         slots are added.
+        :param interval: Seconds between looks at the system.
+        :param clock: Source of the time in seconds.
+        """
+        self._ceiling = max(1, ceiling)
+        self._max_load = max_load
+        self._min_memory = min_memory
+        self._min_idle = min_idle
+        self._interval = interval
+        self._clock = clock
+        self._cpus = os.cpu_count() or 1
+        self._last_look: Optional[float] = None
+        self._last_times: Optional[Tuple[int, int]] = None
+        self.logger = logging.getLogger(__name__)
+
+    @property
+    def ceiling(self) -> int:
+        return self._ceiling
+
+    @property
+    def initial(self) -> int:
+        """
+        Slots to start with, before anything is known of the build.
+        """
+        return max(1, self._ceiling // 2)
+
+    def slots(self, current: int) -> int:
+        """
+        :param current: Slots presently allowed.
+        :return: Slots to be allowed from now on.
+        """
+        now = self._clock()
+        if self._last_look is not None \
+                and now - self._last_look < self._interval:
+            return current
+        self._last_look = now
+
+        load = self._load()
+        memory = self._available_memory()
+        idle = self._idle()
+        if (load is not None and load > self._max_load) \
+                or (memory is not None and memory < self._min_memory):
+            wanted = max(1, current - 1)
+        elif idle is not None and idle > self._min_idle:
+            wanted = min(self._ceiling, current + 1)
+        else:
+            wanted = current
+
+        if wanted != current:
+            self.logger.info('Changing from %d to %d slots '
+                             '(load %s, available memory %s, idle %s)',
+                             current, wanted, load, memory, idle)
+        return wanted
+
+    def _load(self) -> Optional[float]:
+        """
+        :return: One minute load average per processor.
+        """
+        try:
+            return os.getloadavg()[0] / self._cpus
+        except (AttributeError, OSError):
+            return None
+
+    def _available_memory(self) -> Optional[int]:
+        """
+        :return: Bytes of memory which may be had without swapping.
+        """
+        try:
+            with Path('/proc/meminfo').open() as meminfo:
+                for line in meminfo:
+                    name, _, value = line.partition(':')
+                    if name == 'MemAvailable':
+                        return int(value.split()[0]) * 1024
+        except OSError:
+            pass
+        return None
+
+    def _idle(self) -> Optional[float]:
+        """
+        :return: Fraction of processor time spent idle since last asked.
+        """
+        try:
+            with Path('/proc/stat').open() as stat:
+                fields = [int(field) for field in stat.readline().split()[1:]]
+        except (OSError, ValueError):
+            load = self._load()
+            return None if load is None else max(0.0, 1.0 - load)
+
+        # Idle and waiting on I/O both count as not busy
+        idle = sum(fields[3:5])
+        total = sum(fields)
+        previous = self._last_times
+        self._last_times = (idle, total)
+        if previous is None or total == previous[1]:
+            return None
+        return (idle - previous[0]) / (total - previous[1])
@@ -0,0 +1,473 @@
+##############################################################################
+# (c) Crown copyright Met Office. All rights reserved.
+# For further details please refer to the file COPYRIGHT
+# which you should have received as part of this distribution
+##############################################################################
+'''
+Tracking of the dependencies between artifacts as they move through a build.
+'''
+from enum import Enum, auto
+from pathlib import Path
+import threading
+from typing import \
+    Dict, \
+    Iterable, \
+    Iterator, \
+    List, \
+    Mapping, \
+    Optional, \
+    Sequence, \
+    Set, \
+    Tuple, \
+    Union
+
+from fab.artifact import Artifact, Analysed
+
+
+class DiscoveryState(Enum):
+    AWARE_OF = auto()
+    SEEN = auto()
+    COMPILED = auto()
+
+
+class DependencyGraph(object):
+    """
+    Holds artifacts back until the things they depend on are available.
+
+    Analysed artifacts are entered into the graph along with the program
+    units or symbols they depend on. Rather than being returned to the queue
+    until their prerequisites happen to be ready they are parked here and
+    released by the completion of the last prerequisite they are waiting for.
+    The same mechanism serves artifacts waiting on files, such as headers,
+    which are produced by other tasks.
+
+    A build may be for several targets, each to be linked into its own
+    executable. Whatever they have in common is only compiled once.
+
+    Every public method is a single transaction. In practice the graph is
+    held by the coordinator of a build, which alone consults and updates it.
+    """
+    def __init__(self, target: Union[str, Iterable[str]]):
+        """
+        :param target: Program unit or symbol the build is for, or several
+                       of them.
+        """
+        self._targets = [target] if isinstance(target, str) else list(target)
+        self._lock = threading.Lock()
+        self._discovery: Dict[str, DiscoveryState] = {}
+        self._objects: List[Artifact] = []
+
+        # What each required definition depends on and the objects it was
+        # compiled into, from which the objects a target needs follow.
+        #
+        self._requires: Dict[str, List[str]] = {}
+        self._objects_of: Dict[str, List[Artifact]] = {}
+        self._produced: Set[Path] = set()
+
+        # Files known to be the same as they were in the previous build and
+        # what dependents see of each compiled definition.
+        #
+        self._unchanged: Set[Path] = set()
+        self._stamps: Dict[str, str] = {}
+
+        # Analysed artifacts which nothing has asked for yet, indexed by
+        # each of the definitions they provide.
+        #
+        self._unclaimed: Dict[str, Artifact] = {}
+
+        # Artifacts waiting on prerequisites along with the names or paths
+        # they are still waiting for. Each prerequisite knows which of these
+        # it is holding up.
+        #
+        self._next_id = 0
+        self._blocked: Dict[int, Tuple[Artifact, Set[Union[str, Path]]]] = {}
+        self._dependents: Dict[Union[str, Path], List[int]] = {}
+
+    @property
+    def targets(self) -> List[str]:
+        return list(self._targets)
+
+    def schedule(self, artifact: Artifact) -> Tuple[bool, List[Artifact]]:
+        """
+        Enters an analysed artifact into the graph.
+
+        An artifact is only required by the build if it defines the target or
+        something which a required artifact depends on. Those which are not
+        (yet) required are kept aside until they are.
+
+        :param artifact: Analysed artifact.
+        :return: Whether the artifact may be compiled immediately, along with
+                 any previously unclaimed artifacts which it requires.
+        """
+        with self._lock:
+            required = False
+            for definition in artifact.defines:
+                if (definition in self._targets
+                        or definition in self._discovery):
+                    required = True
+                    break
+
+            if not required:
+                for definition in artifact.defines:
+                    self._unclaimed[definition] = artifact
+                return False, []
+
+            self._claim(artifact)
+            requires = [dependency for dependency in artifact.depends_on
+                        if isinstance(dependency, str)
+                        and dependency not in artifact.defines]
+            for definition in artifact.defines:
+                if definition not in self._discovery:
+                    self._discovery[definition] = DiscoveryState.SEEN
+                self._requires[definition] = requires
+
+            released: List[Artifact] = []
+            outstanding: Set[Union[str, Path]] = set()
+            for dependency in artifact.depends_on:
+                # Path dependencies are dealt with before analysis and a
+                # file may quite reasonably use things it defines itself.
+                #
+                if isinstance(dependency, Path) \
+                        or dependency in artifact.defines:
+                    continue
+                if dependency not in self._discovery:
+                    # Let the system know we are expecting this later and
+                    # reclaim anything which has already been put aside.
+                    #
+                    self._discovery[dependency] = DiscoveryState.AWARE_OF
+                    if dependency in self._unclaimed:
+                        claimed = self._unclaimed[dependency]
+                        self._claim(claimed)
+                        released.append(claimed)
+                if self._discovery[dependency] != DiscoveryState.COMPILED:
+                    outstanding.add(dependency)
+
+            if outstanding:
+                self._block(artifact, outstanding)
+                return False, released
+            return True, released
+
+    def await_files(self, artifact: Artifact, paths: Iterable[Path]) -> bool:
+        """
+        Checks that the files an artifact depends on have been produced.
+
+        If they have not the artifact is held until they are.
+
+        :param artifact: Artifact depending on the files.
+        :param paths: Files which must be produced by the build beforehand.
+        :return: Whether the artifact may be processed immediately.
+        """
+        with self._lock:
+            outstanding: Set[Union[str, Path]] \
+                = {path for path in paths if path not in self._produced}
+            if outstanding:
+                self._block(artifact, outstanding)
+                return False
+            return True
+
+    def compiled(self,
+                 definitions: Iterable[str],
+                 objects: Iterable[Artifact],
+                 stamps: Optional[Mapping[str, str]] = None) \
+            -> List[Artifact]:
+        """
+        Records the completed compilation of an artifact.
+
+        :param definitions: Units or symbols which are now compiled.
+        :param objects: Object files resulting from the compilation.
+        :param stamps: Identifies what dependents see of each definition,
+                       changing only when that does.
+        :return: Artifacts which were only waiting on these definitions.
+        """
+        with self._lock:
+            objects = list(objects)
+            self._objects.extend(objects)
+            released: List[Artifact] = []
+            for definition in definitions:
+                self._discovery[definition] = DiscoveryState.COMPILED
+                self._objects_of[definition] = objects
+                if stamps is not None:
+                    self._stamps[definition] = stamps.get(definition, '')
+                released.extend(self._satisfy(definition))
+            return released
+
+    def produced(self,
+                 paths: Iterable[Path],
+                 unchanged: bool = False) -> List[Artifact]:
+        """
+        Records the creation of files by the build.
+
+        :param paths: Newly created files.
+        :param unchanged: The files are those left by the previous build.
+        :return: Artifacts which were only waiting on these files.
+        """
+        with self._lock:
+            released: List[Artifact] = []
+            for path in paths:
+                self._produced.add(path)
+                if unchanged:
+                    self._unchanged.add(path)
+                released.extend(self._satisfy(path))
+            return released
+
+    def unchanged(self, paths: Iterable[Path]) -> None:
+        """
+        Records that files are the same as they were in the previous build.
+        """
+        with self._lock:
+            self._unchanged.update(paths)
+
+    def is_unchanged(self, paths: Iterable[Path]) -> bool:
+        """
+        :return: Whether all the files are as they were in the previous build.
+        """
+        with self._lock:
+            return all(path in self._unchanged for path in paths)
+
+    def stamps(self, definitions: Iterable[str]) -> Dict[str, str]:
+        """
+        :return: What dependents see of each of the definitions.
+        """
+        with self._lock:
+            return {definition: self._stamps.get(definition, '')
+                    for definition in definitions}
+
+    def discovery(self) -> Dict[str, DiscoveryState]:
+        with self._lock:
+            return dict(self._discovery)
+
+    def blocked(self) -> Dict[Path, Set[Union[str, Path]]]:
+        """
+        :return: Artifacts still held back, by location, along with the
+                 names or paths each is waiting for.
+        """
+        with self._lock:
+            return {artifact.location: set(outstanding)
+                    for artifact, outstanding in self._blocked.values()}
+
+    def objects(self, target: Optional[str] = None) -> List[Artifact]:
+        """
+        :param target: Target whose objects are wanted, if not all of them.
+        :return: Objects compiled so far, or those the target needs.
+        """
+        with self._lock:
+            if target is None:
+                return list(self._objects)
+
+            objects: Dict[Path, Artifact] = {}
+            seen: Set[str] = set()
+            to_visit = [target]
+            while to_visit:
+                definition = to_visit.pop()
+                if definition in seen:
+                    continue
+                seen.add(definition)
+                for compiled in self._objects_of.get(definition, []):
+                    objects.setdefault(compiled.location, compiled)
+                to_visit.extend(self._requires.get(definition, []))
+            return [compiled for compiled in self._objects
+                    if objects.get(compiled.location) is compiled]
+
+    def _claim(self, artifact: Artifact) -> None:
+        for definition in artifact.defines:
+            self._unclaimed.pop(definition, None)
+
+    def _block(self,
+               artifact: Artifact,
+               outstanding: Set[Union[str, Path]]) -> None:
+        identifier = self._next_id
+        self._next_id += 1
+        self._blocked[identifier] = (artifact, outstanding)
+        for prerequisite in outstanding:
+            self._dependents.setdefault(prerequisite, []).append(identifier)
+
+    def _satisfy(self, prerequisite: Union[str, Path]) -> List[Artifact]:
+        released: List[Artifact] = []
+        for identifier in self._dependents.pop(prerequisite, []):
+            artifact, outstanding = self._blocked[identifier]
+            outstanding.discard(prerequisite)
+            if not outstanding:
+                del self._blocked[identifier]
+                released.append(artifact)
+        return released
+
+
+class CriticalPath(object):
+    """
+    Ranks artifacts so that long chains of dependent work start first.
+
+    The rank of a file is the length of the longest chain of files which
+    depend on it, derived from the program units or symbols each file defines
+    and the prerequisites of each. Ties are broken on file size, larger files
+    first, as they are likely to take longer to compile.
+
+    The ranking is taken from the analysis held in the state database, which
+    is to say the previous build. Files the ranking knows nothing of sort
+    after those it does, by size alone.
+    """
+    def __init__(self, units: Iterable[Tuple[str, Path, Sequence[str]]]):
+        """
+        :param units: Unit or symbol name, the file it was found in and the
+                      names of its prerequisites.
+        """
+        defined_in: Dict[str, Set[Path]] = {}
+        prerequisites: Dict[Path, Set[str]] = {}
+        for name, found_in, depends_on in units:
+            defined_in.setdefault(name, set()).add(found_in)
+            prerequisites.setdefault(found_in, set()).update(depends_on)
+
+        dependents: Dict[Path, Set[Path]] = {}
+        for filename, names in prerequisites.items():
+            for name in names:
+                for prerequisite in defined_in.get(name, ()):
+                    if prerequisite != filename:
+                        dependents.setdefault(prerequisite, set()) \
+                            .add(filename)
+
+        self._chains: Dict[Path, int] = {}
+        for filename in prerequisites:
+            if filename not in self._chains:
+                self._chain(filename, dependents)
+
+        # Preprocessed files are analysed in the workspace so allow the
+        # sources they came from to be matched on name alone.
+        #
+        self._stem_chains: Dict[str, int] = {}
+        for filename, chain in self._chains.items():
+            if chain > self._stem_chains.get(filename.stem, -1):
+                self._stem_chains[filename.stem] = chain
+
+        self._sizes: Dict[Path, int] = {}
+
+    def chain(self, location: Path) -> int:
+        """
+        :return: Length of the longest chain of files depending on this one.
+        """
+        if location in self._chains:
+            return self._chains[location]
+        return self._stem_chains.get(location.stem, 0)
+
+    def priority(self, artifact: Artifact) -> Tuple[int, int]:
+        """
+        :return: Sort key placing the most critical artifact first.
+        """
+        location = artifact.location
+        if location not in self._sizes:
+            try:
+                self._sizes[location] = location.stat().st_size
+            except OSError:
+                self._sizes[location] = 0
+        return -self.chain(location), -self._sizes[location]
+
+    def _chain(self,
+               start: Path,
+               dependents: Dict[Path, Set[Path]]) -> int:
+        # Chains may be thousands of files long so walk them with an explicit
+        # stack rather than recursion. A file is finished only once all its
+        # dependents are. One already on the path from the start indicates a
+        # cycle, which is broken by treating the repeat as a leaf.
+        #
+        stack: List[Tuple[Path, Iterator[Path]]] \
+            = [(start, iter(dependents.get(start, ())))]
+        on_path: Set[Path] = {start}
+        while stack:
+            filename, remaining = stack[-1]
+            for dependent in remaining:
+                if dependent not in self._chains \
+                        and dependent not in on_path:
+                    stack.append(
+                        (dependent, iter(dependents.get(dependent, ()))))
+                    on_path.add(dependent)
+                    break
+            else:
+                stack.pop()
+                on_path.discard(filename)
+                self._chains[filename] = max(
+                    (self._chains.get(dependent, 0) + 1
+                     for dependent in dependents.get(filename, ())),
+                    default=0)
+        return self._chains[start]
+
+
+class TargetPruning(object):
+    """
+    Picks out the source files a target needs, going by the previous build.
+
+    The files a target needs are those whose analysis defined the target or
+    anything it depends on, directly or indirectly, as recorded by the
+    previous analysis. Source files are related to what was analysed by the
+    records of the files derived from them. Files of which nothing is known,
+    such as those new to the build, or which never reached analysis, such as
+    headers, are always taken to be needed.
+    """
+    def __init__(self,
+                 target: Union[str, Iterable[str]],
+                 units: Iterable[Tuple[str, Path, Sequence[str]]],
+                 derived: Iterable[Tuple[Path, Path, str]]):
+        """
+        :param target: Program unit or symbol the build is for, or several
+                       of them.
+        :param units: Unit or symbol name, the file it was found in and the
+                      names of its prerequisites.
+        :param derived: File given to a task, a file it produced and the
+                        state of that produced file.
+        """
+        defined_in: Dict[str, Set[Path]] = {}
+        prerequisites: Dict[Path, Set[str]] = {}
+        for name, found_in, depends_on in units:
+            defined_in.setdefault(name, set()).add(found_in)
+            prerequisites.setdefault(found_in, set()).update(depends_on)
+        self._defined_in = defined_in
+
+        # Everything from the targets down
+        targets = [target] if isinstance(target, str) else list(target)
+        self._required: Set[Path] = set()
+        to_visit = [filename
+                    for name in targets
+                    for filename in defined_in.get(name, ())]
+        while to_visit:
+            filename = to_visit.pop()
+            if filename in self._required:
+                continue
+            self._required.add(filename)
+            for name in prerequisites.get(filename, ()):
+                to_visit.extend(defined_in.get(name, ()))
+
+        self._produced: Dict[Path, Set[Path]] = {}
+        self._analysed: Set[Path] = set()
+        for source, filename, state in derived:
+            if filename != source:
+                self._produced.setdefault(source, set()).add(filename)
+            if state == Analysed.__name__:
+                self._analysed.add(filename)
+
+    def needs(self, source: Path) -> bool:
+        """
+        :return: Whether the target needs the source file, or may do.
+        """
+        analysed = self._analysed_from(source)
+        return not analysed or not analysed.isdisjoint(self._required)
+
+    def provides(self, source: Path, names: Iterable[str]) -> bool:
+        """
+        :return: Whether the source file was found to define any of the
+                 names.
+        """
+        defining = {filename
+                    for name in names
+                    for filename in self._defined_in.get(name, ())}
+        return not self._analysed_from(source).isdisjoint(defining)
+
+    def _analysed_from(self, source: Path) -> Set[Path]:
+        analysed: Set[Path] = set()
+        seen: Set[Path] = set()
+        to_visit = [source]
+        while to_visit:
+            filename = to_visit.pop()
+            if filename in seen:
+                continue
+            seen.add(filename)
+            if filename in self._analysed:
+                analysed.add(filename)
+            to_visit.extend(self._produced.get(filename, ()))
+        return analysed
@@ -0,0 +1,90 @@
+##############################################################################
+# (c) Crown copyright Met Office. All rights reserved.
+# For further details please refer to the file COPYRIGHT
+# which you should have received as part of this distribution
+##############################################################################
+'''
+Where the files produced from a source file are put in the workspace.
+'''
+from abc import ABC, abstractmethod
+import hashlib
+import os.path
+from pathlib import Path
+from typing import Optional, Set
+
+
+class WorkspaceLayout(ABC):
+    """
+    Decides the directory in the workspace for files produced from a file.
+
+    Directories are created as they are first asked for.
+    """
+    def __init__(self, workspace: Path):
+        self._workspace = workspace
+        self._created: Set[Path] = set()
+
+    @property
+    def workspace(self) -> Path:
+        return self._workspace
+
+    @abstractmethod
+    def directory(self, location: Path) -> Path:
+        """
+        :param location: File from which others are produced.
+        :return: Directory for the files produced from it.
+        """
+        raise NotImplementedError('Abstract methods must be implemented')
+
+    def path(self, location: Path, suffix: Optional[str] = None) -> Path:
+        """
+        :param location: File from which another is produced.
+        :param suffix: Suffix of the produced file, if it differs.
+        :return: Where the produced file should be put.
+        """
+        location = Path(os.path.normpath(str(location)))
+        directory = self.directory(location)
+        if directory not in self._created:
+            directory.mkdir(parents=True, exist_ok=True)
+            self._created.add(directory)
+        name = location.name if suffix is None \
+            else location.with_suffix(suffix).name
+        return directory / name
+
+
+class FlatLayout(WorkspaceLayout):
+    """
+    Puts everything in the top of the workspace, so files of the same name
+    must not be produced from different places.
+    """
+    def directory(self, location: Path) -> Path:
+        return self._workspace
+
+
+class TreeLayout(WorkspaceLayout):
+    """
+    Mirrors the source tree in the workspace, so each directory holds no
+    more than its counterpart in the source.
+
+    Files already in the workspace produce files beside themselves. Files
+    from elsewhere are put in a directory named from a hash of the one they
+    are found in.
+    """
+    def __init__(self, workspace: Path, source: Optional[Path] = None):
+        """
+        :param source: Root of the source tree, which may be given later.
+        """
+        super().__init__(workspace)
+        self.source = source
+
+    def directory(self, location: Path) -> Path:
+        parent = location.parent
+        for root in [self._workspace, self.source]:
+            if root is None:
+                continue
+            try:
+                relative = parent.relative_to(root)
+            except ValueError:
+                continue
+            return self._workspace / relative
+        digest = hashlib.sha1(str(parent).encode()).hexdigest()[:12]
+        return self._workspace / f'_{digest}'
@@ -0,0 +1,504 @@
+##############################################################################
+# (c) Crown copyright Met Office. All rights reserved.
+# For further details please refer to the file COPYRIGHT
+# which you should have received as part of this distribution
+##############################################################################
+'''
+Prediction of the work a build would do, without doing any of it.
+'''
+from collections import Counter
+from pathlib import Path
+import sys
+from typing import \
+    Dict, \
+    Iterable, \
+    Iterator, \
+    List, \
+    Mapping, \
+    Optional, \
+    Sequence, \
+    Set, \
+    Tuple, \
+    Type, \
+    Union
+
+from fab import FabException
+from fab.artifact import \
+    Artifact, \
+    FileType, \
+    State, \
+    CHeader, \
+    CSource, \
+    Analysed, \
+    Compiled, \
+    BinaryObject, \
+    filetype_named, \
+    state_named
+from fab.database import \
+    SqliteStateDatabase, \
+    FileInfoDatabase, \
+    DerivedFileDatabase, \
+    MetricsDatabase
+from fab.engine import PathMap
+from fab.graph import TargetPruning
+from fab.source_tree import TreeDescent, TreeVisitor
+from fab.tasks import Task
+
+
+class PlannedStep(object):
+    """
+    One run of a task which the build is expected to make.
+    """
+    def __init__(self,
+                 stage: str,
+                 filename: Path,
+                 reason: str,
+                 after: Sequence['PlannedStep'] = ()):
+        """
+        :param stage: Name of the task.
+        :param filename: File the task would be run on.
+        :param reason: Why the task cannot be spared: "new", "changed",
+                       "header" (a header has changed), "missing" (the
+                       previous results are gone), "dependent" (something
+                       it depends on is recompiled), "rebuild" (nothing is
+                       being reused) or "link".
+        :param after: Steps which must be done first.
+        """
+        self.stage = stage
+        self.filename = filename
+        self.reason = reason
+        self.level: int = 1 + max((step.level for step in after), default=0)
+        self.estimate: Optional[float] = None
+        self.finish = 0.0
+        self._after = list(after)
+
+    def schedule(self, estimate: Optional[float]) -> None:
+        """
+        Notes how long the step took last time, if known, and from that
+        when it might finish given unlimited workers.
+        """
+        self.estimate = estimate
+        self.finish = (estimate or 0.0) \
+            + max((step.finish for step in self._after), default=0.0)
+
+
+class BuildPlan(object):
+    """
+    The steps a build is expected to take, in an order they might be taken.
+
+    Steps are arranged in waves. Everything in a wave depends only on
+    things in earlier waves so the size of each wave is the most work which
+    could be in progress at that point.
+    """
+    def __init__(self,
+                 target: str,
+                 files: Mapping[Path, str],
+                 steps: Sequence[PlannedStep],
+                 unknown: Sequence[Path]):
+        """
+        :param target: Program unit or symbol the build is for.
+        :param files: Each source file found and whether it is "new",
+                      "changed" or "unchanged" since the previous build.
+        :param steps: Expected runs of tasks.
+        :param unknown: Files about which too little is known to say what
+                        would become of them after their first step.
+        """
+        self._target = target
+        self._files = dict(files)
+        self._steps = sorted(steps, key=lambda step: step.level)
+        self._unknown = list(unknown)
+
+    @property
+    def steps(self) -> List[PlannedStep]:
+        return list(self._steps)
+
+    @property
+    def unknown(self) -> List[Path]:
+        return list(self._unknown)
+
+    def files(self, status: str) -> List[Path]:
+        return sorted(filename for filename, found in self._files.items()
+                      if found == status)
+
+    def profile(self) -> List[int]:
+        """
+        :return: Number of steps in each wave.
+        """
+        widths: List[int] = []
+        for step in self._steps:
+            while len(widths) < step.level:
+                widths.append(0)
+            widths[step.level - 1] += 1
+        return widths
+
+    def stages(self) -> Dict[str, Counter]:
+        """
+        :return: Number of steps for each reason, by task.
+        """
+        stages: Dict[str, Counter] = {}
+        for step in self._steps:
+            stages.setdefault(step.stage, Counter())[step.reason] += 1
+        return stages
+
+    def estimates(self) -> Tuple[float, float, int]:
+        """
+        :return: Seconds of work, seconds along the longest chain of work
+                 and the number of steps with no previous run to go on.
+        """
+        known = [step.estimate for step in self._steps
+                 if step.estimate is not None]
+        return (sum(known),
+                max((step.finish for step in self._steps), default=0.0),
+                len(self._steps) - len(known))
+
+    def report(self, stream=sys.stdout) -> None:
+        print(f"Build Plan for {self._target}", file=stream)
+        print(f"  Files        : {len(self._files)} "
+              f"({len(self.files('changed'))} changed, "
+              f"{len(self.files('new'))} new, "
+              f"{len(self.files('unchanged'))} unchanged)", file=stream)
+        for filename in self.files('changed') + self.files('new'):
+            print(f"    {self._files[filename]:9} : {filename}", file=stream)
+
+        print("  Steps", file=stream)
+        for stage, reasons in self.stages().items():
+            detail = ', '.join(f'{count} {reason}'
+                               for reason, count in sorted(reasons.items()))
+            print(f"    {stage:20} : {sum(reasons.values())} ({detail})",
+                  file=stream)
+        if any(step.reason == 'dependent' for step in self._steps):
+            print("    Dependent steps are spared if their prerequisites "
+                  "look the same", file=stream)
+        if self._unknown:
+            print(f"    Unknown beyond a first step : {len(self._unknown)} "
+                  f"files", file=stream)
+
+        work, longest, guessed = self.estimates()
+        print(f"  Estimated    : {work:.3f} s of work, "
+              f"{longest:.3f} s along the longest chain", file=stream)
+        if guessed:
+            print(f"    Not counting {guessed} steps never run before",
+                  file=stream)
+
+        profile = self.profile()
+        print(f"  Waves        : {len(profile)}, "
+              f"at most {max(profile, default=0)} steps at once", file=stream)
+        scale = max(1, -(-max(profile, default=0) // 50))
+        first = 0
+        for index, width in enumerate(profile):
+            # Runs of waves of the same size, typical of long chains, are
+            # shown once
+            if index + 1 < len(profile) and profile[index + 1] == width:
+                continue
+            waves = f'{first + 1}' if first == index \
+                else f'{first + 1}-{index + 1}'
+            print(f"    {waves:>11} : {width:6} "
+                  f"{'#' * -(-width // scale)}", file=stream)
+            first = index + 1
+
+        print("  Order", file=stream)
+        for step in self._steps:
+            print(f"    {step.level:6} {step.stage:20} {step.filename}",
+                  file=stream)
+
+
+# Filetype of an analysed file, the step which produced it, if it is to be
+# run, and the reason for running it.
+#
+_Analysed = Tuple[Type[FileType], Optional[PlannedStep], Optional[str]]
+
+
+class _FileFinder(TreeVisitor):
+    def __init__(self):
+        self.found: List[Path] = []
+
+    def visit(self, candidate: Path) -> None:
+        self.found.append(candidate)
+
+
+class Planner(object):
+    """
+    Works out what a build would do from what is recorded of the previous
+    one, running no tools and changing nothing.
+
+    Each file found is compared with the file information of the previous
+    build. Changed and new files must go through every task again. Unchanged
+    files retrace the steps recorded in the derived file records with no
+    need of any task, unless the results of a step have gone missing.
+
+    Which analysed files are compiled, and what they wait on, follows from
+    the program units and symbols of the previous analysis. Files are
+    recompiled if they have changed or anything they depend on is
+    recompiled. The latter is pessimistic, as a change which does not affect
+    what dependents see of a file spares them. Likewise any change to a
+    header is taken to affect every C file.
+
+    The predicted steps are given estimates from the metrics of the previous
+    runs of each task on each file.
+    """
+    def __init__(self,
+                 workspace: Path,
+                 target: Union[str, Sequence[str]],
+                 pathmaps: Sequence[PathMap],
+                 taskmap: Mapping[Tuple[Type[FileType], Type[State]], Task],
+                 incremental: bool = False,
+                 linkers: Optional[Mapping[str, Task]] = None,
+                 trust_stat: bool = False):
+        """
+        :param workspace: Directory holding the state of the previous build.
+        :param target: Program unit or symbol the build is for, or several
+                       of them.
+        :param pathmaps: Filetype and starting state of files found.
+        :param taskmap: Task for each filetype and state.
+        :param incremental: Whether the build would reuse the results of the
+                            previous one.
+        :param linkers: Task to link each target with, where it is not that
+                        of the task map for compiled objects.
+        :param trust_stat: Take files which look untouched since they were
+                           last hashed to be unchanged, as the build would.
+        """
+        self._targets = [target] if isinstance(target, str) else list(target)
+        self._pathmaps = pathmaps
+        self._taskmap = taskmap
+        self._incremental = incremental
+        self._linkers = dict(linkers or {})
+        self._trust_stat = trust_stat
+        self._database = SqliteStateDatabase(workspace)
+
+    def plan(self,
+             source: Path,
+             units: Iterable[Tuple[str, Path, Sequence[str]]],
+             pruning: Optional[TargetPruning] = None) -> BuildPlan:
+        """
+        :param source: Root of the source tree to be built.
+        :param units: Unit or symbol name, the file it was found in and the
+                      names of its prerequisites, from the previous build.
+        :param pruning: Which files the target needs, if unchanged files
+                        which it does not are to be left out.
+        :return: What the build is expected to do.
+        """
+        finder = _FileFinder()
+        TreeDescent(source).descend(finder)
+
+        # As when identifying files, the last matching path map wins
+        artifacts: List[Artifact] = []
+        for candidate in finder.found:
+            matched: Optional[Artifact] = None
+            for pathmap in self._pathmaps:
+                if candidate in pathmap:
+                    matched = Artifact(candidate,
+                                       pathmap.filetype,
+                                       pathmap.state)
+            if matched is not None:
+                artifacts.append(matched)
+
+        file_info = FileInfoDatabase(self._database)
+        files: Dict[Path, str] = {}
+        for artifact in artifacts:
+            try:
+                previous = file_info.get_file_info(artifact.location)
+            except FabException:
+                files[artifact.location] = 'new'
+                continue
+            if self._trust_stat \
+                    and previous.matches_stat(artifact.location.stat()):
+                artifact.hash = previous.hash
+            files[artifact.location] = 'unchanged' \
+                if previous.hash == artifact.hash else 'changed'
+        if pruning is not None:
+            artifacts = [artifact for artifact in artifacts
+                         if files[artifact.location] != 'unchanged'
+                         or pruning.needs(artifact.location)]
+        header_changed = any(files[artifact.location] != 'unchanged'
+                             for artifact in artifacts
+                             if artifact.filetype is CHeader)
+
+        steps: List[PlannedStep] = []
+        unknown: List[Path] = []
+        analysed: Dict[Path, _Analysed] = {}
+        for artifact in artifacts:
+            reason: Optional[str] = None
+            if not self._incremental:
+                reason = 'rebuild'
+            elif files[artifact.location] != 'unchanged':
+                reason = files[artifact.location]
+            elif header_changed and artifact.filetype is CSource:
+                reason = 'header'
+            if not self._retrace(artifact, reason, steps, analysed):
+                unknown.append(artifact.location)
+
+        defined_in: Dict[str, Set[Path]] = {}
+        prerequisites: Dict[Path, Set[str]] = {}
+        for name, found_in, depends_on in units:
+            if found_in not in analysed:
+                continue  # No longer part of the build
+            defined_in.setdefault(name, set()).add(found_in)
+            prerequisites.setdefault(found_in, set()).update(depends_on)
+        defining = {target: sorted(defined_in.get(target, ()))
+                    for target in self._targets}
+
+        # Linking is always done, once everything the target needs is
+        # compiled
+        compiles = self._compiles(analysed,
+                                  sorted({filename
+                                          for files in defining.values()
+                                          for filename in files}),
+                                  defined_in,
+                                  prerequisites)
+        steps.extend(step for step in compiles.values() if step is not None)
+        for target in self._targets:
+            linker = self._linkers.get(target) \
+                or self._taskmap.get((BinaryObject, Compiled))
+            if linker is None or not defining[target]:
+                continue
+            needed = self._needed(defining[target], defined_in,
+                                  prerequisites)
+            # The linker is known by the object it starts from
+            objects = DerivedFileDatabase(self._database) \
+                .get_derived_files(defining[target][0], Analysed.__name__)
+            steps.append(PlannedStep(type(linker).__name__,
+                                     objects[0].filename if objects
+                                     else defining[target][0],
+                                     'link',
+                                     [compiled
+                                      for compiled in (compiles.get(filename)
+                                                       for filename
+                                                       in sorted(needed))
+                                      if compiled is not None]))
+
+        metrics = MetricsDatabase(self._database)
+        for step in steps:
+            history = metrics.get_metrics(step.filename, step.stage)
+            step.schedule(history[0].wall if history else None)
+
+        return BuildPlan(', '.join(self._targets), files, steps, unknown)
+
+    def _retrace(self,
+                 artifact: Artifact,
+                 reason: Optional[str],
+                 steps: List[PlannedStep],
+                 analysed: Dict[Path, _Analysed]) -> bool:
+        # Follows a file through the tasks leading up to its compilation,
+        # returning whether the whole way is known
+        derived = DerivedFileDatabase(self._database)
+        to_follow: List[Tuple[Path, Type[FileType], Type[State],
+                              Optional[PlannedStep], Optional[str]]] \
+            = [(artifact.location, artifact.filetype, artifact.state,
+                None, reason)]
+        known = True
+        while to_follow:
+            location, filetype, state, before, why = to_follow.pop()
+            if state is Analysed:
+                analysed[location] = (filetype, before, why)
+                continue
+            task = self._taskmap.get((filetype, state))
+            if task is None:
+                continue
+
+            previous = derived.get_derived_files(location, state.__name__)
+            if why is None and (not previous
+                                or not all(info.filename.exists()
+                                           for info in previous)):
+                why = 'missing'
+            if why is not None:
+                before = PlannedStep(type(task).__name__,
+                                     location,
+                                     why,
+                                     [before] if before else [])
+                steps.append(before)
+            if not previous:
+                known = False
+                continue
+            for info in previous:
+                to_follow.append((info.filename,
+                                  filetype_named(info.filetype),
+                                  state_named(info.state),
+                                  before,
+                                  why))
+        return known
+
+    def _compiles(self,
+                  analysed: Mapping[Path, _Analysed],
+                  defining: Sequence[Path],
+                  defined_in: Mapping[str, Set[Path]],
+                  prerequisites: Mapping[Path, Set[str]]) \
+            -> Dict[Path, Optional[PlannedStep]]:
+        # Only files the targets depend on, directly or indirectly, are
+        # compiled. A file is planned once all its prerequisites are, one
+        # already on the path to it indicating a cycle which is ignored
+        #
+        derived = DerivedFileDatabase(self._database)
+        compiles: Dict[Path, Optional[PlannedStep]] = {}
+
+        def waiting_on(filename: Path) -> List[Path]:
+            return sorted({prerequisite
+                           for name in prerequisites.get(filename, ())
+                           for prerequisite in defined_in.get(name, ())
+                           if prerequisite != filename})
+
+        stack: List[Tuple[Path, Iterator[Path]]] = []
+        on_path: Set[Path] = set()
+        for start in defining:
+            if start in compiles:
+                continue
+            stack.append((start, iter(waiting_on(start))))
+            on_path.add(start)
+            while stack:
+                filename, remaining = stack[-1]
+                for prerequisite in remaining:
+                    if prerequisite not in compiles \
+                            and prerequisite not in on_path:
+                        stack.append((prerequisite,
+                                      iter(waiting_on(prerequisite))))
+                        on_path.add(prerequisite)
+                        break
+                else:
+                    stack.pop()
+                    on_path.discard(filename)
+                    recompiled = [compiles.get(prerequisite)
+                                  for prerequisite in waiting_on(filename)]
+                    compiles[filename] = self._compile_step(
+                        filename,
+                        analysed[filename],
+                        [step for step in recompiled if step is not None],
+                        derived)
+        return compiles
+
+    def _compile_step(self,
+                      filename: Path,
+                      analysed: _Analysed,
+                      recompiled: List[PlannedStep],
+                      derived: DerivedFileDatabase) -> Optional[PlannedStep]:
+        filetype, before, why = analysed
+        if why is None:
+            previous = derived.get_derived_files(filename, Analysed.__name__)
+            if not previous \
+                    or not all(info.filename.exists() for info in previous):
+                why = 'missing'
+            elif recompiled:
+                why = 'dependent'
+        if why is None:
+            return None
+        task = self._taskmap.get((filetype, Analysed))
+        if task is None:
+            return None
+        return PlannedStep(type(task).__name__,
+                           filename,
+                           why,
+                           recompiled + ([before] if before else []))
+
+    @staticmethod
+    def _needed(defining: Sequence[Path],
+                defined_in: Mapping[str, Set[Path]],
+                prerequisites: Mapping[Path, Set[str]]) -> Set[Path]:
+        # Files whose objects are linked along with those defining a target
+        needed: Set[Path] = set()
+        to_visit = list(defining)
+        while to_visit:
+            filename = to_visit.pop()
+            if filename in needed:
+                continue
+            needed.add(filename)
+            for name in prerequisites.get(filename, ()):
+                to_visit.extend(defined_in.get(name, ()))
+        return needed
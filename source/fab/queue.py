@@ -6,95 +6,456 @@
 '''
 Classes and methods relating to the queue system
 '''
+import heapq
+from itertools import count
 import logging
-from queue import Empty as QueueEmpty
-from typing import List, Dict
+from pathlib import Path
+from queue import Queue as LocalQueue
+import time
+from threading import Condition, Thread
+from typing import \
+    Any, \
+    Callable, \
+    Dict, \
+    Hashable, \
+    Iterable, \
+    List, \
+    Optional, \
+    Sequence, \
+    Set, \
+    Tuple, \
+    Union
 from multiprocessing import \
+    AuthenticationError, \
     Queue, \
-    JoinableQueue, \
-    Process, \
-    Lock, \
-    Manager, \
-    Event
-from multiprocessing.synchronize import Lock as LockT
-from multiprocessing.synchronize import Event as EventT
+    Process
 
 from fab.artifact import Artifact
-from fab.engine import Engine, DiscoveryState
+from fab.engine import Engine, Job
+from fab.governor import LoadGovernor
+from fab.graph import CriticalPath, DependencyGraph, DiscoveryState
+from fab.remote import RemoteWorker
+from fab.trace import Trace
+from fab.tasks import Resource
 
 
-def _worker(queue: JoinableQueue,
-            engine: Engine,
-            discovery: Dict[str, DiscoveryState],
-            objects: List[Artifact],
-            lock: LockT,
-            stopswitch: EventT):
-    while not stopswitch.is_set():
-        try:
-            artifact = queue.get(block=True, timeout=0.5)
-        except QueueEmpty:
-            continue
+# Placed on a queue to tell whoever is reading it to stop.
+#
+_STOP = None
 
-        try:
-            new_artifacts = engine.process(artifact,
-                                           discovery,
-                                           objects,
-                                           lock)
 
-            for new_artifact in new_artifacts:
-                queue.put(new_artifact)
-        finally:
-            queue.task_done()
+# Sent back in place of an error by a remote worker which has lost its
+# connection, along with a job it has not done.
+#
+_HANDED_BACK = object()
+
+
+def _execute(engine: Engine,
+             job: Job,
+             worker: int) -> Tuple[Job, Optional[str]]:
+    job.worker = worker
+    error: Optional[str] = None
+    try:
+        job = engine.execute(job)
+    except Exception as err:
+        error = f'{type(err).__name__}: {err}'
+    return job, error
+
+
+def _worker(jobs: Any,
+            results: Any,
+            engine: Union[Engine, Callable[[], Engine]],
+            worker: int = 0):
+    if not isinstance(engine, Engine):
+        engine = engine()
+    for job in iter(jobs.get, _STOP):
+        results.put(_execute(engine, job, worker))
+
+
+def _remote_worker(jobs: Any,
+                   results: Any,
+                   engine: Engine,
+                   remote: RemoteWorker,
+                   worker: int = 0):
+    # Once the connection is lost the coordinator is told, so as to stop
+    # counting on it, and any job which still comes this way is handed
+    # back to be done by a local worker
+    with remote:
+        for job in iter(jobs.get, _STOP):
+            if not remote.connected:
+                results.put((job, _HANDED_BACK))
+                continue
+            results.put(_execute(engine, job, worker))
+            if not remote.connected:
+                results.put(remote)
+
+
+def _relay(source: Queue, destination: LocalQueue):
+    for message in iter(source.get, _STOP):
+        destination.put(message)
+
+
+class _ReadyJobs(object):
+    """
+    Jobs waiting for a worker, most important first.
+
+    Jobs which may be done together are also held by their batch key, so
+    that those to go with a job are taken from the front of a heap of their
+    own. Having been taken they are passed over when they come to the
+    front of the heap of all jobs.
+    """
+    def __init__(self, engine: Engine):
+        self._engine = engine
+        self._all: List[Tuple[Tuple[int, int], int, Job]] = []
+        self._by_key: Dict[Hashable,
+                           List[Tuple[Tuple[int, int], int, Job]]] = {}
+        self._taken: Set[int] = set()
+
+    def __bool__(self) -> bool:
+        return bool(self._all)
+
+    def first(self) -> Tuple[Tuple[int, int], int]:
+        """
+        :return: Priority and sequence number of the most important job.
+        """
+        priority, sequence, _ = self._all[0]
+        return priority, sequence
+
+    def push(self, priority: Tuple[int, int], sequence: int, job: Job):
+        entry = (priority, sequence, job)
+        heapq.heappush(self._all, entry)
+        key = self._engine.batch_key(job)
+        if key is not None:
+            heapq.heappush(self._by_key.setdefault(key, []), entry)
+
+    def take(self) -> Job:
+        """
+        Takes the most important job along with as many of the most
+        important of those which may be done alongside it as make a batch.
+        """
+        _, _, job = heapq.heappop(self._all)
+        key = self._engine.batch_key(job)
+        if key is not None:
+            # The job is at the front of its own heap too
+            alike = self._by_key[key]
+            heapq.heappop(alike)
+            while alike and len(job.batch) < self._engine.batch_size - 1:
+                _, sequence, batched = heapq.heappop(alike)
+                self._taken.add(sequence)
+                job.batch.append(batched)
+            if not alike:
+                del self._by_key[key]
+        while self._all and self._all[0][1] in self._taken:
+            _, sequence, _ = heapq.heappop(self._all)
+            self._taken.remove(sequence)
+        return job
 
 
 class QueueManager(object):
-    def __init__(self, n_workers: int, engine: Engine):
-        self._queue: Queue = JoinableQueue()
+    """
+    Processes artifacts with a pool of workers.
+
+    A coordinator holds the dependency graph and decides what is to be done
+    with each artifact. Workers do the work and report back, leaving the
+    coordinator to record the results. In this way the state of the build is
+    only ever looked at or changed in the one place.
+
+    Tasks which spend their time waiting on an external tool are run by
+    threads, as they need not hold the interpreter lock. Tasks which work in
+    Python are run by processes so they may proceed in parallel. Each task
+    declares which it is. Between them the workers are only given as many
+    jobs at once as there are workers of each kind.
+
+    Jobs which may be done on another machine are also offered to remote
+    workers, each being a connection to a fab-worker, which are kept busy in
+    addition to the local workers. Should the connection to one be lost it
+    is no longer counted on, and jobs on their way to it are done locally.
+
+    A governor may be given to vary how many of the workers are kept busy
+    according to how busy the machine is.
+
+    Worker processes may be given a way of making the engine in place of
+    the engine itself, which they then make once for themselves. This saves
+    sending every task where processes are not forked.
+
+    Everything blocks until it has something to do, be that work or being
+    told to stop, so nothing is left waiting on a timer.
+    """
+    def __init__(self,
+                 n_workers: int,
+                 engine: Engine,
+                 ranking: Optional[CriticalPath] = None,
+                 governor: Optional[LoadGovernor] = None,
+                 remotes: Sequence[RemoteWorker] = (),
+                 trace: Optional[Trace] = None,
+                 bootstrap: Optional[Callable[[], Engine]] = None):
         self._n_workers = n_workers
-        self._workers: List[int] = []
+        self._remotes = list(remotes)
+        self._trace = trace
+        self._governor = governor
+        self._workers: List[Union[Process, Thread]] = []
         self._engine = engine
-        self._mgr = Manager()
-        self._discovery: Dict[str, DiscoveryState] = self._mgr.dict({})
-        self._stopswitch: EventT = Event()
-        self._objects: List[Artifact] = self._mgr.list([])
-        self._lock = Lock()
+        self._bootstrap = bootstrap
+        self._graph = DependencyGraph(engine.target)
+        self._ranking = ranking
         self.logger = logging.getLogger(__name__)
 
+        # Thread workers report straight to the coordinator, process workers
+        # by way of a relay.
+        #
+        self._inbox: LocalQueue = LocalQueue()
+        self._results: Queue = Queue()
+        self._jobs: Dict[Resource, Any] = {Resource.CPU: Queue(),
+                                           Resource.SUBPROCESS: LocalQueue()}
+        self._remote_jobs: LocalQueue = LocalQueue()
+
+        # Jobs waiting for a worker, most important first. Without a ranking
+        # they are served first come, first served. Those which may go to a
+        # remote worker are kept apart.
+        #
+        self._ready = _ReadyJobs(engine)
+        self._portable = _ReadyJobs(engine)
+        self._sequence = count()
+        self._in_flight = 0
+        self._remote_in_flight = 0
+        self._connected = 0
+        self._slots = n_workers
+        if governor is not None:
+            self._slots = min(n_workers, governor.initial)
+
+        # Artifacts somewhere between being added and their job completing.
+        #
+        self._outstanding = 0
+        self._idle = Condition()
+
+        self._relay: Optional[Thread] = None
+        self._coordinator: Optional[Thread] = None
+
+        # Artifacts whose job raised, along with what it raised.
+        #
+        self._failures: List[Tuple[Path, str]] = []
+
+    def unchanged(self, paths: Iterable[Path]) -> None:
+        """
+        Records files known to be as they were in the previous build. This
+        must be done before any artifact for them is added.
+        """
+        self._graph.unchanged(paths)
+
     def add_to_queue(self, artifact: Artifact):
-        self._queue.put(artifact)
+        self._count(1)
+        self._inbox.put(artifact)
 
     def run(self):
-        for _ in range(self._n_workers):
-            process = Process(
-                target=_worker, args=(self._queue,
-                                      self._engine,
-                                      self._discovery,
-                                      self._objects,
-                                      self._lock,
-                                      self._stopswitch))
-            process.start()
-            self._workers.append(process)
+        # Processes are started before any threads as forking a process
+        # with threads running risks copying locks which are held.
+        #
+        for resource in [Resource.CPU, Resource.SUBPROCESS]:
+            for index in range(self._n_workers):
+                identifier = len(self._workers) + 1
+                if resource is Resource.CPU:
+                    worker: Union[Process, Thread] \
+                        = Process(target=_worker,
+                                  args=(self._jobs[resource],
+                                        self._results,
+                                        self._bootstrap or self._engine,
+                                        identifier))
+                    name = f'Process {index + 1}'
+                else:
+                    worker = Thread(target=_worker,
+                                    args=(self._jobs[resource],
+                                          self._inbox,
+                                          self._engine,
+                                          identifier),
+                                    daemon=True)
+                    name = f'Thread {index + 1}'
+                worker.start()
+                self._workers.append(worker)
+                if self._trace is not None:
+                    self._trace.name_worker(identifier, name)
+
+        # Workers which cannot be reached are done without
+        connected: List[RemoteWorker] = []
+        for remote in self._remotes:
+            try:
+                remote.connect()
+            except (OSError, EOFError, AuthenticationError) as err:
+                self.logger.warning('Unable to use worker at %s:%d: %s',
+                                    *remote.address, err)
+                continue
+            identifier = len(self._workers) + 1
+            worker = Thread(target=_remote_worker,
+                            args=(self._remote_jobs,
+                                  self._inbox,
+                                  self._engine,
+                                  remote,
+                                  identifier),
+                            daemon=True)
+            worker.start()
+            self._workers.append(worker)
+            connected.append(remote)
+            if self._trace is not None:
+                self._trace.name_worker(
+                    identifier,
+                    'Remote {0}:{1}'.format(*remote.address))
+        self._remotes = connected
+        self._connected = len(connected)
+
+        self._relay = Thread(target=_relay,
+                             args=(self._results, self._inbox),
+                             daemon=True)
+        self._relay.start()
+        self._workers.append(self._relay)
+
+        self._coordinator = Thread(target=self._coordinate, daemon=True)
+        self._coordinator.start()
 
     def check_queue_done(self):
-        # Blocks until the JoinableQueue is empty
-        self._queue.join()
+        # Blocks until every artifact has been processed
+        with self._idle:
+            while self._outstanding > 0:
+                self._idle.wait()
+
+    def unresolved(self) -> Set[str]:
+        """
+        :return: Units or symbols depended upon which nothing has yet been
+                 found to define.
+        """
+        return {name
+                for name, state in self._graph.discovery().items()
+                if state is DiscoveryState.AWARE_OF}
+
+    def failures(self) -> List[Tuple[Path, str]]:
+        """
+        :return: Location of each artifact whose job failed, along with why.
+        """
+        return list(self._failures)
+
+    def blocked(self) -> Dict[Path, Set[Union[str, Path]]]:
+        """
+        :return: Artifacts still waiting on prerequisites, along with what
+                 they are waiting for.
+        """
+        return self._graph.blocked()
 
     def shutdown(self):
-        # Set the stop switch and wait for workers
-        # to finish
-        self._stopswitch.set()
-        for process in self._workers:
-            process.join(10.0)
-
-        # Any that didn't finish nicely at this point
-        # can be forcibly stopped
-        for i_worker, process in enumerate(self._workers):
-            if process.is_alive():
-                msg = f"Terminating thread {i_worker}..."
-                self.logger.warn(msg)
-                process.terminate()
-
-        # Stop the queue
-        self._queue.close()
-        self._queue.join_thread()
+        # Each worker stops on reaching its stop message, so finishes any
+        # work queued ahead of it first
+        for queue in self._jobs.values():
+            for _ in range(self._n_workers):
+                queue.put(_STOP)
+        for remote in self._remotes:
+            self._remote_jobs.put(_STOP)
+        for worker in self._workers:
+            if worker is not self._relay:
+                worker.join()
+
+        # Only once the processes have gone is it known that nothing more
+        # will come through the relay, or need to go to the coordinator
+        if self._relay is not None:
+            self._results.put(_STOP)
+            self._relay.join()
+            self._relay = None
+        if self._coordinator is not None:
+            self._inbox.put(_STOP)
+            self._coordinator.join()
+            self._coordinator = None
+
+        # Stop the queues
+        for queue in [self._jobs[Resource.CPU], self._results]:
+            queue.close()
+            queue.join_thread()
+        for remote in self._remotes:
+            remote.close()
         self._workers.clear()
+
+    def _coordinate(self):
+        for message in iter(self._inbox.get, _STOP):
+            if isinstance(message, Artifact):
+                self._accept(message)
+            elif isinstance(message, RemoteWorker):
+                self.logger.warning('No longer using worker at %s:%d',
+                                    *message.address)
+                self._connected -= 1
+            elif message[1] is _HANDED_BACK:
+                job = message[0]
+                self._remote_in_flight -= 1
+                for returned in [job] + job.batch:
+                    returned.remote = False
+                    returned.batch = []
+                    self._push(returned, self._ready)
+            else:
+                job, error = message
+                if job.remote:
+                    self._remote_in_flight -= 1
+                else:
+                    self._in_flight -= 1
+                if self._trace is not None:
+                    for traced in [job] + job.batch:
+                        for span in traced.spans:
+                            self._trace.add(span,
+                                            traced.worker,
+                                            span.start - traced.ready)
+                if error is None:
+                    for artifact in self._engine.complete(job, self._graph):
+                        self._count(1)
+                        self._accept(artifact)
+                else:
+                    for failed in [job] + job.batch:
+                        self.logger.error('Failed to process "%s": %s',
+                                          failed.artifact.location, error)
+                        self._failures.append((failed.artifact.location,
+                                               error))
+                self._count(-1 - len(job.batch))
+            self._dispatch()
+
+    def _accept(self, artifact: Artifact) -> None:
+        pending = [artifact]
+        while pending:
+            job, claimed = self._engine.prepare(pending.pop(), self._graph)
+            for claimed_artifact in claimed:
+                self._count(1)
+                pending.append(claimed_artifact)
+            if job is None:
+                self._count(-1)
+            else:
+                job.ready = time.time()
+                ready = self._ready
+                if self._connected and self._engine.is_portable(job):
+                    ready = self._portable
+                self._push(job, ready)
+
+    def _push(self, job: Job, ready: _ReadyJobs) -> None:
+        priority = (0, 0)
+        if self._ranking is not None:
+            priority = self._ranking.priority(job.artifact)
+        ready.push(priority, next(self._sequence), job)
+
+    def _dispatch(self) -> None:
+        if self._governor is not None:
+            self._slots = min(self._n_workers,
+                              self._governor.slots(self._slots))
+
+        # Remote workers take what they can, leaving local workers to take
+        # whatever is most important of the rest
+        while self._portable \
+                and self._remote_in_flight < self._connected:
+            job = self._portable.take()
+            job.remote = True
+            self._remote_jobs.put(job)
+            self._remote_in_flight += 1
+
+        while self._in_flight < self._slots:
+            waiting = [ready for ready in [self._ready, self._portable]
+                       if ready]
+            if not waiting:
+                break
+            job = min(waiting, key=lambda ready: ready.first()).take()
+            self._jobs[self._engine.resource(job.artifact)].put(job)
+            self._in_flight += 1
+
+    def _count(self, change: int) -> None:
+        with self._idle:
+            self._outstanding += change
+            if self._outstanding == 0:
+                self._idle.notify_all()
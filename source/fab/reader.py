@@ -3,9 +3,158 @@
 # For further details please refer to the file COPYRIGHT
 # which you should have received as part of this distribution
 ##############################################################################
+"""
+Reading source files.
+
+A file is read from disk as few times as possible, the stages which look
+at it (hashing, scanning for includes, injecting pragmas) sharing one
+buffer of its contents:
+
+* Within a shared_reads() block, such as a job, a file is read no more
+  than once and a file written is not read back.
+* Beyond that each process keeps what it has read, up to a limit, for as
+  long as the file looks untouched going by its modification time, size
+  and inode. A file rewritten by an external tool is therefore read
+  afresh. Worker processes forked after the source tree has been hashed
+  start out with what was read in doing so.
+
+Hashing, which decides whether a file has changed, always reads afresh.
+"""
 from abc import ABC, abstractmethod
+from collections import OrderedDict
+from contextlib import contextmanager
+import io
 from pathlib import Path
-from typing import IO, Iterator, List, Text, Union
+import threading
+import time
+from typing import Dict, IO, Iterator, List, Optional, Text, Tuple, Union
+
+
+_shared = threading.local()
+
+# Contents of files read by this process, most recently used last, with
+# the status each had when read.
+#
+KEEP_LIMIT = 64 * 1024 ** 2
+_Status = Tuple[int, int, int]
+_kept: 'OrderedDict[Path, Tuple[_Status, bytes]]' = OrderedDict()
+_kept_size = 0
+_kept_lock = threading.Lock()
+
+# A file modified this recently could be modified again without its
+# modification time changing, so is not kept.
+#
+_RACY_SECONDS = 2.0
+
+
+def _status(path: Path) -> Tuple[_Status, float]:
+    status = path.stat()
+    return (status.st_mtime_ns, status.st_size, status.st_ino), \
+        status.st_mtime
+
+
+def _recall(path: Path) -> Optional[bytes]:
+    # Whatever this process has kept of a file, if it looks untouched since
+    try:
+        status, _ = _status(path)
+    except OSError:
+        return None
+    with _kept_lock:
+        entry = _kept.get(path)
+        if entry is None or entry[0] != status:
+            return None
+        _kept.move_to_end(path)
+        return entry[1]
+
+
+def _keep(path: Path, status: _Status, content: bytes) -> None:
+    global _kept_size
+    with _kept_lock:
+        previous = _kept.pop(path, None)
+        if previous is not None:
+            _kept_size -= len(previous[1])
+        _kept[path] = (status, content)
+        _kept_size += len(content)
+        while _kept_size > KEEP_LIMIT:
+            _, (_, dropped) = _kept.popitem(last=False)
+            _kept_size -= len(dropped)
+
+
+def forget_sources() -> None:
+    """
+    Drops everything this process has kept of the files it has read.
+    """
+    global _kept_size
+    with _kept_lock:
+        _kept.clear()
+        _kept_size = 0
+
+
+@contextmanager
+def shared_reads() -> Iterator[None]:
+    """
+    Keeps the contents of files read or written through this module until
+    the block ends. Blocks may be nested, the outermost deciding when the
+    contents are dropped.
+
+    Files must not be changed by other means, such as an external tool,
+    within the block once they have been read through it.
+    """
+    if getattr(_shared, 'buffers', None) is not None:
+        yield
+        return
+    _shared.buffers = {}
+    try:
+        yield
+    finally:
+        _shared.buffers = None
+
+
+def shared_content(path: Path) -> Optional[bytes]:
+    """
+    :return: Contents of the file if already read or written in the current
+             shared_reads() block, otherwise None.
+    """
+    buffers: Optional[Dict[Path, bytes]] = getattr(_shared, 'buffers', None)
+    if buffers is None:
+        return None
+    return buffers.get(path)
+
+
+def read_source(path: Path, fresh: bool = False) -> bytes:
+    """
+    :param fresh: Read the file from disk unless it was read or written in
+                  the current shared_reads() block, rather than take what
+                  this process kept of it. What is read is kept all the
+                  same.
+    :return: Contents of the file, read from disk only if not already held.
+    """
+    buffers: Optional[Dict[Path, bytes]] = getattr(_shared, 'buffers', None)
+    content = shared_content(path)
+    if content is None and not fresh:
+        content = _recall(path)
+    if content is None:
+        # The status is taken first so that a change while reading shows
+        # up as a difference next time
+        status, modified = _status(path)
+        content = path.read_bytes()
+        if time.time() - modified > _RACY_SECONDS \
+                and len(content) <= KEEP_LIMIT:
+            _keep(path, status, content)
+    if buffers is not None:
+        buffers[path] = content
+    return content
+
+
+def write_source(path: Path, content: bytes) -> None:
+    """
+    Writes a file, keeping its contents for anything which reads it later
+    in the current shared_reads() block.
+    """
+    path.write_bytes(content)
+    buffers: Optional[Dict[Path, bytes]] = getattr(_shared, 'buffers', None)
+    if buffers is not None:
+        buffers[path] = content
 
 
 class TextReader(ABC):
@@ -32,8 +181,8 @@ class FileTextReader(TextReader):
 
     def get_handle(self):
         if self._handle is None:
-            self._handle: IO[Text] = \
-                self._filename.open(encoding='utf-8')
+            self._handle: IO[Text] = io.TextIOWrapper(
+                io.BytesIO(read_source(self._filename)), encoding='utf-8')
         return self._handle
 
     @property
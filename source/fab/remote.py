@@ -0,0 +1,280 @@
+##############################################################################
+# (c) Crown copyright Met Office. All rights reserved.
+# For further details please refer to the file COPYRIGHT
+# which you should have received as part of this distribution
+##############################################################################
+"""
+Running commands on other machines on behalf of a build.
+
+A build may make use of workers started elsewhere with the fab-worker tool.
+Each is sent a command along with the files it reads and returns the files
+it writes. The command runs in a scratch directory standing in for the
+workspace so nothing need be shared between the machines but the tools
+themselves.
+
+Workers and builds share a key, taken from the environment, which each
+checks of the other before anything is sent. Anyone with the key may run
+what they like on a worker so it should be kept as safe as any password.
+"""
+import logging
+import os
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import \
+    Client, \
+    Connection, \
+    Listener
+from pathlib import Path
+import subprocess
+import sys
+import tempfile
+import threading
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from fab import FabException
+from fab.reader import read_source
+
+KEY_VARIABLE = 'FAB_WORKER_KEY'
+
+
+class RemoteUnavailable(FabException):
+    pass
+
+
+def get_key() -> bytes:
+    """
+    :return: Key shared between a build and its workers.
+    """
+    key = os.environ.get(KEY_VARIABLE)
+    if not key:
+        raise FabException(f'The environment variable {KEY_VARIABLE} must '
+                           f'hold the key shared with workers')
+    return key.encode()
+
+
+def parse_address(text: str) -> Tuple[str, int]:
+    """
+    :param text: Address in the form HOST:PORT.
+    :return: Host name and port number.
+    """
+    host, _, port = text.rpartition(':')
+    if not host or not port.isdigit():
+        raise ValueError(f'"{text}" is not of the form HOST:PORT')
+    return host, int(port)
+
+
+# The worker each thread sends its commands to, if any.
+#
+_assignment = threading.local()
+
+
+def current_remote() -> Optional['RemoteWorker']:
+    """
+    :return: Worker to which commands from this thread should be sent.
+    """
+    worker = getattr(_assignment, 'worker', None)
+    if worker is None or not worker.connected:
+        return None
+    return worker
+
+
+class RemoteWorker(object):
+    """
+    Connection to a worker on another machine.
+
+    Used as a context manager it becomes the destination of commands from
+    the thread using it.
+    """
+    def __init__(self, address: Tuple[str, int], key: bytes):
+        self._address = address
+        self._key = key
+        self._connection: Optional[Connection] = None
+
+    @property
+    def address(self) -> Tuple[str, int]:
+        return self._address
+
+    @property
+    def connected(self) -> bool:
+        return self._connection is not None
+
+    def connect(self) -> None:
+        self._connection = Client(self._address, authkey=self._key)
+
+    def close(self) -> None:
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+    def __enter__(self) -> 'RemoteWorker':
+        _assignment.worker = self
+        return self
+
+    def __exit__(self, *args) -> None:
+        _assignment.worker = None
+
+    def run(self,
+            command: Sequence[str],
+            workspace: Path,
+            inputs: Sequence[Path],
+            outputs: Sequence[Path]) -> None:
+        """
+        Runs a command on the worker as though it were run in the workspace.
+
+        Inputs and outputs are known by name alone and the workspace stood
+        in for by the directory the command runs in. Arguments naming any of
+        them are changed to suit.
+
+        :param command: Command to run.
+        :param workspace: Directory the command would use for working files.
+        :param inputs: Files the command reads.
+        :param outputs: Files the command may write, which are returned.
+        :raises subprocess.CalledProcessError: If the command fails.
+        :raises RemoteUnavailable: If the worker cannot be reached, in which
+                                   case the command has not been run and
+                                   the worker is no longer used.
+        """
+        if self._connection is None:
+            raise RemoteUnavailable(
+                f'Not connected to worker at {self._address}')
+
+        names = {str(path): path.name for path in [*inputs, *outputs]}
+        remote_command = [names.get(argument,
+                                    argument.replace(str(workspace), '.'))
+                          for argument in command]
+        files = {path.name: read_source(path) for path in inputs}
+        try:
+            self._connection.send((remote_command,
+                                   files,
+                                   [path.name for path in outputs]))
+            returncode, output, results = self._connection.recv()
+        except (EOFError, OSError) as err:
+            logging.getLogger(__name__).warning(
+                'Lost worker at %s:%d: %s', *self._address, err)
+            self.close()
+            raise RemoteUnavailable(
+                f'Lost worker at {self._address}') from err
+
+        if output:
+            sys.stderr.write(output)
+        for path in outputs:
+            if path.name in results:
+                path.write_bytes(results[path.name])
+        if returncode != 0:
+            raise subprocess.CalledProcessError(returncode, list(command))
+
+
+class WorkerServer(object):
+    """
+    Runs commands sent by builds.
+
+    Each connection is served by a thread of its own, one command at a
+    time, so a build can have a worker do as many things at once as it has
+    connections open.
+    """
+    def __init__(self, address: Tuple[str, int], key: bytes):
+        self._listener = Listener(address, authkey=key)
+        self._closed = False
+        self.logger = logging.getLogger(__name__)
+
+    @property
+    def address(self) -> Tuple[str, int]:
+        return self._listener.address
+
+    def serve_forever(self) -> None:
+        while not self._closed:
+            try:
+                connection = self._listener.accept()
+            except (OSError, AuthenticationError) as err:
+                if not self._closed:
+                    self.logger.warning('Refused connection: %s', err)
+                continue
+            thread = threading.Thread(target=self._serve,
+                                      args=(connection,),
+                                      daemon=True)
+            thread.start()
+
+    def close(self) -> None:
+        self._closed = True
+        self._listener.close()
+
+    def _serve(self, connection: Connection) -> None:
+        with connection:
+            while True:
+                try:
+                    command, files, wanted = connection.recv()
+                except (EOFError, OSError):
+                    return
+                connection.send(self._run(command, files, wanted))
+
+    def _run(self,
+             command: List[str],
+             files: Dict[str, bytes],
+             wanted: List[str]) -> Tuple[int, str, Dict[str, bytes]]:
+        with tempfile.TemporaryDirectory(prefix='fab-worker-') as scratch:
+            directory = Path(scratch)
+            for name, content in files.items():
+                if Path(name).name != name:
+                    return 1, f'Refusing to write "{name}"\n', {}
+                (directory / name).write_bytes(content)
+
+            self.logger.info('Running %s', ' '.join(command))
+            try:
+                process = subprocess.run(command,
+                                         cwd=scratch,
+                                         stdout=subprocess.PIPE,
+                                         stderr=subprocess.STDOUT,
+                                         universal_newlines=True)
+            except OSError as err:
+                return 1, f'{err}\n', {}
+
+            results = {name: (directory / name).read_bytes()
+                       for name in wanted
+                       if Path(name).name == name
+                       and (directory / name).is_file()}
+            return process.returncode, process.stdout, results
+
+
+def entry() -> None:
+    """
+    Entry point for the Fab build worker.
+    """
+    import argparse
+    import fab
+
+    logger = logging.getLogger('fab')
+    logger.addHandler(logging.StreamHandler(sys.stderr))
+
+    description = 'Run commands on behalf of Fab builds on other machines.'
+    parser = argparse.ArgumentParser(add_help=False,
+                                     description=description)
+    # We add our own help so as to capture as many permutations of how people
+    # might ask for help. The default only looks for a subset.
+    parser.add_argument('-h', '-help', '--help', action='help',
+                        help='Print this help and exit')
+    parser.add_argument('-V', '--version', action='version',
+                        version=fab.__version__,
+                        help='Print version identifier and exit')
+    parser.add_argument('-v', '--verbose', action='store_true',
+                        help='Produce a running commentary on progress')
+    parser.add_argument('address', metavar='HOST:PORT', type=parse_address,
+                        help='Address to accept builds on')
+    arguments = parser.parse_args()
+
+    if arguments.verbose:
+        logger.setLevel(logging.INFO)
+    else:
+        logger.setLevel(logging.WARNING)
+
+    try:
+        key = get_key()
+    except FabException as err:
+        parser.error(str(err))
+
+    server = WorkerServer(arguments.address, key)
+    logger.warning('Accepting builds on %s:%d', *server.address)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
@@ -8,7 +8,7 @@ Descend a directory tree or trees processing source files found along the way.
 """
 from abc import ABC, abstractmethod
 from pathlib import Path
-from typing import Callable
+from typing import Callable, Iterator
 from fab.artifact import Artifact, Unknown, New
 
 
@@ -35,6 +35,14 @@ class TreeDescent(object):
         self._root = root
 
     def descend(self, visitor: TreeVisitor):
+        for candidate in self.files():
+            visitor.visit(candidate)
+
+    def files(self) -> Iterator[Path]:
+        """
+        Finds the files of the tree as they are asked for, so they may be
+        dealt with while the rest are still being looked for.
+        """
         to_visit = [self._root]
         while len(to_visit) > 0:
             candidate: Path = to_visit.pop()
@@ -45,4 +53,4 @@ class TreeDescent(object):
             # At this point the object should be a file, directories having
             # been dealt with previously.
             #
-            visitor.visit(candidate)
+            yield candidate
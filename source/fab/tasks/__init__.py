@@ -5,7 +5,15 @@
 Base classes for defining the main task units run by Fab.
 '''
 from abc import ABC, abstractmethod
-from typing import List
+from contextlib import contextmanager
+from enum import Enum, auto
+import os
+from pathlib import Path
+import subprocess
+import sys
+import threading
+import time
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
 
 from fab.artifact import Artifact
 
@@ -14,7 +22,225 @@ class TaskException(Exception):
     pass
 
 
+class Resource(Enum):
+    """
+    What a task spends its time doing, which decides where it is best run.
+    """
+    # Working in Python so holding the interpreter lock.
+    #
+    CPU = auto()
+    # Waiting on an external tool such as a compiler.
+    #
+    SUBPROCESS = auto()
+
+
+# Time each thread has spent waiting on other programs, and what those
+# programs have used.
+#
+_waiting = threading.local()
+
+
+@contextmanager
+def timed_subprocess() -> Iterator[None]:
+    """
+    Counts the time spent within towards that spent on other programs.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _waiting.seconds = subprocess_time() + time.perf_counter() - start
+
+
+def subprocess_time() -> float:
+    """
+    :return: Seconds this thread has spent waiting on other programs.
+    """
+    return getattr(_waiting, 'seconds', 0.0)
+
+
+class ChildUsage(object):
+    """
+    Resources used by the programs a task runs.
+    """
+    def __init__(self):
+        self.cpu = 0.0
+        self.peak_rss = 0
+        self.bytes_read = 0
+        self.bytes_written = 0
+
+    def add(self, other: 'ChildUsage') -> None:
+        self.cpu += other.cpu
+        self.peak_rss = max(self.peak_rss, other.peak_rss)
+        self.bytes_read += other.bytes_read
+        self.bytes_written += other.bytes_written
+
+
+@contextmanager
+def measure_children() -> Iterator[ChildUsage]:
+    """
+    Totals the resources used by programs run by this thread within.
+    """
+    outer = getattr(_waiting, 'usage', None)
+    usage = ChildUsage()
+    _waiting.usage = usage
+    try:
+        yield usage
+    finally:
+        _waiting.usage = outer
+        if outer is not None:
+            outer.add(usage)
+
+
+# Compiler options followed by a file or directory, and those which may
+# also have it joined on.
+#
+_PATH_OPTIONS = ('-I', '-J', '-o')
+_JOINED_PATH_OPTIONS = ('-I', '-J')
+
+
+def absolute_command(command: List[str],
+                     paths: Iterable[Path]) -> List[str]:
+    """
+    Makes the paths a command is given absolute, so that it may be run in
+    another directory.
+
+    :param command: Program and its arguments.
+    :param paths: Files given as arguments in their own right. Those given
+                  to options which name a path are recognised anyway.
+    :return: The command with each path it names made absolute.
+    """
+    named = {str(path) for path in paths}
+    result: List[str] = []
+    follows_option = False
+    for argument in command:
+        if follows_option or argument in named:
+            argument = os.path.abspath(argument)
+        else:
+            for option in _JOINED_PATH_OPTIONS:
+                if argument.startswith(option) and argument != option:
+                    argument = option \
+                        + os.path.abspath(argument[len(option):])
+                    break
+        follows_option = argument in _PATH_OPTIONS
+        result.append(argument)
+    return result
+
+
+def run_command(command: List[str], cwd: Optional[Path] = None) -> None:
+    """
+    Runs a program, as subprocess.run(command, check=True) would, noting
+    the time it takes and the resources it uses.
+
+    :param command: Program and its arguments.
+    :param cwd: Directory to run the program in.
+    :raises subprocess.CalledProcessError: If the program fails.
+    """
+    with timed_subprocess():
+        process = subprocess.Popen(command,
+                                   cwd=None if cwd is None else str(cwd))
+        try:
+            usage = _wait(process)
+        except BaseException:
+            process.kill()
+            process.wait()
+            raise
+    if usage is not None:
+        current = getattr(_waiting, 'usage', None)
+        if current is not None:
+            current.add(usage)
+    if process.returncode != 0:
+        raise subprocess.CalledProcessError(process.returncode, command)
+
+
+def _wait(process: subprocess.Popen) -> Optional[ChildUsage]:
+    # Resource use is only to be had from the operating system as the
+    # program is reaped, and what it read and wrote only before then.
+    #
+    if not hasattr(os, 'wait4'):
+        process.wait()
+        return None
+
+    usage = ChildUsage()
+    if hasattr(os, 'waitid') and hasattr(os, 'WNOWAIT'):
+        os.waitid(os.P_PID, process.pid, os.WEXITED | os.WNOWAIT)
+        usage.bytes_read, usage.bytes_written \
+            = read_io(Path(f'/proc/{process.pid}/io'))
+    _, status, rusage = os.wait4(process.pid, 0)
+    if os.WIFSIGNALED(status):
+        process.returncode = -os.WTERMSIG(status)
+    else:
+        process.returncode = os.WEXITSTATUS(status)
+
+    usage.cpu = rusage.ru_utime + rusage.ru_stime
+    usage.peak_rss = rusage.ru_maxrss
+    if sys.platform != 'darwin':
+        usage.peak_rss *= 1024  # Given in kilobytes
+    if usage.bytes_read == 0 and usage.bytes_written == 0:
+        usage.bytes_read = rusage.ru_inblock * 512
+        usage.bytes_written = rusage.ru_oublock * 512
+    return usage
+
+
+def read_io(path: Path) -> Tuple[int, int]:
+    """
+    :param path: I/O accounting file from the /proc filesystem.
+    :return: Bytes read and written, or nothing if unavailable.
+    """
+    counts = {}
+    try:
+        with path.open() as io_file:
+            for line in io_file:
+                name, _, value = line.partition(':')
+                counts[name] = int(value)
+    except (OSError, ValueError):
+        pass
+    return counts.get('rchar', 0), counts.get('wchar', 0)
+
+
 class Task(ABC):
+    resource: Resource = Resource.CPU
+
+    # Whether the task may be given several independent artifacts at once,
+    # in which case it produces a result for each in turn.
+    #
+    batchable: bool = False
+
+    # Whether the task may be run by a worker on another machine, in which
+    # case it sends its commands to fab.remote.current_remote() when there
+    # is one.
+    #
+    portable: bool = False
+
     @abstractmethod
     def run(self, artifacts: List[Artifact]) -> List[Artifact]:
         raise NotImplementedError('Abstract methods must be implemented')
+
+    def restore(self,
+                artifact: Artifact,
+                previous: List[Artifact]) -> List[Artifact]:
+        """
+        Reconstitutes the results of running this task on an unchanged file.
+
+        Only the locations, filetypes and states of previous results are
+        recorded. Tasks which attach anything else to their results must
+        override this to put it back.
+
+        :param artifact: Artifact the task would be run on.
+        :param previous: Results of the previous run of the task.
+        :return: Results as if the task had been run.
+        """
+        return previous
+
+    def fingerprints(self, artifact: Artifact) -> Optional[Dict[str, str]]:
+        """
+        Describes what other files see of the definitions in an artifact.
+
+        Files which depend on a definition need only be processed again if
+        its fingerprint changes. By default nothing is known, in which case
+        any change to the artifact is assumed to affect its dependents.
+
+        :param artifact: Artifact the task has just been run on.
+        :return: Fingerprint of each definition, or None if unknown.
+        """
+        return None
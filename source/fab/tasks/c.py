@@ -4,11 +4,11 @@
 """
 C language handling classes.
 """
-import subprocess
 import re
 import clang.cindex  # type: ignore
 from collections import deque
 from typing import \
+    Dict, \
     List, \
     Iterator, \
     Pattern, \
@@ -25,7 +25,16 @@ from fab.database import \
     FileInfoDatabase, \
     SqliteStateDatabase, \
     WorkingStateException
-from fab.tasks import Task, TaskException
+from fab.cache import ObjectCache
+from fab.layout import FlatLayout, WorkspaceLayout
+from fab.remote import RemoteUnavailable, RemoteWorker, current_remote
+from fab.tasks import \
+    Resource, \
+    Task, \
+    TaskException, \
+    absolute_command, \
+    run_command, \
+    timed_subprocess
 from fab.artifact import \
     Artifact, \
     Raw, \
@@ -36,7 +45,8 @@ from fab.artifact import \
 from fab.reader import \
     TextReader, \
     FileTextReader, \
-    TextReaderDecorator
+    TextReaderDecorator, \
+    write_source
 
 
 class CSymbolUnresolvedID(object):
@@ -245,6 +255,28 @@ class CWorkingState(DatabaseDecorator):
             raise WorkingStateException(message.format(symbol=name))
         return info_list
 
+    def get_file_symbols(self, filename: Union[Path, str]) -> List[CInfo]:
+        """
+        Gets the details of the symbols found in a source file.
+        :param filename: Source file.
+        :return: List of symbol information objects. May be an empty list.
+        """
+        query = '''select s.symbol, s.found_in, p.prerequisite
+                   from c_symbol as s
+                   left join c_prerequisite as p
+                   on p.symbol = s.symbol and p.found_in = s.found_in
+                   where s.found_in=:filename
+                   order by s.id, p.id'''
+        rows = self.execute(query, {'filename': str(filename)})
+        info_list: List[CInfo] = []
+        for row in rows:
+            symbol_id = CSymbolID(row['symbol'], Path(row['found_in']))
+            if len(info_list) == 0 or info_list[-1].symbol != symbol_id:
+                info_list.append(CInfo(symbol_id))
+            if row['prerequisite'] is not None:
+                info_list[-1].add_prerequisite(row['prerequisite'])
+        return info_list
+
     def depends_on(self, symbol: CSymbolID)\
             -> Generator[CSymbolID, None, None]:
         """
@@ -381,6 +413,17 @@ class CAnalyser(Task):
 
         return [new_artifact]
 
+    def restore(self,
+                artifact: Artifact,
+                previous: List[Artifact]) -> List[Artifact]:
+        state = CWorkingState(self.database)
+        for new_artifact in previous:
+            for info in state.get_file_symbols(new_artifact.location):
+                new_artifact.add_definition(info.symbol.name)
+                for prerequisite in info.depends_on:
+                    new_artifact.add_dependency(prerequisite)
+        return previous
+
 
 class _CTextReaderPragmas(TextReaderDecorator):
     """
@@ -424,8 +467,11 @@ class _CTextReaderPragmas(TextReaderDecorator):
 
 
 class CPragmaInjector(Task):
-    def __init__(self, workspace: Path):
+    def __init__(self,
+                 workspace: Path,
+                 layout: Optional[WorkspaceLayout] = None):
         self._workspace = workspace
+        self._layout = layout or FlatLayout(workspace)
 
     def run(self, artifacts: List[Artifact]) -> List[Artifact]:
 
@@ -439,13 +485,11 @@ class CPragmaInjector(Task):
         injector = _CTextReaderPragmas(
             FileTextReader(artifact.location))
 
-        output_file = self._workspace / artifact.location.name
+        output_file = self._layout.path(artifact.location)
 
         out_lines = [line for line in injector.line_by_line()]
 
-        with output_file.open('w') as out_file:
-            for line in out_lines:
-                out_file.write(line)
+        write_source(output_file, ''.join(out_lines).encode('utf-8'))
 
         new_artifact = Artifact(output_file,
                                 artifact.filetype,
@@ -455,15 +499,27 @@ class CPragmaInjector(Task):
 
         return [new_artifact]
 
+    def restore(self,
+                artifact: Artifact,
+                previous: List[Artifact]) -> List[Artifact]:
+        for new_artifact in previous:
+            for dependency in artifact.depends_on:
+                new_artifact.add_dependency(dependency)
+        return previous
+
 
 class CPreProcessor(Task):
+    resource = Resource.SUBPROCESS
+
     def __init__(self,
                  preprocessor: str,
                  flags: List[str],
-                 workspace: Path):
+                 workspace: Path,
+                 layout: Optional[WorkspaceLayout] = None):
         self._preprocessor = preprocessor
         self._flags = flags
         self._workspace = workspace
+        self._layout = layout or FlatLayout(workspace)
 
     def run(self, artifacts: List[Artifact]) -> List[Artifact]:
 
@@ -480,17 +536,15 @@ class CPreProcessor(Task):
 
         # Use temporary output name (in case the given tool
         # can't operate in-place)
-        output_file = (self._workspace /
-                       artifact.location.with_suffix('.fabcpp').name)
+        output_file = self._layout.path(artifact.location, '.fabcpp')
 
         command.append(str(output_file))
-        subprocess.run(command, check=True)
+        run_command(command)
 
         # Overwrite actual output file
-        final_output = (self._workspace /
-                        artifact.location.name)
+        final_output = self._layout.path(artifact.location)
         command = ["mv", str(output_file), str(final_output)]
-        subprocess.run(command, check=True)
+        run_command(command)
 
         return [Artifact(final_output,
                          artifact.filetype,
@@ -498,38 +552,133 @@ class CPreProcessor(Task):
 
 
 class CCompiler(Task):
+    resource = Resource.SUBPROCESS
+    batchable = True
+    portable = True
 
     def __init__(self,
                  compiler: str,
                  flags: List[str],
-                 workspace: Path):
+                 workspace: Path,
+                 cache: Optional[ObjectCache] = None,
+                 layout: Optional[WorkspaceLayout] = None):
         self._compiler = compiler
         self._flags = flags
         self._workspace = workspace
+        self._cache = cache
+        self._layout = layout or FlatLayout(workspace)
 
     def run(self, artifacts: List[Artifact]) -> List[Artifact]:
+        """
+        Compiles files which are independent of one another.
 
-        if len(artifacts) == 1:
-            artifact = artifacts[0]
-        else:
-            msg = ('C Compiler expects only one Artifact, '
-                   f'but was given {len(artifacts)}')
+        :param artifacts: Files to compile.
+        :return: Object file of each artifact, in the same order.
+        """
+        if len(artifacts) == 0:
+            msg = 'C Compiler expects at least one Artifact'
             raise TaskException(msg)
 
+        # The same file may well have been compiled in the same way in some
+        # other workspace, in which case the result may be taken from there
+        keys: Dict[Path, str] = {}
+        to_compile: List[Artifact] = []
+        for artifact in artifacts:
+            if self._cache is not None:
+                key = self._cache.key(self._compiler,
+                                      self._flags,
+                                      artifact.location,
+                                      line_markers=True)
+                if self._cache.fetch(key,
+                                     self._object_file(artifact),
+                                     self._workspace):
+                    continue
+                keys[artifact.location] = key
+            to_compile.append(artifact)
+
+        if to_compile:
+            self._compile(to_compile)
+
+        object_artifacts: List[Artifact] = []
+        for artifact in artifacts:
+            output_file = self._object_file(artifact)
+            if self._cache is not None and artifact.location in keys:
+                self._cache.store(keys[artifact.location], output_file)
+
+            object_artifact = Artifact(output_file,
+                                       BinaryObject,
+                                       Compiled)
+            for definition in artifact.defines:
+                object_artifact.add_definition(definition)
+            object_artifacts.append(object_artifact)
+
+        return object_artifacts
+
+    def _object_file(self, artifact: Artifact) -> Path:
+        return self._layout.path(artifact.location, '.o')
+
+    def _compile(self, artifacts: List[Artifact]) -> None:
+        if len(artifacts) == 1:
+            command = [self._compiler]
+            command.extend(self._flags)
+            command.append(str(artifacts[0].location))
+            command.extend(['-o', str(self._object_file(artifacts[0]))])
+            self._execute(command, artifacts)
+            return
+
+        # Given several files the compiler names each object after its
+        # source and puts it in the working directory. Files which would
+        # end up with the same name, or whose objects belong in different
+        # directories, must be compiled separately.
+        #
+        names = [self._object_file(artifact) for artifact in artifacts]
+        if len(set(names)) < len(names) \
+                or len({name.parent for name in names}) > 1:
+            for artifact in artifacts:
+                self._compile([artifact])
+            return
         command = [self._compiler]
         command.extend(self._flags)
-        command.append(str(artifact.location))
-
-        output_file = (self._workspace /
-                       artifact.location.with_suffix('.o').name)
-        command.extend(['-o', str(output_file)])
-
-        subprocess.run(command, check=True)
-
-        object_artifact = Artifact(output_file,
-                                   BinaryObject,
-                                   Compiled)
-        for definition in artifact.defines:
-            object_artifact.add_definition(definition)
-
-        return [object_artifact]
+        command.extend(str(artifact.location) for artifact in artifacts)
+        self._execute(command, artifacts, names[0].parent)
+
+    def _execute(self,
+                 command: List[str],
+                 artifacts: List[Artifact],
+                 cwd: Optional[Path] = None) -> None:
+        remote = current_remote()
+        if remote is not None:
+            try:
+                with timed_subprocess():
+                    self._execute_remotely(remote, command, artifacts)
+                return
+            except RemoteUnavailable:
+                pass  # Done here instead
+        if cwd is not None:
+            # Paths given relative to here must still be found from there
+            command = absolute_command(
+                command, [artifact.location for artifact in artifacts])
+        run_command(command, cwd)
+
+    def _execute_remotely(self,
+                          remote: RemoteWorker,
+                          command: List[str],
+                          artifacts: List[Artifact]) -> None:
+        # Preprocessed source needs nothing else to compile
+        remote.run(command,
+                   self._workspace,
+                   [artifact.location for artifact in artifacts],
+                   [self._object_file(artifact) for artifact in artifacts])
+
+    def restore(self,
+                artifact: Artifact,
+                previous: List[Artifact]) -> List[Artifact]:
+        for object_artifact in previous:
+            for definition in artifact.defines:
+                object_artifact.add_definition(definition)
+        return previous
+
+    def fingerprints(self, artifact: Artifact) -> Optional[Dict[str, str]]:
+        # Other files see only declarations from headers, never the
+        # compiled symbols themselves
+        return {definition: '' for definition in artifact.defines}
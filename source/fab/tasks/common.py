@@ -4,7 +4,7 @@
 
 import re
 import subprocess
-from typing import List, Optional, Match
+from typing import Dict, List, Optional, Match
 from pathlib import Path
 
 from fab.artifact import \
@@ -12,20 +12,43 @@ from fab.artifact import \
     Executable, \
     HeadersAnalysed, \
     Linked
-from fab.tasks import Task, TaskException
+from fab.tasks import \
+    Resource, \
+    Task, \
+    TaskException, \
+    run_command, \
+    timed_subprocess
+from fab.layout import FlatLayout, WorkspaceLayout
 from fab.reader import FileTextReader
 
 
 class Linker(Task):
+    """
+    Links objects into an executable.
+
+    Given an archiver the objects are first gathered into a static archive
+    for each directory they are in, and the executable linked from those.
+    Each archive is kept from one link to the next and only the members
+    which have changed since are replaced, so a small change means little
+    work however many objects there are.
+    """
+    resource = Resource.SUBPROCESS
+
     def __init__(self,
                  linker: str,
                  flags: List[str],
                  workspace: Path,
-                 output_filename: str):
+                 output_filename: str,
+                 archiver: Optional[str] = None):
+        """
+        :param archiver: Program maintaining static archives, such as "ar",
+                         if objects are to be linked by way of archives.
+        """
         self._linker = linker
         self._flags = flags
         self._workspace = workspace
         self._output_filename = output_filename
+        self._archiver = archiver
 
     def run(self, artifacts: List[Artifact]) -> List[Artifact]:
 
@@ -39,24 +62,88 @@ class Linker(Task):
         output_file = self._workspace / self._output_filename
 
         command.extend(['-o', str(output_file)])
-        for artifact in artifacts:
-            command.append(str(artifact.location))
+        if self._archiver is None:
+            for artifact in artifacts:
+                command.append(str(artifact.location))
+        else:
+            # Archives may refer to one another in any order
+            command.append('-Wl,--start-group')
+            command.extend(str(archive)
+                           for archive in self._archive(self._archiver,
+                                                        artifacts))
+            command.append('-Wl,--end-group')
 
         command.extend(self._flags)
 
-        subprocess.run(command, check=True)
+        run_command(command)
 
         return [Artifact(output_file,
                          Executable,
                          Linked)]
 
+    def _archive(self,
+                 archiver: str,
+                 artifacts: List[Artifact]) -> List[Path]:
+        directories: Dict[Path, List[Path]] = {}
+        for artifact in artifacts:
+            directories.setdefault(artifact.location.parent, []) \
+                .append(artifact.location)
+
+        archives: List[Path] = []
+        for directory, objects in directories.items():
+            # Each executable has archives of its own as they hold only the
+            # objects it needs
+            archive = directory / f'lib{self._output_filename}.a'
+            try:
+                self._update_archive(archiver, archive, objects)
+            except BaseException:
+                # A half updated archive cannot be trusted next time
+                if archive.exists():
+                    archive.unlink()
+                raise
+            archives.append(archive)
+        return archives
+
+    @staticmethod
+    def _update_archive(archiver: str,
+                        archive: Path,
+                        objects: List[Path]) -> None:
+        if not archive.exists():
+            run_command([archiver, 'rcs', str(archive)]
+                        + [str(member) for member in objects])
+            return
+
+        # Members are known by name alone. Those no longer wanted are
+        # removed, and those which are new or have been written since the
+        # archive last was are replaced
+        written = archive.stat().st_mtime_ns
+        with timed_subprocess():
+            listing = subprocess.run([archiver, 't', str(archive)],
+                                     check=True,
+                                     stdout=subprocess.PIPE,
+                                     universal_newlines=True)
+        members = set(listing.stdout.split())
+        unwanted = sorted(members - {member.name for member in objects})
+        if unwanted:
+            run_command([archiver, 'ds', str(archive)] + unwanted)
+
+        changed = [member for member in objects
+                   if member.name not in members
+                   or member.stat().st_mtime_ns >= written]
+        if changed:
+            run_command([archiver, 'rcs', str(archive)]
+                        + [str(member) for member in changed])
+
 
 class HeaderAnalyser(Task):
     _include_re = r'^\s*#include\s+(\S+)'
     _include_pattern = re.compile(_include_re)
 
-    def __init__(self, workspace: Path):
+    def __init__(self,
+                 workspace: Path,
+                 layout: Optional[WorkspaceLayout] = None):
         self._workspace = workspace
+        self._layout = layout or FlatLayout(workspace)
 
     def run(self, artifacts: List[Artifact]) -> List[Artifact]:
         if len(artifacts) == 1:
@@ -77,8 +164,16 @@ class HeaderAnalyser(Task):
             if include_match:
                 include: str = include_match.group(1)
                 if include.startswith(('"', "'")):
+                    # Looked for beside the including file, where the
+                    # header will have been put in the workspace
                     include = include.strip('"').strip("'")
-                    new_artifact.add_dependency(
-                        Path(self._workspace / include))
+                    new_artifact.add_dependency(self._layout.path(
+                        artifact.location.parent / include))
 
         return [new_artifact]
+
+    def restore(self,
+                artifact: Artifact,
+                previous: List[Artifact]) -> List[Artifact]:
+        # Includes are not recorded and scanning for them is cheap
+        return self.run([artifact])
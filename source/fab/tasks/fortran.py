@@ -4,11 +4,12 @@
 """
 Fortran language handling classes.
 """
+import hashlib
 import logging
 from pathlib import Path
 import re
-import subprocess
-from typing import (Generator,
+from typing import (Dict,
+                    Generator,
                     Iterator,
                     List,
                     Match,
@@ -23,9 +24,16 @@ from fab.database import (DatabaseDecorator,
                           StateDatabase,
                           SqliteStateDatabase,
                           WorkingStateException)
+from fab.cache import ObjectCache
+from fab.layout import FlatLayout, WorkspaceLayout
+from fab.remote import RemoteUnavailable, RemoteWorker, current_remote
 from fab.tasks import \
+    Resource, \
     Task, \
-    TaskException
+    TaskException, \
+    absolute_command, \
+    run_command, \
+    timed_subprocess
 from fab.reader import TextReader, TextReaderDecorator, FileTextReader
 from fab.artifact import \
     Artifact, \
@@ -98,6 +106,10 @@ class FortranWorkingState(DatabaseDecorator):
     #
     _FORTRAN_LABEL_LENGTH: int = 63
 
+    # Module file fingerprints are hexadecimal SHA-256 digests.
+    #
+    _FINGERPRINT_LENGTH: int = 64
+
     def __init__(self, database: StateDatabase):
         super().__init__(database)
         create_unit_table = [
@@ -133,6 +145,21 @@ class FortranWorkingState(DatabaseDecorator):
         ]
         self.execute(create_prerequisite_table, {})
 
+        # Compiling a module writes a module file describing its interface.
+        # Only when that changes need the units which use it be recompiled.
+        #
+        create_module_table = [
+            f'''create table if not exists fortran_module (
+                id integer primary key,
+                unit character({self._FORTRAN_LABEL_LENGTH}) not null,
+                found_in character({FileInfoDatabase.PATH_LENGTH}) not null,
+                fingerprint character({self._FINGERPRINT_LENGTH}) not null
+                )''',
+            '''create index if not exists idx_fortran_module
+                   on fortran_module (found_in)'''
+        ]
+        self.execute(create_module_table, {})
+
     def __iter__(self) -> Generator[FortranInfo, None, None]:
         """
         Yields all units and their containing file names.
@@ -203,10 +230,46 @@ class FortranWorkingState(DatabaseDecorator):
         remove_file = [
             '''delete from fortran_prerequisite
                where found_in = :filename''',
-            '''delete from fortran_unit where found_in=:filename'''
+            '''delete from fortran_unit where found_in=:filename''',
+            '''delete from fortran_module where found_in=:filename'''
             ]
         self.execute(remove_file, {'filename': str(filename)})
 
+    def set_module_fingerprints(self,
+                                filename: Union[Path, str],
+                                fingerprints: Dict[str, str]) -> None:
+        """
+        Records the module files resulting from compiling a source file.
+
+        Any previous record for the file is replaced.
+
+        :param filename: Source file.
+        :param fingerprints: Fingerprint of the module file of each module.
+        """
+        self.execute('''delete from fortran_module
+                        where found_in = :filename''',
+                     {'filename': str(filename)})
+        for unit, fingerprint in fingerprints.items():
+            self.execute('''insert into fortran_module
+                              (unit, found_in, fingerprint)
+                            values (:unit, :filename, :fingerprint)''',
+                         {'unit': unit,
+                          'filename': str(filename),
+                          'fingerprint': fingerprint})
+
+    def get_module_fingerprints(self,
+                                filename: Union[Path, str]) -> Dict[str, str]:
+        """
+        Gets the module files which resulted from compiling a source file.
+
+        :param filename: Source file.
+        :return: Fingerprint of the module file of each module.
+        """
+        query = '''select unit, fingerprint from fortran_module
+                   where found_in = :filename'''
+        rows = self.execute(query, {'filename': str(filename)})
+        return {row['unit']: row['fingerprint'] for row in rows}
+
     def get_program_unit(self, name: str) -> List[FortranInfo]:
         """
         Gets the details of program units given their name.
@@ -248,6 +311,31 @@ class FortranWorkingState(DatabaseDecorator):
             raise WorkingStateException(message.format(unit=name))
         return info_list
 
+    def get_file_program_units(self,
+                               filename: Union[Path, str]) \
+            -> List[FortranInfo]:
+        """
+        Gets the details of the program units found in a source file.
+
+        :param filename: Source file.
+        :return: List of unit information objects. May be an empty list.
+        """
+        query = '''select u.unit, u.found_in, p.prerequisite
+                   from fortran_unit as u
+                   left join fortran_prerequisite as p
+                   on p.unit = u.unit and p.found_in = u.found_in
+                   where u.found_in=:filename
+                   order by u.id, p.id'''
+        rows = self.execute(query, {'filename': str(filename)})
+        info_list: List[FortranInfo] = []
+        for row in rows:
+            unit_id = FortranUnitID(row['unit'], Path(row['found_in']))
+            if len(info_list) == 0 or info_list[-1].unit != unit_id:
+                info_list.append(FortranInfo(unit_id))
+            if row['prerequisite'] is not None:
+                info_list[-1].add_prerequisite(row['prerequisite'])
+        return info_list
+
     def depends_on(self, unit: FortranUnitID)\
             -> Generator[FortranUnitID, None, None]:
         """
@@ -486,15 +574,30 @@ class FortranAnalyser(Task):
 
         return [new_artifact]
 
+    def restore(self,
+                artifact: Artifact,
+                previous: List[Artifact]) -> List[Artifact]:
+        state = FortranWorkingState(self.database)
+        for new_artifact in previous:
+            for info in state.get_file_program_units(new_artifact.location):
+                new_artifact.add_definition(info.unit.name)
+                for prerequisite in info.depends_on:
+                    new_artifact.add_dependency(prerequisite)
+        return previous
+
 
 class FortranPreProcessor(Task):
+    resource = Resource.SUBPROCESS
+
     def __init__(self,
                  preprocessor: str,
                  flags: List[str],
-                 workspace: Path):
+                 workspace: Path,
+                 layout: Optional[WorkspaceLayout] = None):
         self._preprocessor = preprocessor
         self._flags = flags
         self._workspace = workspace
+        self._layout = layout or FlatLayout(workspace)
 
     def run(self, artifacts: List[Artifact]) -> List[Artifact]:
 
@@ -509,50 +612,188 @@ class FortranPreProcessor(Task):
         command.extend(self._flags)
         command.append(str(artifact.location))
 
-        output_file = (self._workspace /
-                       artifact.location.with_suffix('.f90').name)
+        output_file = self._layout.path(artifact.location, '.f90')
         command.append(str(output_file))
 
-        subprocess.run(command, check=True)
+        run_command(command)
 
         return [Artifact(output_file,
                          artifact.filetype,
                          Raw)]
 
 
+def _fingerprint(module: Path) -> str:
+    return hashlib.sha256(module.read_bytes()).hexdigest()
+
+
 class FortranCompiler(Task):
+    resource = Resource.SUBPROCESS
+    batchable = True
+    portable = True
 
     def __init__(self,
                  compiler: str,
                  flags: List[str],
-                 workspace: Path):
+                 workspace: Path,
+                 cache: Optional[ObjectCache] = None,
+                 layout: Optional[WorkspaceLayout] = None):
+        """
+        :param layout: Where objects are put. Module files are always put
+                       in the top of the workspace.
+        """
         self._compiler = compiler
         self._flags = flags
         self._workspace = workspace
+        self._cache = cache
+        self._layout = layout or FlatLayout(workspace)
+        self.database = SqliteStateDatabase(workspace)
 
     def run(self, artifacts: List[Artifact]) -> List[Artifact]:
+        """
+        Compiles files which are independent of one another.
 
-        if len(artifacts) == 1:
-            artifact = artifacts[0]
-        else:
-            msg = ('Fortran Compiler expects only one Artifact, '
-                   f'but was given {len(artifacts)}')
+        :param artifacts: Files to compile.
+        :return: Object file of each artifact, in the same order.
+        """
+        if len(artifacts) == 0:
+            msg = 'Fortran Compiler expects at least one Artifact'
             raise TaskException(msg)
 
-        command = [self._compiler]
-        command.extend(self._flags)
-        command.append(str(artifact.location))
-
-        output_file = (self._workspace /
-                       artifact.location.with_suffix('.o').name)
-        command.extend(['-o', str(output_file)])
-
-        subprocess.run(command, check=True)
+        # The same unit may well have been compiled in the same way in some
+        # other workspace, in which case the results may be taken from there
+        keys: Dict[Path, str] = {}
+        to_compile: List[Artifact] = []
+        for artifact in artifacts:
+            if self._cache is not None:
+                key = self._cache.key(self._compiler,
+                                      [flag.replace(str(self._workspace), '')
+                                       for flag in self._flags],
+                                      artifact.location,
+                                      self._prerequisites(artifact))
+                if self._cache.fetch(key,
+                                     self._object_file(artifact),
+                                     self._workspace):
+                    continue
+                keys[artifact.location] = key
+            to_compile.append(artifact)
 
-        object_artifact = Artifact(output_file,
-                                   BinaryObject,
-                                   Compiled)
-        for definition in artifact.defines:
-            object_artifact.add_definition(definition)
+        if to_compile:
+            self._compile(to_compile)
 
-        return [object_artifact]
+        state = FortranWorkingState(self.database)
+        object_artifacts: List[Artifact] = []
+        for artifact in artifacts:
+            output_file = self._object_file(artifact)
+            modules = [self._workspace / f'{definition}.mod'
+                       for definition in artifact.defines]
+            modules = [module for module in modules if module.exists()]
+            if self._cache is not None and artifact.location in keys:
+                self._cache.store(keys[artifact.location],
+                                  output_file,
+                                  modules)
+            state.set_module_fingerprints(
+                artifact.location,
+                {module.stem: _fingerprint(module) for module in modules})
+
+            object_artifact = Artifact(output_file,
+                                       BinaryObject,
+                                       Compiled)
+            for definition in artifact.defines:
+                object_artifact.add_definition(definition)
+            object_artifacts.append(object_artifact)
+
+        return object_artifacts
+
+    def _object_file(self, artifact: Artifact) -> Path:
+        return self._layout.path(artifact.location, '.o')
+
+    def _prerequisites(self, artifact: Artifact) -> List[Path]:
+        # Module files which may be used, although those for modules
+        # provided by the compiler will not exist
+        return [self._workspace / f'{dependency}.mod'
+                for dependency in artifact.depends_on
+                if isinstance(dependency, str)]
+
+    def _compile(self, artifacts: List[Artifact]) -> None:
+        if len(artifacts) == 1:
+            command = [self._compiler]
+            command.extend(self._flags)
+            command.append(str(artifacts[0].location))
+            command.extend(['-o', str(self._object_file(artifacts[0]))])
+            self._execute(command, artifacts)
+            return
+
+        # Given several files the compiler names each object after its
+        # source and puts it in the working directory. Files which would
+        # end up with the same name, or whose objects belong in different
+        # directories, must be compiled separately.
+        #
+        names = [self._object_file(artifact) for artifact in artifacts]
+        if len(set(names)) < len(names) \
+                or len({name.parent for name in names}) > 1:
+            for artifact in artifacts:
+                self._compile([artifact])
+            return
+        command = [self._compiler]
+        command.extend(self._flags)
+        command.extend(str(artifact.location) for artifact in artifacts)
+        self._execute(command, artifacts, names[0].parent)
+
+    def _execute(self,
+                 command: List[str],
+                 artifacts: List[Artifact],
+                 cwd: Optional[Path] = None) -> None:
+        remote = current_remote()
+        if remote is not None:
+            try:
+                with timed_subprocess():
+                    self._execute_remotely(remote, command, artifacts)
+                return
+            except RemoteUnavailable:
+                pass  # Done here instead
+        if cwd is not None:
+            # Paths given relative to here must still be found from there
+            command = absolute_command(
+                command, [artifact.location for artifact in artifacts])
+        run_command(command, cwd)
+
+    def _execute_remotely(self,
+                          remote: RemoteWorker,
+                          command: List[str],
+                          artifacts: List[Artifact]) -> None:
+        # Elsewhere the compiler has only the files it is sent
+        inputs: Dict[Path, None] = {}
+        outputs: List[Path] = []
+        for artifact in artifacts:
+            inputs[artifact.location] = None
+            for module in self._prerequisites(artifact):
+                if module.exists():
+                    inputs[module] = None
+            outputs.append(self._object_file(artifact))
+            outputs.extend(self._workspace / f'{definition}.mod'
+                           for definition in artifact.defines)
+        remote.run(command, self._workspace, list(inputs), outputs)
+
+    def restore(self,
+                artifact: Artifact,
+                previous: List[Artifact]) -> List[Artifact]:
+        # The module files must still be those the compilation produced
+        state = FortranWorkingState(self.database)
+        recorded = state.get_module_fingerprints(artifact.location)
+        for definition, fingerprint in recorded.items():
+            module = self._workspace / f'{definition}.mod'
+            if not module.exists() or _fingerprint(module) != fingerprint:
+                return self.run([artifact])
+
+        for object_artifact in previous:
+            for definition in artifact.defines:
+                object_artifact.add_definition(definition)
+        return previous
+
+    def fingerprints(self, artifact: Artifact) -> Optional[Dict[str, str]]:
+        # Only modules may be used by other units and they only see the
+        # module file. Anything else has no fingerprint.
+        state = FortranWorkingState(self.database)
+        recorded = state.get_module_fingerprints(artifact.location)
+        return {definition: recorded.get(definition, '')
+                for definition in artifact.defines}
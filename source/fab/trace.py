@@ -0,0 +1,87 @@
+##############################################################################
+# (c) Crown copyright Met Office. All rights reserved.
+# For further details please refer to the file COPYRIGHT
+# which you should have received as part of this distribution
+##############################################################################
+'''
+Timeline of a build, for viewing with a trace viewer.
+'''
+import json
+from pathlib import Path
+import time
+from typing import Dict, List, Sequence
+
+
+class Span(object):
+    """
+    One run of a task.
+    """
+    def __init__(self,
+                 task: str,
+                 paths: Sequence[Path],
+                 start: float,
+                 duration: float,
+                 subprocess: float):
+        """
+        :param task: Name of the task class.
+        :param paths: Files the task was run on.
+        :param start: When the run started, in seconds since the epoch.
+        :param duration: Seconds the run took.
+        :param subprocess: Seconds of the run spent waiting on other
+                           programs.
+        """
+        self.task = task
+        self.paths = list(paths)
+        self.start = start
+        self.duration = duration
+        self.subprocess = subprocess
+
+
+class Trace(object):
+    """
+    Collects the runs of tasks by each worker and writes them out in the
+    Chrome trace event format.
+    """
+    def __init__(self):
+        self._origin = time.time()
+        self._workers: Dict[int, str] = {}
+        self._events: List[Dict] = []
+
+    def name_worker(self, worker: int, name: str) -> None:
+        self._workers[worker] = name
+
+    def add(self, span: Span, worker: int, queue_wait: float) -> None:
+        """
+        :param span: Run of a task.
+        :param worker: Identifies the worker which ran the task.
+        :param queue_wait: Seconds between the work being ready and
+                           being started.
+        """
+        self._events.append({
+            'name': span.task,
+            'cat': 'task',
+            'ph': 'X',
+            'ts': self._microseconds(span.start - self._origin),
+            'dur': self._microseconds(span.duration),
+            'pid': 0,
+            'tid': worker,
+            'args': {'paths': [str(path) for path in span.paths],
+                     'queue_wait_ms': round(queue_wait * 1000.0, 3),
+                     'subprocess_ms': round(span.subprocess * 1000.0, 3)}
+        })
+
+    def write(self, path: Path) -> None:
+        names = [{'name': 'thread_name',
+                  'ph': 'M',
+                  'pid': 0,
+                  'tid': worker,
+                  'args': {'name': name}}
+                 for worker, name in sorted(self._workers.items())]
+        with path.open('w') as trace_file:
+            json.dump({'traceEvents': names + self._events,
+                       'displayTimeUnit': 'ms'},
+                      trace_file)
+
+    @staticmethod
+    def _microseconds(seconds: float) -> int:
+        return int(round(seconds * 1000000.0))
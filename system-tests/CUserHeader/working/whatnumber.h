@@ -0,0 +1,9 @@
+#ifndef WHATNUMBER
+#define WHATNUMBER
+/* (c) Crown copyright Met Office. All rights reserved.
+  For further details please refer to the file COPYRIGHT
+  which you should have received as part of this distribution */
+
+void whatnumber(int number);
+
+#endif
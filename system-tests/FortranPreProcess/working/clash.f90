@@ -0,0 +1,29 @@
+
+
+
+
+
+
+
+
+
+
+
+! (c) Crown copyright Met Office. All rights reserved.
+! For further details please refer to the file COPYRIGHT
+! which you should have received as part of this distribution
+!
+program stay_or_go_now
+
+    use iso_fortran_env, only: output_unit
+    use constants_mod, only : str_len
+    
+    use go_now_mod, only: go_now
+
+    character(str_len) :: message
+
+    call go_now(message)
+
+    write(output_unit, '(A)') message
+
+end program stay_or_go_now
@@ -5,7 +5,26 @@
 ##############################################################################
 
 from pathlib import Path
-from fab.artifact import Artifact, New, Unknown
+import pickle
+
+import pytest  # type: ignore
+
+from fab import FabException
+from fab.artifact import \
+    Analysed, \
+    Artifact, \
+    FileType, \
+    FortranSource, \
+    HASH_ALGORITHMS, \
+    New, \
+    Unknown, \
+    file_hash, \
+    hash_algorithm, \
+    use_hash_algorithm
+
+
+class Special(FileType):
+    pass
 
 
 class TestArtifact:
@@ -33,6 +52,53 @@ class TestArtifact:
         test_path.unlink()
         assert artifact.hash == expected_hash
 
+    @pytest.mark.parametrize('algorithm', list(HASH_ALGORITHMS))
+    def test_hash_algorithm(self, algorithm: str, tmp_path: Path):
+        test_path = tmp_path / 'test.foo'
+        test_path.write_bytes(b'Lorem ipsum dolor sit\n' * 100000)
+        other_path = tmp_path / 'other.foo'
+        other_path.write_bytes(b'Lorem ipsum dolor sat\n' * 100000)
+        try:
+            use_hash_algorithm(algorithm)
+            assert hash_algorithm() == algorithm
+            first = Artifact(test_path, Unknown, New).hash
+            assert 0 <= first < 2 ** 63
+            assert first == file_hash(test_path)
+            assert first != file_hash(other_path)
+        finally:
+            use_hash_algorithm('adler32')
+
+    def test_unknown_hash_algorithm(self):
+        with pytest.raises(FabException):
+            use_hash_algorithm('teapot')
+        assert hash_algorithm() == 'adler32'
+
+    def test_pickle(self):
+        artifact = Artifact(Path('/test/path.f90'), FortranSource, Analysed)
+        artifact.add_definition('teapot_mod')
+        artifact.add_dependency('kettle_mod')
+        artifact.add_dependency(Path('/test/kettle.h'))
+        artifact.add_dependency('cup_mod')
+        artifact.hash = 31337
+
+        copy = pickle.loads(pickle.dumps(artifact))
+        assert copy.location == artifact.location
+        assert copy.filetype is FortranSource
+        assert copy.state is Analysed
+        assert copy.defines == ['teapot_mod']
+        assert copy.depends_on == ['kettle_mod',
+                                   Path('/test/kettle.h'),
+                                   'cup_mod']
+        assert copy.hash == 31337
+        # Names are shared rather than copied
+        assert copy.depends_on[0] is artifact.depends_on[0]
+        assert pickle.loads(pickle.dumps(artifact)).location \
+            is copy.location
+
+        # As are filetypes and states without a code
+        unusual = Artifact(Path('/test/path.x'), Special, New)
+        assert pickle.loads(pickle.dumps(unusual)).filetype is Special
+
     def test_add_string_dependency(self):
         test_path = Path('/test/path')
         artifact = Artifact(test_path,
@@ -8,3 +8,30 @@
 # system testing.
 #
 # TODO: We may wish to consider how much stuff is in these top level objects.
+from pathlib import Path
+
+import pytest  # type: ignore
+
+from fab import FabException
+from fab.builder import Fab
+
+
+def test_failure(tmp_path: Path):
+    source = tmp_path / 'source'
+    source.mkdir()
+    (source / 'main.f90').write_text('program main\n'
+                                     '  use broken_mod\n'
+                                     'end program main\n')
+    (source / 'broken_mod.f90').write_text('module broken_mod\n'
+                                           '  this is not fortran\n'
+                                           'end module broken_mod\n')
+
+    # Whatever depends on a failure is left undone and the build with it
+    #
+    application = Fab(tmp_path / 'working', 'main', 'main', '', '', '', 2)
+    with pytest.raises(FabException) as error:
+        application.run(source)
+    assert str(source / 'broken_mod.f90') in str(error.value)
+    assert f'{source / "main.f90"}: waiting on broken_mod' \
+        in str(error.value)
+    assert not (tmp_path / 'working' / 'main').exists()
@@ -0,0 +1,155 @@
+##############################################################################
+# (c) Crown copyright Met Office. All rights reserved.
+# For further details please refer to the file COPYRIGHT
+# which you should have received as part of this distribution
+##############################################################################
+from pathlib import Path
+
+import pytest  # type: ignore
+
+from fab.cache import CacheStatistics, ObjectCache
+
+
+@pytest.fixture
+def versioned(mocker):
+    process = mocker.Mock()
+    process.stdout = 'fred 1.0'
+    return mocker.patch('subprocess.run', return_value=process)
+
+
+class TestCacheStatistics(object):
+    def test_equality(self):
+        first = CacheStatistics(1, 2, 3, 4)
+        with pytest.raises(ValueError):
+            _ = first == 'Not a CacheStatistics'
+        assert first == CacheStatistics(1, 2, 3, 4)
+        assert first != CacheStatistics(2, 2, 3, 4)
+        assert first != CacheStatistics(1, 2, 3, 5)
+
+
+class TestObjectCache(object):
+    def test_key(self, versioned, tmp_path: Path):
+        test_unit = ObjectCache(tmp_path / 'cache', 1024)
+        source = tmp_path / 'source.f90'
+        source.write_text('module source_mod\nend module source_mod\n')
+        module = tmp_path / 'other_mod.mod'
+        module.write_bytes(b'first')
+
+        key = test_unit.key('fred', ['-c'], source, [module])
+        assert key == test_unit.key('fred', ['-c'], source, [module])
+
+        # The compiler is only asked its version once
+        #
+        versioned.assert_called_once()
+
+        assert key != test_unit.key('barney', ['-c'], source, [module])
+        assert key != test_unit.key('fred', ['-c', '-O3'], source, [module])
+        assert key != test_unit.key('fred', ['-c'], source)
+
+        module.write_bytes(b'second')
+        assert key != test_unit.key('fred', ['-c'], source, [module])
+
+        # Where the source lives makes no difference, only what it holds
+        #
+        module.write_bytes(b'first')
+        moved = tmp_path / 'moved.f90'
+        moved.write_bytes(source.read_bytes())
+        assert key == test_unit.key('fred', ['-c'], moved, [module])
+        moved.write_text('module moved_mod\nend module moved_mod\n')
+        assert key != test_unit.key('fred', ['-c'], moved, [module])
+
+    def test_preprocessed_key(self, versioned, tmp_path: Path):
+        test_unit = ObjectCache(tmp_path / 'cache', 1024)
+        objects = {}
+        for name in ['first', 'second']:
+            workspace = tmp_path / name / 'working'
+            workspace.mkdir(parents=True)
+            (workspace / 'thing.c').write_text(
+                f'# 1 "{workspace}/thing.c"\n'
+                '# 1 "<built-in>"\n'
+                f'# 1 "{tmp_path / name}/source/include/thing.h" 1\n'
+                'int thing(void);\n'
+                f'# 2 "{workspace}/thing.c" 2\n'
+                '#pragma weak thing\n'
+                'int thing(void) { return 1; }\n')
+            objects[name] = workspace / 'thing.o'
+
+        # Preprocessed in different workspaces but the same otherwise
+        #
+        first = test_unit.key('fred', ['-c'],
+                              objects['first'].with_suffix('.c'),
+                              line_markers=True)
+        assert not test_unit.fetch(first, objects['first'],
+                                   objects['first'].parent)
+        objects['first'].write_bytes(b'object')
+        test_unit.store(first, objects['first'])
+
+        second = test_unit.key('fred', ['-c'],
+                               objects['second'].with_suffix('.c'),
+                               line_markers=True)
+        assert second == first
+        assert test_unit.fetch(second, objects['second'],
+                               objects['second'].parent)
+        assert objects['second'].read_bytes() == b'object'
+
+        # Markers are only taken apart when asked for
+        #
+        assert test_unit.key('fred', ['-c'],
+                             objects['first'].with_suffix('.c')) \
+            != test_unit.key('fred', ['-c'],
+                             objects['second'].with_suffix('.c'))
+
+        # Line numbers and file names still count
+        #
+        source = objects['second'].with_suffix('.c')
+        source.write_text(source.read_text().replace('# 2 ', '# 3 '))
+        assert test_unit.key('fred', ['-c'], source, line_markers=True) \
+            != first
+        source.write_text(source.read_text().replace('thing.h', 'other.h'))
+        assert test_unit.key('fred', ['-c'], source, line_markers=True) \
+            != first
+
+    def test_fetch_and_store(self, tmp_path: Path):
+        test_unit = ObjectCache(tmp_path / 'cache', 1024)
+        first = tmp_path / 'first'
+        first.mkdir()
+        (first / 'thing.o').write_bytes(b'object')
+        (first / 'thing_mod.mod').write_bytes(b'module')
+
+        second = tmp_path / 'second'
+        second.mkdir()
+        assert not test_unit.fetch('beef', second / 'thing.o', second)
+        assert test_unit.statistics() == CacheStatistics(0, 1, 0, 0)
+
+        test_unit.store('beef', first / 'thing.o', [first / 'thing_mod.mod'])
+        assert test_unit.statistics() == CacheStatistics(0, 1, 1, 12)
+
+        assert test_unit.fetch('beef', second / 'other.o', second)
+        assert (second / 'other.o').read_bytes() == b'object'
+        assert (second / 'thing_mod.mod').read_bytes() == b'module'
+        assert test_unit.statistics() == CacheStatistics(1, 1, 1, 12)
+
+        # Storing the same thing twice is harmless
+        #
+        test_unit.store('beef', first / 'thing.o', [first / 'thing_mod.mod'])
+        assert test_unit.statistics() == CacheStatistics(1, 1, 1, 12)
+
+    def test_eviction(self, tmp_path: Path):
+        test_unit = ObjectCache(tmp_path / 'cache', 20)
+        objects = {}
+        for name in ['first', 'second', 'third']:
+            objects[name] = tmp_path / f'{name}.o'
+            objects[name].write_bytes(b'0123456789')
+
+        test_unit.store('first', objects['first'])
+        test_unit.store('second', objects['second'])
+        assert test_unit.statistics().entries == 2
+
+        # Using the older entry makes the other the least recently used
+        #
+        assert test_unit.fetch('first', tmp_path / 'out.o', tmp_path)
+        test_unit.store('third', objects['third'])
+        assert test_unit.statistics() == CacheStatistics(1, 0, 2, 20)
+        assert test_unit.fetch('first', tmp_path / 'out.o', tmp_path)
+        assert not test_unit.fetch('second', tmp_path / 'out.o', tmp_path)
+        assert test_unit.fetch('third', tmp_path / 'out.o', tmp_path)
@@ -3,21 +3,28 @@
 # For further details please refer to the file COPYRIGHT
 # which you should have received as part of this distribution
 ##############################################################################
+import os
 from pathlib import Path
 import sqlite3
 import pytest  # type: ignore
 from fab import FabException
+from fab.artifact import use_hash_algorithm
 from fab.database import (DatabaseRows,
+                          DerivedFile,
+                          DerivedFileDatabase,
                           FileInfo,
                           FileInfoDatabase,
-                          SqliteStateDatabase)
+                          MetricsDatabase,
+                          SqliteStateDatabase,
+                          TaskMetric)
 
 
 class TestFileInfo(object):
     def test_constructor(self):
         test_unit = FileInfo(Path('stuff/nonsense'), 1234)
         assert test_unit.filename == Path('stuff/nonsense')
-        assert test_unit.adler32 == 1234
+        assert test_unit.hash == 1234
+        assert test_unit.algorithm == 'adler32'
 
     def equality_cases(self, request):
         yield request.param
@@ -40,6 +47,9 @@ class TestFileInfo(object):
         second = FileInfo(Path('bobbins'), 1234)
         assert first != second
 
+        second = FileInfo(Path('stuff/nonsense'), 5678, 'crc32')
+        assert first != second
+
 
 class TestDatabaseRows(object):
     def test_iteration(self):
@@ -130,3 +140,255 @@ class TestFileInfoDatabase(object):
         test_unit.add_file_info(Path('teapot.c'), 31337)
         assert test_unit.get_file_info(Path('teapot.c')) \
             == FileInfo(Path('teapot.c'), 31337)
+
+    def test_algorithm(self, tmp_path: Path):
+        test_unit = FileInfoDatabase(SqliteStateDatabase(tmp_path))
+        test_unit.add_file_info(Path('teapot.c'), 31337)
+        try:
+            use_hash_algorithm('blake2b')
+            # A hash made another way cannot be compared
+            with pytest.raises(FabException):
+                test_unit.get_file_info(Path('teapot.c'))
+
+            test_unit.add_file_info(Path('teapot.c'), 42)
+            assert test_unit.get_file_info(Path('teapot.c')) \
+                == FileInfo(Path('teapot.c'), 42, 'blake2b')
+        finally:
+            use_hash_algorithm('adler32')
+        assert list(iter(test_unit)) \
+            == [FileInfo(Path('teapot.c'), 42, 'blake2b')]
+
+    def test_status(self, tmp_path: Path):
+        test_unit = FileInfoDatabase(SqliteStateDatabase(tmp_path))
+        source = tmp_path / 'teapot.c'
+        source.write_text('short and stout')
+        os.utime(source, ns=(10 ** 18, 10 ** 18))
+        status = source.stat()
+
+        test_unit.add_file_info(source, 31337, status=status)
+        info = test_unit.get_file_info(source)
+        assert (info.mtime, info.size, info.inode) \
+            == (10 ** 18, 15, status.st_ino)
+        assert info.matches_stat(status)
+
+        source.write_text('tall and thin')
+        assert not info.matches_stat(source.stat())
+
+        # The modification time of a file just written may not change when
+        # it is written again
+        test_unit.add_file_info(source, 42, status=source.stat())
+        info = test_unit.get_file_info(source)
+        assert info.mtime is None
+        assert not info.matches_stat(source.stat())
+
+    def test_bulk(self, tmp_path: Path):
+        test_unit = FileInfoDatabase(SqliteStateDatabase(tmp_path))
+        test_unit.add_file_info(Path('teapot.c'), 31337)
+        sources = [tmp_path / 'teapot.c', tmp_path / 'kettle.c']
+        for source in sources:
+            source.write_text('short and stout')
+            os.utime(source, ns=(10 ** 18, 10 ** 18))
+
+        test_unit.add_file_infos([(Path('teapot.c'), 42, sources[0].stat()),
+                                  (Path('kettle.c'), 7, sources[1].stat())])
+        assert list(iter(test_unit)) == [FileInfo(Path('kettle.c'), 7),
+                                         FileInfo(Path('teapot.c'), 42)]
+        assert test_unit.get_file_info(Path('kettle.c')) \
+            .matches_stat(sources[1].stat())
+
+    def test_unrecorded_algorithm(self, tmp_path: Path):
+        database = SqliteStateDatabase(tmp_path)
+        database.execute('''create table file_info (
+                                id integer primary key,
+                                filename character(1024) not null,
+                                adler32 integer not null)''', {})
+        database.execute('''insert into file_info (filename, adler32)
+                                values ('teapot.c', 31337)''', {})
+
+        test_unit = FileInfoDatabase(database)
+        assert list(iter(test_unit)) == []
+
+
+class TestDerivedFileDatabase(object):
+    def test_derived_files(self, tmp_path: Path):
+        test_unit = DerivedFileDatabase(SqliteStateDatabase(tmp_path))
+        assert test_unit.get_derived_files(Path('foo.F90'), 'Seen') == []
+        assert test_unit.get_stamp(Path('foo.F90'), 'Seen') == ''
+
+        test_unit.add_derived_files(Path('foo.F90'), 'Seen',
+                                    [DerivedFile(Path('foo.f90'),
+                                                 'FortranSource', 'Raw')])
+        test_unit.add_derived_files(Path('foo.f90'), 'Analysed',
+                                    [DerivedFile(Path('foo.o'),
+                                                 'BinaryObject', 'Compiled'),
+                                     DerivedFile(Path('foo.mod'),
+                                                 'ModuleFile', 'Compiled')],
+                                    'beef')
+        test_unit.add_derived_files(Path('bar.f90'), 'Analysed',
+                                    [DerivedFile(Path('bar.o'),
+                                                 'BinaryObject', 'Compiled')],
+                                    'cafe')
+        assert test_unit.get_derived_files(Path('foo.F90'), 'Seen') \
+            == [DerivedFile(Path('foo.f90'), 'FortranSource', 'Raw')]
+        assert test_unit.get_derived_files(Path('foo.f90'), 'Analysed') \
+            == [DerivedFile(Path('foo.o'), 'BinaryObject', 'Compiled'),
+                DerivedFile(Path('foo.mod'), 'ModuleFile', 'Compiled')]
+        assert test_unit.get_stamp(Path('foo.f90'), 'Analysed') == 'beef'
+
+        # Replacing the records of a file leaves others alone
+        #
+        test_unit.add_derived_files(Path('foo.f90'), 'Analysed',
+                                    [DerivedFile(Path('foo.o'),
+                                                 'BinaryObject', 'Compiled')],
+                                    'dead')
+        assert test_unit.get_derived_files(Path('foo.f90'), 'Analysed') \
+            == [DerivedFile(Path('foo.o'), 'BinaryObject', 'Compiled')]
+        assert test_unit.get_stamp(Path('foo.f90'), 'Analysed') == 'dead'
+        assert test_unit.get_stamp(Path('bar.f90'), 'Analysed') == 'cafe'
+
+        # Removing a file's records removes those of everything derived
+        # from it
+        #
+        test_unit.remove_derived_files(Path('foo.F90'), 'Seen')
+        assert test_unit.get_derived_files(Path('foo.F90'), 'Seen') == []
+        assert test_unit.get_derived_files(Path('foo.f90'), 'Analysed') \
+            == []
+        assert test_unit.get_derived_files(Path('bar.f90'), 'Analysed') \
+            == [DerivedFile(Path('bar.o'), 'BinaryObject', 'Compiled')]
+
+    def test_stale(self, tmp_path: Path):
+        test_unit = DerivedFileDatabase(SqliteStateDatabase(tmp_path))
+        chain = [('foo.F90', 'Seen', 'foo.f90', 'Raw'),
+                 ('foo.f90', 'Raw', 'foo.f90', 'Analysed'),
+                 ('foo.f90', 'Analysed', 'foo.o', 'Compiled')]
+        for source, state, produced, produced_state in chain:
+            test_unit.add_derived_files(Path(source), state,
+                                        [DerivedFile(Path(produced),
+                                                     'FortranSource',
+                                                     produced_state)],
+                                        'beef')
+
+        # Stale records are as good as forgotten, following the chain of
+        # states, but may still be looked at
+        #
+        test_unit.mark_stale(Path('foo.f90'), 'Raw')
+        assert test_unit.get_derived_files(Path('foo.F90'), 'Seen') != []
+        assert test_unit.get_derived_files(Path('foo.f90'), 'Raw') == []
+        assert test_unit.get_derived_files(Path('foo.f90'), 'Analysed') \
+            == []
+        assert test_unit.get_derived_files(Path('foo.f90'), 'Analysed',
+                                           stale=True) \
+            == [DerivedFile(Path('foo.o'), 'FortranSource', 'Compiled')]
+        assert test_unit.get_stamp(Path('foo.f90'), 'Raw') == 'beef'
+
+        # Until revived, or replaced
+        #
+        test_unit.revive(Path('foo.f90'), 'Raw')
+        assert test_unit.get_derived_files(Path('foo.f90'), 'Analysed') \
+            != []
+        test_unit.mark_stale(Path('foo.F90'), 'Seen')
+        test_unit.add_derived_files(Path('foo.F90'), 'Seen',
+                                    [DerivedFile(Path('foo.f90'),
+                                                 'FortranSource', 'Raw')])
+        assert test_unit.get_derived_files(Path('foo.F90'), 'Seen') != []
+        assert test_unit.get_derived_files(Path('foo.f90'), 'Raw') == []
+
+    def test_prerequisite_stamps(self, tmp_path: Path):
+        test_unit = DerivedFileDatabase(SqliteStateDatabase(tmp_path))
+        assert test_unit.get_prerequisite_stamps(Path('foo.f90')) == {}
+
+        test_unit.add_prerequisite_stamps(Path('foo.f90'),
+                                          {'bar_mod': 'beef',
+                                           'baz_mod': 'cafe'})
+        assert test_unit.get_prerequisite_stamps(Path('foo.f90')) \
+            == {'bar_mod': 'beef', 'baz_mod': 'cafe'}
+
+        test_unit.add_prerequisite_stamps(Path('foo.f90'),
+                                          {'bar_mod': 'dead'})
+        assert test_unit.get_prerequisite_stamps(Path('foo.f90')) \
+            == {'bar_mod': 'dead'}
+
+    def test_iterate(self, tmp_path: Path):
+        test_unit = DerivedFileDatabase(SqliteStateDatabase(tmp_path))
+        assert list(test_unit) == []
+        test_unit.add_derived_files(Path('foo.F90'), 'Seen',
+                                    [DerivedFile(Path('foo.f90'),
+                                                 'FortranSource', 'Raw')])
+        test_unit.add_derived_files(Path('foo.f90'), 'Analysed',
+                                    [DerivedFile(Path('foo.o'),
+                                                 'BinaryObject', 'Compiled')])
+        assert list(test_unit) \
+            == [(Path('foo.F90'),
+                 DerivedFile(Path('foo.f90'), 'FortranSource', 'Raw')),
+                (Path('foo.f90'),
+                 DerivedFile(Path('foo.o'), 'BinaryObject', 'Compiled'))]
+
+    def test_settings(self, tmp_path: Path):
+        test_unit = DerivedFileDatabase(SqliteStateDatabase(tmp_path))
+        assert not test_unit.check_settings('gfortran -c')
+        assert test_unit.check_settings('gfortran -c')
+
+        test_unit.add_derived_files(Path('foo.f90'), 'Analysed',
+                                    [DerivedFile(Path('foo.o'),
+                                                 'BinaryObject', 'Compiled')])
+        test_unit.add_prerequisite_stamps(Path('foo.f90'), {'bar': 'beef'})
+        assert test_unit.check_settings('gfortran -c')
+        assert test_unit.get_derived_files(Path('foo.f90'), 'Analysed') \
+            != []
+
+        # Different settings make the records worthless
+        #
+        assert not test_unit.check_settings('gfortran -c -O3')
+        assert test_unit.get_derived_files(Path('foo.f90'), 'Analysed') \
+            == []
+        assert test_unit.get_prerequisite_stamps(Path('foo.f90')) == {}
+        assert test_unit.check_settings('gfortran -c -O3')
+
+        # Looking is not enough to forget
+        #
+        test_unit.add_derived_files(Path('foo.f90'), 'Analysed',
+                                    [DerivedFile(Path('foo.o'),
+                                                 'BinaryObject', 'Compiled')])
+        assert not test_unit.settings_match('gfortran -c')
+        assert test_unit.settings_match('gfortran -c -O3')
+        assert test_unit.get_derived_files(Path('foo.f90'), 'Analysed') \
+            != []
+
+
+class TestMetricsDatabase(object):
+    def test_metrics(self, tmp_path: Path):
+        test_unit = MetricsDatabase(SqliteStateDatabase(tmp_path))
+        assert test_unit.get_metrics(Path('foo.f90'), 'Compiler') == []
+        assert list(test_unit) == []
+
+        first = TaskMetric(Path('foo.f90'), 'Compiler',
+                           2.0, 1.5, 1024, 100, 200)
+        second = TaskMetric(Path('foo.f90'), 'Compiler',
+                            4.0, 3.5, 2048, 100, 200)
+        other = TaskMetric(Path('bar.f90'), 'Compiler',
+                           3.0, 2.5, 1024, 50, 60, 2)
+        test_unit.add_metric(first)
+        test_unit.add_metric(second)
+        test_unit.add_metric(other)
+        test_unit.add_metric(TaskMetric(Path('foo.f90'), 'Analyser',
+                                        1.0, 1.0, 0, 10, 0))
+
+        assert test_unit.get_metrics(Path('foo.f90'), 'Compiler') \
+            == [second, first]
+
+        # The latest of each, the most costly first
+        summary = list(test_unit)
+        assert [entry[0] for entry in summary] \
+            == [second, other,
+                TaskMetric(Path('foo.f90'), 'Analyser', 1.0, 1.0, 0, 10, 0)]
+        assert summary[0][1:] == (2, 3.0)
+        assert summary[1][1:] == (1, 3.0)
+
+    def test_history(self, tmp_path: Path):
+        test_unit = MetricsDatabase(SqliteStateDatabase(tmp_path))
+        for run in range(MetricsDatabase.HISTORY + 5):
+            test_unit.add_metric(TaskMetric(Path('foo.f90'), 'Compiler',
+                                            float(run), 0.0, 0, 0, 0))
+        remembered = test_unit.get_metrics(Path('foo.f90'), 'Compiler')
+        assert [metric.wall for metric in remembered] \
+            == [float(run) for run in reversed(range(5, 15))]
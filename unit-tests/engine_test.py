@@ -4,13 +4,26 @@
 # which you should have received as part of this distribution
 ##############################################################################
 
+import os
 from pathlib import Path
-from typing import List, Mapping, Dict, Tuple, Type
-from multiprocessing.synchronize import Lock as LockT
+from typing import List, Mapping, Tuple, Type
 
-from fab.engine import PathMap, Engine, DiscoveryState
-from fab.artifact import Artifact, State, FileType, Unknown, New
+from fab.engine import Action, PathMap, Engine, Job
+from fab.graph import DependencyGraph
+from fab.artifact import \
+    Artifact, \
+    State, \
+    FileType, \
+    Unknown, \
+    New, \
+    Analysed, \
+    BinaryObject, \
+    Compiled
 from fab.tasks import Task
+from fab.database import \
+    FileInfoDatabase, \
+    MetricsDatabase, \
+    SqliteStateDatabase
 
 
 class DummyState(State):
@@ -37,17 +50,6 @@ class DummyTask(Task):
         return [new_artifact]
 
 
-class DummyLock(LockT):
-    def __init__(self):
-        pass
-
-    def acquire(self):
-        pass
-
-    def release(self):
-        pass
-
-
 class TestPathMap:
     def test_constructor(self):
         pattern = r'.*abcd.*'
@@ -92,32 +94,328 @@ class TestEngine:
                             Unknown,
                             New)
 
-        discovery: Dict[str, DiscoveryState] = {}
-        objects: List[Artifact] = []
-        lock = DummyLock()
+        graph = DependencyGraph("test_target")
 
-        new_artifact = engine.process(artifact,
-                                      discovery,
-                                      objects,
-                                      lock)
+        new_artifact = engine.process(artifact, graph)
 
         assert len(new_artifact) == 1
         assert new_artifact[0].location == artifact.location
         assert new_artifact[0].filetype is DummyFileType
         assert new_artifact[0].state is DummyState
         assert new_artifact[0]._hash == 1630603340
-        assert discovery == {}
-        assert objects == []
+        assert graph.discovery() == {}
+        assert graph.objects() == []
 
-        new_artifact2 = engine.process(new_artifact[0],
-                                       discovery,
-                                       objects,
-                                       lock)
+        new_artifact2 = engine.process(new_artifact[0], graph)
 
         assert len(new_artifact2) == 1
         assert new_artifact2[0].location == tmp_path / "test.bar"
         assert new_artifact2[0].filetype is DummyFileType2
         assert new_artifact2[0].state is DummyState2
         assert new_artifact2[0]._hash is None
-        assert discovery == {}
-        assert objects == []
+        assert graph.discovery() == {}
+        assert graph.objects() == []
+
+    def test_incremental(self, tmp_path: Path):
+        class WritingTask(Task):
+            def __init__(self):
+                self.runs = 0
+
+            def run(self, artifacts: List[Artifact]):
+                self.runs += 1
+                output = artifacts[0].location.with_suffix('.bar')
+                output.write_text('Produced by the task')
+                return [Artifact(output, DummyFileType2, DummyState2)]
+
+        pathmap = PathMap(r'.*\.foo', DummyFileType, DummyState)
+        task = WritingTask()
+        taskmap: Mapping[Tuple[Type[FileType], Type[State]], Task] = {
+            (DummyFileType, DummyState): task,
+        }
+
+        test_path = tmp_path / "test.foo"
+        test_path.write_text("This is the Engine test")
+
+        def build() -> List[Artifact]:
+            engine = Engine(tmp_path,
+                            "test_target",
+                            [pathmap],
+                            taskmap,
+                            incremental=True)
+            graph = DependencyGraph("test_target")
+            new_artifact = engine.process(Artifact(test_path, Unknown, New),
+                                          graph)
+            return engine.process(new_artifact[0], graph)
+
+        # The first build has nothing to reuse
+        outputs = build()
+        assert task.runs == 1
+        assert [output.location for output in outputs] \
+            == [tmp_path / "test.bar"]
+
+        # An unchanged file need not be processed again
+        outputs = build()
+        assert task.runs == 1
+        assert [output.location for output in outputs] \
+            == [tmp_path / "test.bar"]
+        assert outputs[0].filetype is DummyFileType2
+        assert outputs[0].state is DummyState2
+
+        # Unless its results have gone missing
+        (tmp_path / "test.bar").unlink()
+        build()
+        assert task.runs == 2
+
+        # Or it has changed
+        test_path.write_text("This is the changed Engine test")
+        build()
+        assert task.runs == 3
+
+    def test_trust_stat(self, tmp_path: Path):
+        class CountingTask(Task):
+            def __init__(self):
+                self.runs = 0
+
+            def run(self, artifacts: List[Artifact]):
+                self.runs += 1
+                output = artifacts[0].location.with_suffix('.bar')
+                output.write_text('Produced by the task')
+                return [Artifact(output, DummyFileType2, DummyState2)]
+
+        pathmap = PathMap(r'.*\.foo', DummyFileType, DummyState)
+        task = CountingTask()
+        taskmap: Mapping[Tuple[Type[FileType], Type[State]], Task] = {
+            (DummyFileType, DummyState): task,
+        }
+
+        # Old enough for its modification time to be relied upon
+        test_path = tmp_path / "test.foo"
+        test_path.write_text("This is the Engine test")
+        os.utime(test_path, ns=(10 ** 18, 10 ** 18))
+
+        def build(trust_stat: bool) -> None:
+            engine = Engine(tmp_path,
+                            "test_target",
+                            [pathmap],
+                            taskmap,
+                            incremental=True,
+                            trust_stat=trust_stat)
+            graph = DependencyGraph("test_target")
+            new_artifact = engine.process(Artifact(test_path, Unknown, New),
+                                          graph)
+            engine.process(new_artifact[0], graph)
+
+        build(trust_stat=True)
+        assert task.runs == 1
+
+        # A change hidden from the status is only seen by hashing
+        test_path.write_text("This is the Engine tset")
+        os.utime(test_path, ns=(10 ** 18, 10 ** 18))
+        build(trust_stat=True)
+        assert task.runs == 1
+        build(trust_stat=False)
+        assert task.runs == 2
+
+        # Any change to the status has the file hashed again
+        test_path.write_text("This is the Engine test")
+        build(trust_stat=True)
+        assert task.runs == 3
+
+    def test_survey(self, tmp_path: Path):
+        pathmap = PathMap(r'.*\.foo', DummyFileType, DummyState)
+        engine = Engine(tmp_path,
+                        "test_target",
+                        [pathmap],
+                        {},
+                        incremental=True)
+        files = [tmp_path / f'test{index}.foo' for index in range(20)]
+        for index, path in enumerate(files):
+            path.write_text(f'This is Engine test {index}')
+        (tmp_path / 'test.bar').write_text('Of no use')
+
+        def locations():
+            yield from files
+            yield tmp_path / 'test.bar'
+
+        artifacts, unchanged = engine.survey(locations(), threads=4)
+        assert [artifact.location for artifact in artifacts] == files
+        assert all(artifact.filetype is DummyFileType
+                   and artifact.state is DummyState
+                   for artifact in artifacts)
+        assert unchanged == []
+        file_info = FileInfoDatabase(SqliteStateDatabase(tmp_path))
+        assert [info.filename for info in file_info] == sorted(files)
+        assert all(file_info.get_file_info(artifact.location).hash
+                   == artifact.hash for artifact in artifacts)
+
+        files[3].write_text('This is a changed Engine test')
+        artifacts, unchanged = engine.survey(locations(), threads=4)
+        assert unchanged == files[:3] + files[4:]
+        assert file_info.get_file_info(files[3]).hash == artifacts[3].hash
+
+    def test_early_cutoff(self, tmp_path: Path):
+        class StrippingTask(Task):
+            def run(self, artifacts: List[Artifact]):
+                output = artifacts[0].location.with_suffix('.bar')
+                lines = artifacts[0].location.read_text().splitlines()
+                output.write_text('\n'.join(line for line in lines
+                                            if not line.startswith('#')))
+                return [Artifact(output, DummyFileType2, DummyState2)]
+
+        class CountingTask(Task):
+            def __init__(self):
+                self.runs = 0
+
+            def run(self, artifacts: List[Artifact]):
+                self.runs += 1
+                output = artifacts[0].location.with_suffix('.baz')
+                output.write_text('Produced by the task')
+                return [Artifact(output, DummyFileType, Analysed)]
+
+        pathmap = PathMap(r'.*\.foo', DummyFileType, DummyState)
+        counting = CountingTask()
+        taskmap: Mapping[Tuple[Type[FileType], Type[State]], Task] = {
+            (DummyFileType, DummyState): StrippingTask(),
+            (DummyFileType2, DummyState2): counting,
+        }
+
+        test_path = tmp_path / "test.foo"
+
+        def build() -> List[Artifact]:
+            engine = Engine(tmp_path,
+                            "test_target",
+                            [pathmap],
+                            taskmap,
+                            incremental=True)
+            graph = DependencyGraph("test_target")
+            artifacts = [Artifact(test_path, Unknown, New)]
+            for _ in range(3):
+                artifacts = engine.process(artifacts[0], graph)
+            return artifacts
+
+        test_path.write_text("# Comment\nContent")
+        assert build()[0].location == tmp_path / "test.baz"
+        assert counting.runs == 1
+        # Files generated along the way are not mistaken for source
+        file_info = FileInfoDatabase(SqliteStateDatabase(tmp_path))
+        assert [info.filename for info in file_info] == [test_path]
+
+        # Output the same as before spares whatever follows
+        test_path.write_text("# Changed comment\nContent")
+        assert build()[0].location == tmp_path / "test.baz"
+        assert counting.runs == 1
+
+        # Unlike output which is not
+        test_path.write_text("# Changed comment\nChanged content")
+        build()
+        assert counting.runs == 2
+
+    def test_batch(self, tmp_path: Path):
+        class BatchTask(Task):
+            batchable = True
+
+            def __init__(self):
+                self.calls: List[List[Path]] = []
+
+            def run(self, artifacts: List[Artifact]):
+                self.calls.append([artifact.location
+                                   for artifact in artifacts])
+                return [Artifact(artifact.location.with_suffix('.o'),
+                                 BinaryObject,
+                                 Compiled) for artifact in artifacts]
+
+        task = BatchTask()
+        taskmap: Mapping[Tuple[Type[FileType], Type[State]], Task] = {
+            (DummyFileType, Analysed): task,
+        }
+        engine = Engine(tmp_path, "test_target", [], taskmap, batch_size=4)
+        graph = DependencyGraph("test_target")
+
+        artifacts = []
+        for name in ['first', 'second']:
+            artifact = Artifact(tmp_path / f'{name}.foo',
+                                DummyFileType,
+                                Analysed)
+            artifact.add_definition(f'{name}_mod')
+            artifacts.append(artifact)
+
+        job = Job(Action.COMPILE, artifacts[0])
+        assert engine.batch_key(job) is not None
+        assert engine.batch_key(Job(Action.LINK, artifacts[0])) is None
+        job.batch = [Job(Action.COMPILE, artifacts[1])]
+
+        # Both are compiled at once, each with its own result
+        #
+        new_artifacts = engine.complete(engine.execute(job), graph)
+        assert task.calls == [[tmp_path / 'first.foo',
+                               tmp_path / 'second.foo']]
+        assert job.outputs[0].location == tmp_path / 'first.o'
+        assert job.batch[0].outputs[0].location == tmp_path / 'second.o'
+        assert sorted(artifact.location for artifact in new_artifacts) \
+            == [tmp_path / 'first.o', tmp_path / 'second.o']
+        assert set(graph.discovery()) == {'first_mod', 'second_mod'}
+
+        # The one run of the task is noted against the job leading the batch
+        #
+        assert len(job.spans) == 1
+        assert job.spans[0].task == 'BatchTask'
+        assert job.spans[0].paths == [tmp_path / 'first.foo',
+                                      tmp_path / 'second.foo']
+        assert job.batch[0].spans == []
+
+        # While its costs are shared between them
+        #
+        metrics = MetricsDatabase(SqliteStateDatabase(tmp_path))
+        for name in ['first', 'second']:
+            recorded = metrics.get_metrics(tmp_path / f'{name}.foo',
+                                           'BatchTask')
+            assert len(recorded) == 1
+            assert recorded[0].shared_by == 2
+
+        # Without being asked for nothing is done together
+        #
+        engine = Engine(tmp_path, "test_target", [], taskmap)
+        assert engine.batch_key(job) is None
+
+    def test_several_targets(self, tmp_path: Path):
+        class LinkTask(Task):
+            def __init__(self, name: str):
+                self.name = name
+                self.calls: List[List[Path]] = []
+
+            def run(self, artifacts: List[Artifact]):
+                self.calls.append([artifact.location
+                                   for artifact in artifacts])
+                return [Artifact(tmp_path / self.name,
+                                 DummyFileType2,
+                                 DummyState2)]
+
+        linkers = {'main': LinkTask('model'), 'tests': LinkTask('tests')}
+        taskmap: Mapping[Tuple[Type[FileType], Type[State]], Task] = {
+            (BinaryObject, Compiled): linkers['main'],
+        }
+        engine = Engine(tmp_path, ['main', 'tests'], [], taskmap,
+                        linkers=linkers)
+        graph = DependencyGraph(engine.target)
+
+        objects = {}
+        for name in ['main', 'tests']:
+            analysed = Artifact(tmp_path / f'{name}.foo',
+                                DummyFileType,
+                                Analysed)
+            analysed.add_definition(name)
+            graph.schedule(analysed)
+            compiled = Artifact(tmp_path / f'{name}.o',
+                                BinaryObject,
+                                Compiled)
+            compiled.add_definition(name)
+            graph.compiled([name], [compiled])
+            objects[name] = compiled
+
+        # Each target is linked by its own task with its own objects
+        #
+        for name in ['main', 'tests']:
+            outputs = engine.process(objects[name], graph)
+            assert [output.location for output in outputs] \
+                == [tmp_path / linkers[name].name]
+            assert linkers[name].calls == [[tmp_path / f'{name}.o']]
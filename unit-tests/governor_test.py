@@ -0,0 +1,92 @@
+##############################################################################
+# (c) Crown copyright Met Office. All rights reserved.
+# For further details please refer to the file COPYRIGHT
+# which you should have received as part of this distribution
+##############################################################################
+from typing import List, Optional
+
+from fab.governor import LoadGovernor
+
+
+class DummyGovernor(LoadGovernor):
+    """
+    Sees a machine described by the test rather than the real one.
+    """
+    def __init__(self, ceiling: int):
+        self.now = 0.0
+        super().__init__(ceiling,
+                         max_load=1.0,
+                         min_memory=100,
+                         min_idle=0.2,
+                         interval=2.0,
+                         clock=lambda: self.now)
+        self.load: Optional[float] = 0.5
+        self.memory: Optional[int] = 1000
+        self.idle: Optional[float] = 0.5
+
+    def _load(self) -> Optional[float]:
+        return self.load
+
+    def _available_memory(self) -> Optional[int]:
+        return self.memory
+
+    def _idle(self) -> Optional[float]:
+        return self.idle
+
+
+class TestLoadGovernor(object):
+    def test_initial(self):
+        assert LoadGovernor(8).initial == 4
+        assert LoadGovernor(1).initial == 1
+        assert LoadGovernor(0).ceiling == 1
+
+    def test_grow_when_idle(self):
+        governor = DummyGovernor(3)
+        slots: List[int] = []
+        current = 1
+        for _ in range(4):
+            current = governor.slots(current)
+            slots.append(current)
+            governor.now += 2.0
+        assert slots == [2, 3, 3, 3]
+
+    def test_hold_between_looks(self):
+        governor = DummyGovernor(4)
+        assert governor.slots(1) == 2
+        governor.now += 1.0
+        assert governor.slots(2) == 2
+        governor.now += 1.0
+        assert governor.slots(2) == 3
+
+    def test_hold_when_busy(self):
+        governor = DummyGovernor(4)
+        governor.idle = 0.1
+        assert governor.slots(2) == 2
+        governor.now += 2.0
+        governor.idle = None
+        assert governor.slots(2) == 2
+
+    def test_shrink_on_load(self):
+        governor = DummyGovernor(4)
+        governor.load = 1.5
+        assert governor.slots(3) == 2
+        governor.now += 2.0
+        assert governor.slots(1) == 1
+
+    def test_shrink_on_memory(self):
+        governor = DummyGovernor(4)
+        governor.memory = 50
+        assert governor.slots(3) == 2
+
+    def test_unknown_figures(self):
+        governor = DummyGovernor(4)
+        governor.load = None
+        governor.memory = None
+        governor.idle = None
+        assert governor.slots(3) == 3
+
+    def test_real_machine(self):
+        # Whatever the figures, the answer stays within bounds
+        governor = LoadGovernor(4, interval=0.0)
+        for current in [1, 2, 3, 4]:
+            assert 1 <= governor.slots(current) <= 4
@@ -0,0 +1,253 @@
+##############################################################################
+# (c) Crown copyright Met Office. All rights reserved.
+# For further details please refer to the file COPYRIGHT
+# which you should have received as part of this distribution
+##############################################################################
+from pathlib import Path
+
+from fab.artifact import Artifact, Analysed, Modified, FortranSource, \
+    CSource, BinaryObject, Compiled
+from fab.graph import \
+    CriticalPath, \
+    DependencyGraph, \
+    DiscoveryState, \
+    TargetPruning
+
+
+def _analysed(name: str, defines, depends_on=()) -> Artifact:
+    artifact = Artifact(Path(f'/test/{name}.f90'), FortranSource, Analysed)
+    for definition in defines:
+        artifact.add_definition(definition)
+    for dependency in depends_on:
+        artifact.add_dependency(dependency)
+    return artifact
+
+
+class TestDependencyGraph(object):
+    def test_target_without_prerequisites(self):
+        graph = DependencyGraph('main')
+        ready, claimed = graph.schedule(_analysed('main', ['main']))
+        assert ready
+        assert claimed == []
+        assert graph.discovery() == {'main': DiscoveryState.SEEN}
+
+    def test_unrequired_is_held(self):
+        graph = DependencyGraph('main')
+        ready, claimed = graph.schedule(_analysed('spare', ['spare_mod']))
+        assert not ready
+        assert claimed == []
+        assert graph.discovery() == {}
+
+    def test_blocked(self):
+        graph = DependencyGraph('main')
+        main = _analysed('main', ['main'], ['first_mod', 'second_mod'])
+        graph.schedule(main)
+        assert graph.blocked() == {main.location: {'first_mod',
+                                                   'second_mod'}}
+        graph.compiled(['first_mod'], [])
+        assert graph.blocked() == {main.location: {'second_mod'}}
+        graph.compiled(['second_mod'], [])
+        assert graph.blocked() == {}
+
+    def test_release_on_last_prerequisite(self):
+        graph = DependencyGraph('main')
+        first = _analysed('first_mod', ['first_mod'])
+        second = _analysed('second_mod', ['second_mod'])
+        main = _analysed('main', ['main'], ['first_mod', 'second_mod'])
+
+        # Prerequisites analysed ahead of anything requiring them are held
+        # until the target claims them.
+        #
+        assert graph.schedule(first) == (False, [])
+        ready, claimed = graph.schedule(main)
+        assert not ready
+        assert claimed == [first]
+        assert graph.discovery()['second_mod'] is DiscoveryState.AWARE_OF
+
+        ready, claimed = graph.schedule(first)
+        assert ready
+        ready, claimed = graph.schedule(second)
+        assert ready
+
+        first_object = Artifact(Path('/test/first_mod.o'),
+                                BinaryObject,
+                                Compiled)
+        assert graph.compiled(['first_mod'], [first_object]) == []
+        assert graph.compiled(['second_mod'], []) == [main]
+        assert graph.discovery()['first_mod'] is DiscoveryState.COMPILED
+        assert graph.objects() == [first_object]
+
+        ready, _ = graph.schedule(main)
+        assert ready
+
+    def test_self_dependency(self):
+        graph = DependencyGraph('main')
+        ready, _ = graph.schedule(_analysed('main',
+                                            ['util_mod', 'main'],
+                                            ['util_mod']))
+        assert ready
+
+    def test_files(self):
+        graph = DependencyGraph('main')
+        header = Path('/work/header.h')
+        artifact = Artifact(Path('/work/source.c'), CSource, Modified)
+        artifact.add_dependency(header)
+
+        assert not graph.await_files(artifact, [header])
+        assert graph.produced([Path('/work/other.h')]) == []
+        assert graph.produced([header]) == [artifact]
+        assert graph.await_files(artifact, [header])
+
+    def test_unchanged(self):
+        graph = DependencyGraph('main')
+        source = Path('/test/source.F90')
+        assert not graph.is_unchanged([source])
+        graph.unchanged([source])
+        assert graph.is_unchanged([source])
+
+        # Files are only unchanged if they were reused from before
+        #
+        generated = Path('/work/source.f90')
+        graph.produced([generated])
+        assert not graph.is_unchanged([source, generated])
+        graph.produced([generated], unchanged=True)
+        assert graph.is_unchanged([source, generated])
+
+    def test_several_targets(self):
+        graph = DependencyGraph(['main', 'tests'])
+        shared = _analysed('shared_mod', ['shared_mod'])
+        main = _analysed('main', ['main'], ['shared_mod', 'model_mod'])
+        model = _analysed('model_mod', ['model_mod'])
+        tests = _analysed('tests', ['tests'], ['shared_mod'])
+
+        # Whatever either target needs is required, and compiled once
+        #
+        assert graph.schedule(main) == (False, [])
+        assert graph.schedule(tests) == (False, [])
+        assert graph.schedule(shared) == (True, [])
+        assert graph.schedule(model) == (True, [])
+
+        def compiled(artifact: Artifact) -> Artifact:
+            return Artifact(artifact.location.with_suffix('.o'),
+                            BinaryObject,
+                            Compiled)
+
+        assert graph.compiled(['shared_mod'], [compiled(shared)]) \
+            == [tests]
+        assert graph.compiled(['tests'], [compiled(tests)]) == []
+        assert graph.compiled(['model_mod'], [compiled(model)]) == [main]
+        assert graph.compiled(['main'], [compiled(main)]) == []
+
+        # Each target is only linked with the objects it needs
+        #
+        assert [artifact.location.name
+                for artifact in graph.objects('tests')] \
+            == ['shared_mod.o', 'tests.o']
+        assert [artifact.location.name
+                for artifact in graph.objects('main')] \
+            == ['shared_mod.o', 'model_mod.o', 'main.o']
+        assert len(graph.objects()) == 4
+
+    def test_stamps(self):
+        graph = DependencyGraph('main')
+        assert graph.stamps(['first_mod']) == {'first_mod': ''}
+        graph.compiled(['first_mod', 'second_mod'], [],
+                       {'first_mod': 'beef', 'second_mod': 'cafe'})
+        assert graph.stamps(['first_mod', 'third_mod']) \
+            == {'first_mod': 'beef', 'third_mod': ''}
+
+
+class TestCriticalPath(object):
+    def test_chain(self):
+        units = [('main', Path('/src/main.f90'), ['first_mod', 'leaf_mod']),
+                 ('first_mod', Path('/src/first_mod.f90'), ['second_mod']),
+                 ('second_mod', Path('/src/second_mod.f90'), []),
+                 ('leaf_mod', Path('/src/leaf_mod.f90'), [])]
+        ranking = CriticalPath(units)
+        assert ranking.chain(Path('/src/main.f90')) == 0
+        assert ranking.chain(Path('/src/first_mod.f90')) == 1
+        assert ranking.chain(Path('/src/second_mod.f90')) == 2
+        assert ranking.chain(Path('/src/leaf_mod.f90')) == 1
+        # Preprocessed sources are matched on name
+        assert ranking.chain(Path('/work/second_mod.F90')) == 2
+        assert ranking.chain(Path('/src/unknown.f90')) == 0
+
+    def test_shared_dependents(self):
+        units = [('a', Path('/src/a.f90'), []),
+                 ('b', Path('/src/b.f90'), ['a']),
+                 ('c', Path('/src/c.f90'), ['a', 'b']),
+                 ('d', Path('/src/d.f90'), ['c'])]
+        ranking = CriticalPath(units)
+        assert [ranking.chain(Path(f'/src/{name}.f90'))
+                for name in 'abcd'] == [3, 2, 1, 0]
+
+        # Each file used by all which follow, so that the answer does not
+        # rest on the order in which a set of dependents happens to come
+        names = [f'unit_{index}' for index in range(12)]
+        units = [(name, Path(f'/src/{name}.f90'), names[:index])
+                 for index, name in enumerate(names)]
+        ranking = CriticalPath(units)
+        assert [ranking.chain(Path(f'/src/{name}.f90')) for name in names] \
+            == list(reversed(range(12)))
+
+    def test_cycle(self):
+        units = [('one', Path('one.f90'), ['two']),
+                 ('two', Path('two.f90'), ['one'])]
+        ranking = CriticalPath(units)
+        assert {ranking.chain(Path('one.f90')),
+                ranking.chain(Path('two.f90'))} == {1, 2}
+
+    def test_priority(self, tmp_path: Path):
+        big = tmp_path / 'big.f90'
+        big.write_text('x' * 100)
+        small = tmp_path / 'small.f90'
+        small.write_text('x')
+        deep = tmp_path / 'deep.f90'
+        deep.write_text('x')
+        ranking = CriticalPath([('deep', deep, []),
+                                ('user', small, ['deep'])])
+
+        def artifact(path):
+            return Artifact(path, FortranSource, Analysed)
+
+        ordered = sorted([artifact(small), artifact(big), artifact(deep)],
+                         key=ranking.priority)
+        assert [entry.location for entry in ordered] == [deep, big, small]
+
+
+class TestTargetPruning(object):
+    def test_needs(self):
+        units = [('main', Path('/work/main.f90'), ['used_mod']),
+                 ('used_mod', Path('/work/used.f90'), []),
+                 ('spare_mod', Path('/work/spare.f90'), [])]
+        derived = [(Path('/src/main.F90'), Path('/work/main.f90'), 'Raw'),
+                   (Path('/work/main.f90'), Path('/work/main.f90'),
+                    'Analysed'),
+                   (Path('/src/used.F90'), Path('/work/used.f90'), 'Raw'),
+                   (Path('/work/used.f90'), Path('/work/used.f90'),
+                    'Analysed'),
+                   (Path('/src/spare.F90'), Path('/work/spare.f90'), 'Raw'),
+                   (Path('/work/spare.f90'), Path('/work/spare.f90'),
+                    'Analysed'),
+                   (Path('/src/header.h'), Path('/work/header.h'),
+                    'Modified')]
+        pruning = TargetPruning('main', units, derived)
+        assert pruning.needs(Path('/src/main.F90'))
+        assert pruning.needs(Path('/src/used.F90'))
+        assert not pruning.needs(Path('/src/spare.F90'))
+
+        # Anything not known to lead elsewhere may be needed
+        assert pruning.needs(Path('/src/header.h'))
+        assert pruning.needs(Path('/src/new.F90'))
+
+        assert pruning.provides(Path('/src/spare.F90'), ['spare_mod', 'x'])
+        assert not pruning.provides(Path('/src/spare.F90'), ['used_mod'])
+
+    def test_cycle(self):
+        units = [('one', Path('one.f90'), ['two']),
+                 ('two', Path('two.f90'), ['one'])]
+        derived = [(Path('one.f90'), Path('one.f90'), 'Analysed'),
+                   (Path('two.f90'), Path('two.f90'), 'Analysed')]
+        pruning = TargetPruning('one', units, derived)
+        assert pruning.needs(Path('one.f90'))
+        assert pruning.needs(Path('two.f90'))
@@ -0,0 +1,52 @@
+##############################################################################
+# (c) Crown copyright Met Office. All rights reserved.
+# For further details please refer to the file COPYRIGHT
+# which you should have received as part of this distribution
+##############################################################################
+from pathlib import Path
+
+from fab.layout import FlatLayout, TreeLayout
+
+
+class TestFlatLayout(object):
+    def test_path(self, tmp_path: Path):
+        workspace = tmp_path / 'working'
+        test_unit = FlatLayout(workspace)
+
+        assert test_unit.path(tmp_path / 'source/a/foo.F90', '.f90') \
+            == workspace / 'foo.f90'
+        assert test_unit.path(workspace / 'foo.f90', '.o') \
+            == workspace / 'foo.o'
+        assert workspace.is_dir()
+
+
+class TestTreeLayout(object):
+    def test_path(self, tmp_path: Path):
+        workspace = tmp_path / 'working'
+        test_unit = TreeLayout(workspace, tmp_path / 'source')
+
+        # Files from the source go in their counterpart
+        assert test_unit.path(tmp_path / 'source/a/b/foo.F90', '.f90') \
+            == workspace / 'a/b/foo.f90'
+        assert (workspace / 'a/b').is_dir()
+
+        # Files from the workspace stay where they are
+        assert test_unit.path(workspace / 'a/b/foo.f90', '.o') \
+            == workspace / 'a/b/foo.o'
+        assert test_unit.path(workspace / 'a/b/../c/bar.h') \
+            == workspace / 'a/c/bar.h'
+
+        # Files from elsewhere go somewhere of their own
+        elsewhere = test_unit.path(tmp_path / 'other/foo.c')
+        assert elsewhere.parent.parent == workspace
+        assert elsewhere.name == 'foo.c'
+        assert elsewhere != test_unit.path(tmp_path / 'another/foo.c')
+        assert elsewhere == test_unit.path(tmp_path / 'other/foo.c')
+
+    def test_source_later(self, tmp_path: Path):
+        workspace = tmp_path / 'working'
+        test_unit = TreeLayout(workspace)
+        test_unit.source = tmp_path / 'source'
+
+        assert test_unit.path(tmp_path / 'source/a/foo.c') \
+            == workspace / 'a/foo.c'
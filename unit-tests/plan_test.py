@@ -0,0 +1,238 @@
+##############################################################################
+# (c) Crown copyright Met Office. All rights reserved.
+# For further details please refer to the file COPYRIGHT
+# which you should have received as part of this distribution
+##############################################################################
+import io
+from pathlib import Path
+from typing import List, Sequence, Tuple
+
+from fab.artifact import \
+    Artifact, \
+    FortranSource, \
+    BinaryObject, \
+    Seen, \
+    Raw, \
+    Analysed, \
+    Compiled
+from fab.database import \
+    SqliteStateDatabase, \
+    FileInfoDatabase, \
+    DerivedFile, \
+    DerivedFileDatabase, \
+    MetricsDatabase, \
+    TaskMetric
+from fab.engine import PathMap
+from fab.graph import TargetPruning
+from fab.plan import Planner
+from fab.tasks import Task
+
+
+class NeverRun(Task):
+    def run(self, artifacts: List[Artifact]):
+        raise AssertionError('Planning should run nothing')
+
+
+class Preprocessor(NeverRun):
+    pass
+
+
+class Analyser(NeverRun):
+    pass
+
+
+class Compiler(NeverRun):
+    pass
+
+
+class Linker(NeverRun):
+    pass
+
+
+_PATHMAPS = [PathMap(r'.*\.F90', FortranSource, Seen)]
+_TASKMAP = {(FortranSource, Seen): Preprocessor(),
+            (FortranSource, Raw): Analyser(),
+            (FortranSource, Analysed): Compiler(),
+            (BinaryObject, Compiled): Linker()}
+
+# The program uses a module which uses another, something else is not used
+#
+_UNITS = [('prog', 'main', ['second_mod']),
+          ('second_mod', 'second', ['first_mod']),
+          ('first_mod', 'first', []),
+          ('spare_mod', 'spare', [])]
+
+# The program uses two modules, one of which also uses the other
+#
+_DIAMOND = [('prog', 'main', ['greeting_mod', 'constants_mod']),
+            ('greeting_mod', 'greeting', ['constants_mod']),
+            ('constants_mod', 'constants', [])]
+
+
+def _previous_build(tmp_path: Path,
+                    units=_UNITS) -> Tuple[Path, Path]:
+    """
+    Leaves behind what a build of the source tree would have.
+    """
+    source = tmp_path / 'source'
+    source.mkdir()
+    workspace = tmp_path / 'working'
+    workspace.mkdir()
+    database = SqliteStateDatabase(workspace)
+    file_info = FileInfoDatabase(database)
+    derived = DerivedFileDatabase(database)
+    for _, name, _ in units:
+        original = source / f'{name}.F90'
+        original.write_text(f'! {name}\n')
+        file_info.add_file_info(original,
+                                Artifact(original, FortranSource, Seen).hash)
+        preprocessed = workspace / f'{name}.f90'
+        preprocessed.write_text(f'! {name}\n')
+        compiled = workspace / f'{name}.o'
+        compiled.write_text('')
+        derived.add_derived_files(original, 'Seen',
+                                  [DerivedFile(preprocessed,
+                                               'FortranSource', 'Raw')])
+        derived.add_derived_files(preprocessed, 'Raw',
+                                  [DerivedFile(preprocessed,
+                                               'FortranSource', 'Analysed')])
+        derived.add_derived_files(preprocessed, 'Analysed',
+                                  [DerivedFile(compiled,
+                                               'BinaryObject', 'Compiled')])
+    return source, workspace
+
+
+def _units(workspace: Path,
+           units=_UNITS) -> List[Tuple[str, Path, Sequence[str]]]:
+    return [(unit, workspace / f'{name}.f90', depends_on)
+            for unit, name, depends_on in units]
+
+
+def _steps(plan) -> List[Tuple[int, str, str, str]]:
+    return [(step.level, step.stage, step.filename.name, step.reason)
+            for step in plan.steps]
+
+
+class TestPlanner(object):
+    def test_unchanged(self, tmp_path: Path):
+        source, workspace = _previous_build(tmp_path)
+        planner = Planner(workspace, 'prog', _PATHMAPS, _TASKMAP, True)
+        plan = planner.plan(source, _units(workspace))
+
+        assert plan.files('unchanged') == sorted(source.iterdir())
+        assert _steps(plan) == [(1, 'Linker', 'main.o', 'link')]
+        assert plan.profile() == [1]
+
+    def test_changed(self, tmp_path: Path):
+        source, workspace = _previous_build(tmp_path)
+        (source / 'first.F90').write_text('! Changed\n')
+        planner = Planner(workspace, 'prog', _PATHMAPS, _TASKMAP, True)
+        plan = planner.plan(source, _units(workspace))
+
+        # Everything depending on the change follows it, one at a time
+        assert plan.files('changed') == [source / 'first.F90']
+        assert _steps(plan) == [
+            (1, 'Preprocessor', 'first.F90', 'changed'),
+            (2, 'Analyser', 'first.f90', 'changed'),
+            (3, 'Compiler', 'first.f90', 'changed'),
+            (4, 'Compiler', 'second.f90', 'dependent'),
+            (5, 'Compiler', 'main.f90', 'dependent'),
+            (6, 'Linker', 'main.o', 'link')]
+        assert plan.stages()['Compiler'] == {'changed': 1, 'dependent': 2}
+
+    def test_changed_shared(self, tmp_path: Path):
+        source, workspace = _previous_build(tmp_path, _DIAMOND)
+        (source / 'constants.F90').write_text('! Changed\n')
+        planner = Planner(workspace, 'prog', _PATHMAPS, _TASKMAP, True)
+        plan = planner.plan(source, _units(workspace, _DIAMOND))
+
+        # A module used both directly and by way of another is compiled
+        # ahead of both its dependents
+        assert _steps(plan) == [
+            (1, 'Preprocessor', 'constants.F90', 'changed'),
+            (2, 'Analyser', 'constants.f90', 'changed'),
+            (3, 'Compiler', 'constants.f90', 'changed'),
+            (4, 'Compiler', 'greeting.f90', 'dependent'),
+            (5, 'Compiler', 'main.f90', 'dependent'),
+            (6, 'Linker', 'main.o', 'link')]
+
+    def test_missing(self, tmp_path: Path):
+        source, workspace = _previous_build(tmp_path)
+        (workspace / 'main.o').unlink()
+        planner = Planner(workspace, 'prog', _PATHMAPS, _TASKMAP, True)
+        plan = planner.plan(source, _units(workspace))
+
+        assert _steps(plan) == [(1, 'Compiler', 'main.f90', 'missing'),
+                                (2, 'Linker', 'main.o', 'link')]
+
+    def test_rebuild(self, tmp_path: Path):
+        source, workspace = _previous_build(tmp_path)
+        metrics = MetricsDatabase(SqliteStateDatabase(workspace))
+        for _, name, _ in _UNITS:
+            metrics.add_metric(TaskMetric(workspace / f'{name}.f90',
+                                          'Compiler', 2.0, 2.0, 0, 0, 0))
+        planner = Planner(workspace, 'prog', _PATHMAPS, _TASKMAP, False)
+        plan = planner.plan(source, _units(workspace))
+
+        # Only what the target needs is compiled, and only once its
+        # prerequisites are
+        assert plan.profile() == [4, 4, 1, 1, 1, 1]
+        assert [step.filename.name for step in plan.steps
+                if step.stage == 'Compiler'] \
+            == ['first.f90', 'second.f90', 'main.f90']
+        assert plan.estimates() == (6.0, 6.0, 9)
+
+    def test_several_targets(self, tmp_path: Path):
+        source, workspace = _previous_build(tmp_path)
+        linkers = {'prog': Linker(), 'spare_mod': Linker()}
+        planner = Planner(workspace, ['prog', 'spare_mod'],
+                          _PATHMAPS, _TASKMAP, False, linkers)
+        plan = planner.plan(source, _units(workspace))
+
+        # Each target is linked once what it needs is compiled
+        links = {step.filename.name: step.level for step in plan.steps
+                 if step.stage == 'Linker'}
+        assert links == {'main.o': 6, 'spare.o': 4}
+        assert sorted(step.filename.name for step in plan.steps
+                      if step.stage == 'Compiler') \
+            == ['first.f90', 'main.f90', 'second.f90', 'spare.f90']
+
+    def test_new(self, tmp_path: Path):
+        source, workspace = _previous_build(tmp_path)
+        (source / 'extra.F90').write_text('! New\n')
+        planner = Planner(workspace, 'prog', _PATHMAPS, _TASKMAP, True)
+        plan = planner.plan(source, _units(workspace))
+
+        assert plan.files('new') == [source / 'extra.F90']
+        assert plan.unknown == [source / 'extra.F90']
+        assert (1, 'Preprocessor', 'extra.F90', 'new') in _steps(plan)
+
+    def test_report(self, tmp_path: Path):
+        source, workspace = _previous_build(tmp_path)
+        (source / 'first.F90').write_text('! Changed\n')
+        planner = Planner(workspace, 'prog', _PATHMAPS, _TASKMAP, True)
+        stream = io.StringIO()
+        planner.plan(source, _units(workspace)).report(stream)
+
+        report = stream.getvalue()
+        assert 'Files        : 4 (1 changed, 0 new, 3 unchanged)' in report
+        assert 'Compiler             : 3 (1 changed, 2 dependent)' in report
+        assert 'Waves        : 6, at most 1 steps at once' in report
+        assert '        1-6 :      1 #' in report
+
+    def test_pruned(self, tmp_path: Path):
+        source, workspace = _previous_build(tmp_path)
+        (source / 'spare.F90').write_text('! Changed\n')
+        derived = DerivedFileDatabase(SqliteStateDatabase(workspace))
+        pruning = TargetPruning('prog',
+                                _units(workspace),
+                                ((original, info.filename, info.state)
+                                 for original, info in derived))
+        planner = Planner(workspace, 'prog', _PATHMAPS, _TASKMAP, False)
+        plan = planner.plan(source, _units(workspace), pruning)
+
+        # Changed files are looked at again, whether needed or not
+        assert plan.profile() == [4, 4, 1, 1, 1, 1]
+        assert [step.filename.name for step in plan.steps
+                if step.stage == 'Preprocessor'] \
+            == ['spare.F90', 'second.F90', 'main.F90', 'first.F90']
@@ -6,23 +6,33 @@
 
 from fab.queue import QueueManager
 from fab.artifact import Artifact, Unknown, New
-from fab.engine import Engine
+from fab.engine import Action, Engine, Job
+from fab.governor import LoadGovernor
+from fab.graph import CriticalPath
+from fab.tasks import Resource
+from functools import partial
+import os
 from pathlib import Path
 import subprocess
-from typing import List
+from threading import Event
+import time
+from typing import Hashable, List, Optional, Tuple
 
 
 class DummyEngine(Engine):
     def __init__(self):
         self._target = "target"
+        self._taskmap = {}
+        self._batch_size = 1
 
-    def process(self,
+    def prepare(self,
                 artifact: Artifact,
-                shared,
-                objects,
-                lock) -> List[Artifact]:
-        subprocess.run(['touch', str(artifact.location)], check=True)
-        return []
+                graph) -> Tuple[Optional[Job], List[Artifact]]:
+        return Job(Action.PROCESS, artifact), []
+
+    def execute(self, job: Job) -> Job:
+        subprocess.run(['touch', str(job.artifact.location)], check=True)
+        return job
 
 
 def test_queue(tmp_path: Path):
@@ -47,10 +57,220 @@ def test_queue(tmp_path: Path):
     q_manager.shutdown()
 
 
+def test_priority_queue(tmp_path: Path):
+
+    dummy_engine = DummyEngine()
+
+    ranking = CriticalPath([])
+    q_manager = QueueManager(2, dummy_engine, ranking)
+    q_manager.run()
+
+    for i in range(1, 4):
+        artifact = Artifact(tmp_path / f"file_{i}",
+                            Unknown,
+                            New)
+        q_manager.add_to_queue(artifact)
+
+    q_manager.check_queue_done()
+
+    for i in range(1, 4):
+        filename = tmp_path / f"file_{i}"
+        assert filename.exists()
+
+    q_manager.shutdown()
+
+
 def test_startstop():
     dummy_engine = DummyEngine()
     q_manager = QueueManager(1, dummy_engine)
     q_manager.run()
-    assert len(q_manager._workers) == 1
+    # One worker of each resource class and a relay for the processes
+    assert len(q_manager._workers) == 3
+
+    # Idle workers stop as soon as they are told to
+    start = time.monotonic()
     q_manager.shutdown()
+    assert time.monotonic() - start < 0.5
     assert len(q_manager._workers) == 0
+
+
+class RoutingEngine(DummyEngine):
+    """
+    Processes files named for the CPU in Python and the rest with a tool.
+    """
+    def resource(self, artifact: Artifact) -> Resource:
+        if artifact.location.name.startswith('cpu'):
+            return Resource.CPU
+        return Resource.SUBPROCESS
+
+    def execute(self, job: Job) -> Job:
+        location = job.artifact.location
+        location.write_text(str(os.getpid()))
+        if location.name == 'cpu_first':
+            job.outputs.append(Artifact(location.with_name('tool_second'),
+                                        Unknown,
+                                        New))
+        return job
+
+
+def test_resource_routing(tmp_path: Path):
+    q_manager = QueueManager(2, RoutingEngine())
+    q_manager.run()
+    q_manager.add_to_queue(Artifact(tmp_path / 'cpu_first', Unknown, New))
+    q_manager.add_to_queue(Artifact(tmp_path / 'tool_first', Unknown, New))
+    q_manager.check_queue_done()
+    q_manager.shutdown()
+
+    # Python work happens in other processes, waiting on tools in this one
+    #
+    assert (tmp_path / 'cpu_first').read_text() != str(os.getpid())
+    assert (tmp_path / 'tool_first').read_text() == str(os.getpid())
+    assert (tmp_path / 'tool_second').read_text() == str(os.getpid())
+
+
+class MarkingEngine(RoutingEngine):
+    def __init__(self, mark: str):
+        super().__init__()
+        self._mark = mark
+
+    def execute(self, job: Job) -> Job:
+        job.artifact.location.write_text(self._mark)
+        return job
+
+
+def test_bootstrap(tmp_path: Path):
+    q_manager = QueueManager(1,
+                             MarkingEngine('sent'),
+                             bootstrap=partial(MarkingEngine, 'made'))
+    q_manager.run()
+    q_manager.add_to_queue(Artifact(tmp_path / 'cpu_first', Unknown, New))
+    q_manager.add_to_queue(Artifact(tmp_path / 'tool_first', Unknown, New))
+    q_manager.check_queue_done()
+    q_manager.shutdown()
+
+    # Processes make their own engine, threads share the one given
+    #
+    assert (tmp_path / 'cpu_first').read_text() == 'made'
+    assert (tmp_path / 'tool_first').read_text() == 'sent'
+
+
+class FailingEngine(DummyEngine):
+    def execute(self, job: Job) -> Job:
+        if job.artifact.location.name == 'broken':
+            raise ValueError('Cannot be processed')
+        return super().execute(job)
+
+
+def test_failure(tmp_path: Path, caplog):
+    q_manager = QueueManager(1, FailingEngine())
+    q_manager.run()
+    q_manager.add_to_queue(Artifact(tmp_path / 'broken', Unknown, New))
+    q_manager.add_to_queue(Artifact(tmp_path / 'working', Unknown, New))
+
+    # A failure is reported and does not hold up the rest of the build
+    #
+    q_manager.check_queue_done()
+    q_manager.shutdown()
+    assert (tmp_path / 'working').exists()
+    assert 'Cannot be processed' in caplog.text
+    assert q_manager.failures() \
+        == [(tmp_path / 'broken', 'ValueError: Cannot be processed')]
+
+
+class SchedulingEngine(DummyEngine):
+    """
+    Holds each artifact until what it depends on has been processed.
+    """
+    def __init__(self):
+        super().__init__()
+        self._target = 'main'
+
+    def prepare(self,
+                artifact: Artifact,
+                graph) -> Tuple[Optional[Job], List[Artifact]]:
+        ready, claimed = graph.schedule(artifact)
+        return (Job(Action.PROCESS, artifact) if ready else None), claimed
+
+
+def test_blocked(tmp_path: Path):
+    q_manager = QueueManager(1, SchedulingEngine())
+    q_manager.run()
+    main = Artifact(tmp_path / 'main', Unknown, New)
+    main.add_definition('main')
+    main.add_dependency('missing_mod')
+    q_manager.add_to_queue(main)
+    q_manager.check_queue_done()
+    q_manager.shutdown()
+
+    # Nothing fails but the artifact can never be processed
+    #
+    assert q_manager.failures() == []
+    assert q_manager.blocked() == {tmp_path / 'main': {'missing_mod'}}
+
+
+class BatchingEngine(DummyEngine):
+    """
+    Does files named with the same prefix in batches, once let go.
+    """
+    def __init__(self):
+        super().__init__()
+        self._batch_size = 3
+        self.go = Event()
+        self.batches: List[List[str]] = []
+
+    def resource(self, artifact: Artifact) -> Resource:
+        return Resource.SUBPROCESS
+
+    def batch_key(self, job: Job) -> Optional[Hashable]:
+        prefix = job.artifact.location.name.rstrip('0123456789')
+        return None if prefix == 'alone' else prefix
+
+    def execute(self, job: Job) -> Job:
+        self.go.wait()
+        self.batches.append([batched.artifact.location.name
+                             for batched in [job] + job.batch])
+        return job
+
+
+def test_batch(tmp_path: Path):
+    engine = BatchingEngine()
+    q_manager = QueueManager(1, engine)
+    q_manager.run()
+    for name in ['first', 'a1', 'b1', 'a2', 'alone', 'a3', 'a4']:
+        q_manager.add_to_queue(Artifact(tmp_path / name, Unknown, New))
+    engine.go.set()
+    q_manager.check_queue_done()
+    q_manager.shutdown()
+
+    # Whatever is first waiting goes along with as many of the same kind
+    # as make a batch, the rest keeping their turn
+    #
+    assert engine.batches == [['first'], ['a1', 'a2', 'a3'], ['b1'],
+                              ['alone'], ['a4']]
+
+
+class SingleSlot(LoadGovernor):
+    def __init__(self):
+        super().__init__(1)
+        self.asked = 0
+
+    def slots(self, current: int) -> int:
+        self.asked += 1
+        return 1
+
+
+def test_governed(tmp_path: Path):
+    governor = SingleSlot()
+    q_manager = QueueManager(2, DummyEngine(), governor=governor)
+    q_manager.run()
+    for i in range(1, 4):
+        q_manager.add_to_queue(Artifact(tmp_path / f"file_{i}", Unknown, New))
+    q_manager.check_queue_done()
+    q_manager.shutdown()
+
+    # The governor is consulted as work is handed out and its limit kept to
+    #
+    assert governor.asked > 0
+    assert q_manager._slots == 1
+    for i in range(1, 4):
+        assert (tmp_path / f"file_{i}").exists()
@@ -3,12 +3,21 @@
 # For further details please refer to the file COPYRIGHT
 # which you should have received as part of this distribution
 ##############################################################################
+import os
 from pathlib import Path
 from textwrap import dedent
+import zlib
 
 from pytest import fail  # type: ignore
 
-from fab.reader import FileTextReader, StringTextReader
+from fab.artifact import file_hash, use_hash_algorithm
+from fab.reader import \
+    FileTextReader, \
+    StringTextReader, \
+    forget_sources, \
+    read_source, \
+    shared_reads, \
+    write_source
 
 
 class TestFileTextReader:
@@ -32,6 +41,65 @@ class TestFileTextReader:
         for _ in test_unit.line_by_line():
             fail(' No lines should be generated from a read file')
 
+    def test_shared(self, tmp_path: Path):
+        test_file = tmp_path / 'beef.food'
+        test_file.write_text('This is my test file\nIt has two lines')
+
+        with shared_reads():
+            first = [line for line in FileTextReader(test_file).line_by_line()]
+            # Changed behind the reader's back, so only the buffer is seen
+            test_file.write_text('Something else')
+            second = [line for line
+                      in FileTextReader(test_file).line_by_line()]
+            assert first == second == ['This is my test file\n',
+                                       'It has two lines']
+            with shared_reads():
+                assert read_source(test_file) \
+                    == b'This is my test file\nIt has two lines'
+
+        # Outside the block the file is read afresh
+        assert read_source(test_file) == b'Something else'
+        assert [line for line in FileTextReader(test_file).line_by_line()] \
+            == ['Something else']
+
+
+class TestSharedReads:
+    def test_kept(self, tmp_path: Path):
+        forget_sources()
+        test_file = tmp_path / 'old.c'
+        test_file.write_bytes(b'int first;')
+        os.utime(test_file, ns=(10 ** 18, 10 ** 18))
+        assert read_source(test_file) == b'int first;'
+
+        # A change hidden from the status goes unseen, unless asked to
+        # read afresh as hashing does
+        test_file.write_bytes(b'int other;')
+        os.utime(test_file, ns=(10 ** 18, 10 ** 18))
+        assert read_source(test_file) == b'int first;'
+        use_hash_algorithm('adler32')
+        assert file_hash(test_file) == zlib.adler32(b'int other;')
+        assert read_source(test_file) == b'int other;'
+
+        # Any change to the status has the file read again, but one only
+        # just written is not kept
+        test_file.write_bytes(b'int third;')
+        assert read_source(test_file) == b'int third;'
+        test_file.write_bytes(b'int fifth;')
+        assert read_source(test_file) == b'int fifth;'
+        forget_sources()
+
+    def test_write(self, tmp_path: Path):
+        use_hash_algorithm('adler32')
+        test_file = tmp_path / 'output.c'
+
+        with shared_reads():
+            write_source(test_file, b'Lorem ipsum dolor sit')
+            assert test_file.read_bytes() == b'Lorem ipsum dolor sit'
+            # The hash is taken from what was written, not the file
+            test_file.unlink()
+            assert file_hash(test_file) == 1463158782
+            assert read_source(test_file) == b'Lorem ipsum dolor sit'
+
 
 class TestStringTextReader:
     def test_constructor(self):
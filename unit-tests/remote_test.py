@@ -0,0 +1,233 @@
+##############################################################################
+# (c) Crown copyright Met Office. All rights reserved.
+# For further details please refer to the file COPYRIGHT
+# which you should have received as part of this distribution
+##############################################################################
+from multiprocessing import Process
+from pathlib import Path
+import subprocess
+import sys
+from typing import Dict, Iterator, List
+
+import pytest  # type: ignore
+
+from fab.artifact import Artifact, Unknown, New
+from fab.engine import Action, Engine, Job
+from fab.queue import QueueManager
+from fab.remote import \
+    RemoteUnavailable, \
+    RemoteWorker, \
+    WorkerServer, \
+    current_remote, \
+    parse_address
+
+_KEY = b'test key'
+
+# Copies its input to its output, reporting where it was run
+#
+_COPY = [sys.executable,
+         '-c',
+         'import os, sys; '
+         'open(sys.argv[2], "w").write(open(sys.argv[1]).read() '
+         '+ os.getcwd())']
+
+
+@pytest.fixture
+def servers() -> Iterator[List[WorkerServer]]:
+    # Several workers, each a process of its own, as they would be on
+    # other machines
+    started: List[WorkerServer] = []
+    processes: List[Process] = []
+    for _ in range(2):
+        server = WorkerServer(('localhost', 0), _KEY)
+        process = Process(target=server.serve_forever, daemon=True)
+        process.start()
+        started.append(server)
+        processes.append(process)
+    yield started
+    for server, process in zip(started, processes):
+        process.terminate()
+        process.join()
+        server.close()
+
+
+def test_parse_address():
+    assert parse_address('somewhere:1234') == ('somewhere', 1234)
+    assert parse_address('[::1]:1234') == ('[::1]', 1234)
+    with pytest.raises(ValueError):
+        parse_address('somewhere')
+    with pytest.raises(ValueError):
+        parse_address('somewhere:port')
+
+
+class TestRemoteWorker(object):
+    def test_run(self, tmp_path: Path, servers):
+        workspace = tmp_path / 'working'
+        workspace.mkdir()
+        source = tmp_path / 'input.txt'
+        source.write_text('Hello from ')
+
+        remote = RemoteWorker(servers[0].address, _KEY)
+        remote.connect()
+        try:
+            # Paths to inputs and into the workspace are made to suit
+            #
+            remote.run(_COPY + [str(source), str(workspace / 'output.txt')],
+                       workspace,
+                       [source],
+                       [workspace / 'output.txt', workspace / 'absent.txt'])
+            result = (workspace / 'output.txt').read_text()
+            assert result.startswith('Hello from ')
+            assert not result.endswith(str(workspace))
+            assert not (workspace / 'absent.txt').exists()
+
+            with pytest.raises(subprocess.CalledProcessError):
+                remote.run(['false'], workspace, [], [])
+
+            # The connection remains good after a failure
+            remote.run(_COPY + [str(source), str(workspace / 'again.txt')],
+                       workspace,
+                       [source],
+                       [workspace / 'again.txt'])
+            assert (workspace / 'again.txt').exists()
+        finally:
+            remote.close()
+
+    def test_wrong_key(self, servers):
+        remote = RemoteWorker(servers[0].address, b'wrong key')
+        with pytest.raises(Exception):
+            remote.connect()
+
+    def test_assignment(self, tmp_path: Path, servers):
+        remote = RemoteWorker(servers[0].address, _KEY)
+        assert current_remote() is None
+        with remote:
+            # Only a connected worker is of any use
+            assert current_remote() is None
+            remote.connect()
+            assert current_remote() is remote
+
+            # Lost workers are given up on
+            remote._connection.close()  # type: ignore
+            remote._connection = _Broken()  # type: ignore
+            with pytest.raises(RemoteUnavailable):
+                remote.run(['true'], tmp_path, [], [])
+            assert current_remote() is None
+        assert current_remote() is None
+
+
+class _Broken(object):
+    def send(self, message):
+        raise EOFError('Gone away')
+
+    def close(self):
+        pass
+
+
+class RemoteEngine(Engine):
+    """
+    Copies each file, remotely where it may.
+    """
+    def __init__(self, workspace: Path):
+        self._workspace = workspace
+        self._target = 'target'
+        self._taskmap = {}
+        self._batch_size = 1
+
+    def prepare(self, artifact: Artifact, graph):
+        return Job(Action.COMPILE, artifact), []
+
+    def is_portable(self, job: Job) -> bool:
+        return job.artifact.location.name.startswith('portable')
+
+    def execute(self, job: Job) -> Job:
+        source = job.artifact.location
+        output = self._workspace / (source.name + '.out')
+        command = _COPY + [str(source), str(output)]
+        remote = current_remote()
+        if remote is not None:
+            remote.run(command, self._workspace, [source], [output])
+        else:
+            subprocess.run(command, check=True, cwd=str(self._workspace))
+        return job
+
+    def complete(self, job: Job, graph) -> List[Artifact]:
+        return []
+
+
+def test_queue(tmp_path: Path, servers):
+    workspace = tmp_path / 'working'
+    workspace.mkdir()
+    remotes = [RemoteWorker(server.address, _KEY)
+               for server in servers + servers]
+    remotes.append(RemoteWorker(('localhost', 1), _KEY))  # Not there
+
+    q_manager = QueueManager(1, RemoteEngine(workspace), remotes=remotes)
+    q_manager.run()
+    names = [f'portable_{i}' for i in range(8)] + ['local_0', 'local_1']
+    for name in names:
+        (tmp_path / name).write_text('')
+        q_manager.add_to_queue(Artifact(tmp_path / name, Unknown, New))
+    q_manager.check_queue_done()
+    q_manager.shutdown()
+
+    # Only work which can be done elsewhere leaves, and only for workers
+    # which are there
+    #
+    assert len(q_manager._remotes) == 4
+    assert (workspace / 'local_0.out').read_text() == str(workspace)
+    assert (workspace / 'local_1.out').read_text() == str(workspace)
+    elsewhere = [name for name in names
+                 if (workspace / f'{name}.out').read_text()
+                 != str(workspace)]
+    assert len(elsewhere) > 0
+    assert all(name.startswith('portable') for name in elsewhere)
+
+
+class LosingEngine(RemoteEngine):
+    """
+    Loses the connection to the first worker it sends to, whereupon the
+    work is done here instead, and notes who did each job.
+    """
+    def __init__(self, workspace: Path):
+        super().__init__(workspace)
+        self.done_by: Dict[str, int] = {}
+
+    def execute(self, job: Job) -> Job:
+        remote = current_remote()
+        if remote is not None and not self.done_by:
+            remote._connection.close()  # type: ignore
+            remote._connection = _Broken()  # type: ignore
+        try:
+            super().execute(job)
+        except RemoteUnavailable:
+            subprocess.run(_COPY + [str(job.artifact.location),
+                                    str(self._workspace / 'lost.out')],
+                           check=True)
+        self.done_by[job.artifact.location.name] = job.worker
+        return job
+
+
+def test_queue_lost(tmp_path: Path, servers):
+    workspace = tmp_path / 'working'
+    workspace.mkdir()
+    engine = LosingEngine(workspace)
+    q_manager = QueueManager(1,
+                             engine,
+                             remotes=[RemoteWorker(servers[0].address,
+                                                   _KEY)])
+    q_manager.run()
+    names = [f'portable_{i}' for i in range(8)]
+    for name in names:
+        (tmp_path / name).write_text('')
+        q_manager.add_to_queue(Artifact(tmp_path / name, Unknown, New))
+    q_manager.check_queue_done()
+    q_manager.shutdown()
+
+    # Once lost the worker is sent nothing more, all else being done by
+    # the local worker
+    #
+    assert q_manager._connected == 0
+    assert sorted(engine.done_by) == names
+    remote_worker = 3
+    assert list(engine.done_by.values()).count(remote_worker) == 1
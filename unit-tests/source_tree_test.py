@@ -78,3 +78,14 @@ class TestTreeDescent(object):
         assert visitor.visited == [tree_root / 'beta' / 'gamma',
                                    tree_root / 'beta' / 'delta',
                                    tree_root / 'alpha']
+
+    def test_files(self, tmp_path: Path):
+        (tmp_path / 'alpha').write_text('File in root')
+        (tmp_path / 'beta').mkdir()
+        (tmp_path / 'beta' / 'gamma').write_text('File in beta')
+
+        files = TreeDescent(tmp_path).files()
+        assert next(files) == tmp_path / 'beta' / 'gamma'
+        # Nothing more is looked for until it is asked for
+        (tmp_path / 'beta' / 'delta').write_text('Another file in beta')
+        assert list(files) == [tmp_path / 'alpha']
@@ -1,6 +1,43 @@
 # (c) Crown copyright Met Office. All rights reserved.
 # For further details please refer to the file COPYRIGHT
 # which you should have received as part of this distribution
-#
-# Since this module only defines a single abstract interface
-# there isn't really anything to test
+from pathlib import Path
+import subprocess
+import sys
+
+import pytest  # type: ignore
+
+from fab.tasks import measure_children, run_command, subprocess_time
+
+
+class TestRunCommand(object):
+    def test_run(self, tmp_path: Path):
+        before = subprocess_time()
+        with measure_children() as usage:
+            run_command([sys.executable,
+                         '-c',
+                         'open("output", "wb").write(bytes(100000))'],
+                        tmp_path)
+        assert (tmp_path / 'output').stat().st_size == 100000
+        assert subprocess_time() > before
+        assert usage.cpu > 0.0
+        assert usage.peak_rss > 0
+        assert usage.bytes_written >= 100000
+
+    def test_nested(self, tmp_path: Path):
+        # Programs count towards every measurement they are run within
+        with measure_children() as outer:
+            with measure_children() as inner:
+                run_command(['true'])
+            run_command(['true'])
+        assert outer.cpu >= inner.cpu
+        assert outer.peak_rss >= inner.peak_rss
+
+    def test_failure(self):
+        with pytest.raises(subprocess.CalledProcessError) as err:
+            run_command(['false'])
+        assert err.value.returncode == 1
+        assert err.value.cmd == ['false']
+
+        with pytest.raises(FileNotFoundError):
+            run_command(['/nonexistent/program'])
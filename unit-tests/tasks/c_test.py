@@ -377,7 +377,7 @@ class TestCPreProcessor(object):
                             Seen)
 
         # Monkeypatch the subprocess call out and run
-        patched_run = mocker.patch('subprocess.run')
+        patched_run = mocker.patch('fab.tasks.c.run_command')
         artifacts_out = preprocessor.run([artifact])
 
         # Check that the subprocess call contained the command
@@ -387,14 +387,12 @@ class TestCPreProcessor(object):
                                '--baz',
                                str(tmp_path / 'foo.c'),
                                str(workspace / 'foo.fabcpp')]
-        patched_run.assert_any_call(expected_pp_command,
-                                    check=True)
+        patched_run.assert_any_call(expected_pp_command)
 
         expected_mv_command = ['mv',
                                str(workspace / 'foo.fabcpp'),
                                str(workspace / 'foo.c')]
-        patched_run.assert_any_call(expected_mv_command,
-                                    check=True)
+        patched_run.assert_any_call(expected_mv_command)
 
         assert len(artifacts_out) == 1
         assert artifacts_out[0].location == workspace / 'foo.c'
@@ -419,7 +417,7 @@ class TestCCompiler(object):
                             Analysed)
 
         # Monkeypatch the subprocess call out and run
-        patched_run = mocker.patch('subprocess.run')
+        patched_run = mocker.patch('fab.tasks.c.run_command')
         artifacts_out = compiler.run([artifact])
 
         # Check that the subprocess call contained the command
@@ -430,8 +428,7 @@ class TestCCompiler(object):
                             str(tmp_path / 'flintstone.c'),
                             '-o',
                             str(workspace / 'flintstone.o')]
-        patched_run.assert_any_call(expected_command,
-                                    check=True)
+        patched_run.assert_any_call(expected_command, None)
 
         assert len(artifacts_out) == 1
         assert artifacts_out[0].location == workspace / 'flintstone.o'
@@ -439,3 +436,42 @@ class TestCCompiler(object):
         assert artifacts_out[0].state is Compiled
         assert artifacts_out[0].depends_on == []
         assert artifacts_out[0].defines == []
+
+    def test_run_batch_relative(self, mocker, monkeypatch, tmp_path: Path):
+        monkeypatch.chdir(tmp_path)
+        workspace = Path('working')
+        workspace.mkdir()
+        compiler = CCompiler('fred', ['-c', '-I', 'include'], workspace)
+        artifacts = [Artifact(workspace / 'flintstone.c', CSource, Analysed),
+                     Artifact(workspace / 'rubble.c', CSource, Analysed)]
+
+        patched_run = mocker.patch('fab.tasks.c.run_command')
+        compiler.run(artifacts)
+
+        # Being run in the workspace everything is found from anywhere
+        #
+        patched_run.assert_called_once_with(
+            ['fred',
+             '-c',
+             '-I', str(tmp_path / 'include'),
+             str(tmp_path / 'working/flintstone.c'),
+             str(tmp_path / 'working/rubble.c')],
+            workspace)
+
+    def test_run_batch(self, mocker, tmp_path: Path):
+        workspace = tmp_path / 'working'
+        workspace.mkdir()
+        compiler = CCompiler('fred', ['-c'], workspace)
+        artifacts = [Artifact(tmp_path / 'flintstone.c', CSource, Analysed),
+                     Artifact(tmp_path / 'rubble.c', CSource, Analysed)]
+
+        patched_run = mocker.patch('fab.tasks.c.run_command')
+        artifacts_out = compiler.run(artifacts)
+
+        patched_run.assert_called_once_with(['fred',
+                                             '-c',
+                                             str(tmp_path / 'flintstone.c'),
+                                             str(tmp_path / 'rubble.c')],
+                                            workspace)
+        assert [artifact.location for artifact in artifacts_out] \
+            == [workspace / 'flintstone.o', workspace / 'rubble.o']
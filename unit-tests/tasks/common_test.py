@@ -3,7 +3,9 @@
 # For further details please refer to the file COPYRIGHT
 # which you should have received as part of this distribution
 ##############################################################################
+import os
 from pathlib import Path
+import subprocess
 from textwrap import dedent
 
 from fab.tasks.common import Linker, HeaderAnalyser
@@ -36,7 +38,7 @@ class TestLinker:
                               New)]
 
         # Monkeypatch the subprocess call out and run linker
-        patched_run = mocker.patch('subprocess.run')
+        patched_run = mocker.patch('fab.tasks.common.run_command')
         artifacts_out = linker.run(artifacts)
 
         # Check that the subprocess call contained the command
@@ -48,8 +50,7 @@ class TestLinker:
                             file2,
                             '--bar',
                             '--baz']
-        patched_run.assert_called_once_with(expected_command,
-                                            check=True)
+        patched_run.assert_called_once_with(expected_command)
         assert len(artifacts_out) == 1
         assert artifacts_out[0].location == workspace / 'qux'
         assert artifacts_out[0].filetype is Executable
@@ -57,6 +58,49 @@ class TestLinker:
         assert artifacts_out[0].depends_on == []
         assert artifacts_out[0].defines == []
 
+    def test_run_archived(self, tmp_path: Path):
+        workspace = tmp_path / 'working'
+        objects = []
+        for name in ['one', 'two']:
+            directory = workspace / name
+            directory.mkdir(parents=True)
+            objects.append(directory / f'{name}.o')
+        for obj in objects:
+            obj.write_text(f'Object {obj.stem}')
+        artifacts = [Artifact(obj, Unknown, New) for obj in objects]
+        linker = Linker('true', [], workspace, 'qux', 'ar')
+
+        def members(directory: Path) -> str:
+            return subprocess.run(['ar', 't', str(directory / 'libqux.a')],
+                                  check=True,
+                                  stdout=subprocess.PIPE,
+                                  universal_newlines=True).stdout
+
+        # An archive is made for each directory of objects
+        #
+        linker.run(artifacts)
+        assert members(workspace / 'one') == 'one.o\n'
+        assert members(workspace / 'two') == 'two.o\n'
+
+        # Only changed members are replaced
+        #
+        archive = workspace / 'one' / 'libqux.a'
+        earlier = archive.stat().st_mtime_ns - 10 ** 9
+        for obj in objects:
+            os.utime(obj, ns=(earlier, earlier))
+        before = (workspace / 'two' / 'libqux.a').stat().st_mtime_ns
+        extra = workspace / 'one' / 'extra.o'
+        extra.write_text('Object extra')
+        linker.run(artifacts + [Artifact(extra, Unknown, New)])
+        assert members(workspace / 'one') == 'one.o\nextra.o\n'
+        assert (workspace / 'two' / 'libqux.a').stat().st_mtime_ns \
+            == before
+
+        # As are those no longer linked
+        #
+        linker.run(artifacts)
+        assert members(workspace / 'one') == 'one.o\n'
+
 
 class TestHeaderAnalyser:
     def test_run(self, tmp_path):
@@ -10,7 +10,9 @@ from typing import Iterator, Union
 
 import pytest  # type: ignore
 
+from fab.cache import ObjectCache
 from fab.database import SqliteStateDatabase, WorkingStateException
+from fab.remote import RemoteUnavailable, RemoteWorker
 from fab.tasks import TaskException
 from fab.tasks.fortran import \
     FortranAnalyser, \
@@ -267,6 +269,51 @@ class TestFortranWorkingSpace:
         with pytest.raises(WorkingStateException):
             _ = test_unit.get_program_unit('pooh')
 
+    def test_get_file_program_units(self, tmp_path: Path):
+        database = SqliteStateDatabase(tmp_path)
+        test_unit = FortranWorkingState(database)
+        assert test_unit.get_file_program_units(Path('tigger.f90')) == []
+
+        test_unit.add_fortran_program_unit(FortranUnitID('tigger',
+                                                         Path('tigger.f90')))
+        test_unit.add_fortran_program_unit(FortranUnitID('eeor',
+                                                         Path('tigger.f90')))
+        test_unit.add_fortran_program_unit(FortranUnitID('pooh',
+                                                         Path('pooh.f90')))
+        test_unit.add_fortran_dependency(FortranUnitID('eeor',
+                                                       Path('tigger.f90')),
+                                         'piglet')
+        test_unit.add_fortran_dependency(FortranUnitID('eeor',
+                                                       Path('tigger.f90')),
+                                         'pooh')
+        assert test_unit.get_file_program_units(Path('tigger.f90')) \
+            == [FortranInfo(FortranUnitID('tigger', Path('tigger.f90'))),
+                FortranInfo(FortranUnitID('eeor', Path('tigger.f90')),
+                            ['piglet', 'pooh'])]
+        assert test_unit.get_file_program_units(Path('pooh.f90')) \
+            == [FortranInfo(FortranUnitID('pooh', Path('pooh.f90')))]
+
+    def test_module_fingerprints(self, tmp_path: Path):
+        database = SqliteStateDatabase(tmp_path)
+        test_unit = FortranWorkingState(database)
+        assert test_unit.get_module_fingerprints(Path('tigger.f90')) == {}
+
+        test_unit.set_module_fingerprints(Path('tigger.f90'),
+                                          {'tigger': 'beef', 'eeor': 'cafe'})
+        test_unit.set_module_fingerprints(Path('pooh.f90'), {'pooh': 'dead'})
+        assert test_unit.get_module_fingerprints(Path('tigger.f90')) \
+            == {'tigger': 'beef', 'eeor': 'cafe'}
+
+        test_unit.set_module_fingerprints(Path('tigger.f90'),
+                                          {'tigger': 'f00d'})
+        assert test_unit.get_module_fingerprints(Path('tigger.f90')) \
+            == {'tigger': 'f00d'}
+        assert test_unit.get_module_fingerprints(Path('pooh.f90')) \
+            == {'pooh': 'dead'}
+
+        test_unit.remove_fortran_file(Path('tigger.f90'))
+        assert test_unit.get_module_fingerprints(Path('tigger.f90')) == {}
+
 
 class DummyReader(TextReader):
     @property
@@ -394,6 +441,37 @@ class TestFortranAnalyser(object):
         assert output_artifacts[0].filetype is FortranSource
         assert output_artifacts[0].state is Analysed
 
+    def test_restore(self, tmp_path: Path):
+        """
+        Tests that a previous analysis is recovered from the database.
+        """
+        test_file: Path = tmp_path / 'test.f90'
+        test_file.write_text(
+            dedent('''
+                   module bar
+                     use cheese_mod, only : bits_n_bobs
+                     implicit none
+                   end module bar
+
+                   program foo
+                     use bar
+                     use beef_mod
+                     implicit none
+                   end program foo
+                   '''))
+        test_unit = FortranAnalyser(tmp_path)
+        test_artifact = Artifact(test_file, FortranSource, Raw)
+        analysed = test_unit.run([test_artifact])[0]
+
+        restored = test_unit.restore(test_artifact,
+                                     [Artifact(test_file,
+                                               FortranSource,
+                                               Analysed)])
+        assert len(restored) == 1
+        assert sorted(restored[0].defines) == sorted(analysed.defines)
+        assert sorted(restored[0].depends_on) \
+            == sorted(analysed.depends_on)
+
     def test_analyser_scope(self, caplog, tmp_path):
         """
         Tests that the analyser is able to track scope correctly.
@@ -602,7 +680,7 @@ class TestFortranPreProcessor(object):
                             Seen)
 
         # Monkeypatch the subprocess call out and run
-        patched_run = mocker.patch('subprocess.run')
+        patched_run = mocker.patch('fab.tasks.fortran.run_command')
         artifacts_out = preprocessor.run([artifact])
 
         # Check that the subprocess call contained the command
@@ -612,8 +690,7 @@ class TestFortranPreProcessor(object):
                             '--baz',
                             str(tmp_path / 'foo.F90'),
                             str(workspace / 'foo.f90')]
-        patched_run.assert_any_call(expected_command,
-                                    check=True)
+        patched_run.assert_any_call(expected_command)
 
         assert len(artifacts_out) == 1
         assert artifacts_out[0].location == workspace / 'foo.f90'
@@ -638,7 +715,7 @@ class TestFortranCompiler(object):
                             Analysed)
 
         # Monkeypatch the subprocess call out and run
-        patched_run = mocker.patch('subprocess.run')
+        patched_run = mocker.patch('fab.tasks.fortran.run_command')
         artifacts_out = compiler.run([artifact])
 
         # Check that the subprocess call contained the command
@@ -649,8 +726,7 @@ class TestFortranCompiler(object):
                             str(tmp_path / 'flintstone.f90'),
                             '-o',
                             str(workspace / 'flintstone.o')]
-        patched_run.assert_any_call(expected_command,
-                                    check=True)
+        patched_run.assert_any_call(expected_command, None)
 
         assert len(artifacts_out) == 1
         assert artifacts_out[0].location == workspace / 'flintstone.o'
@@ -658,3 +734,196 @@ class TestFortranCompiler(object):
         assert artifacts_out[0].state is Compiled
         assert artifacts_out[0].depends_on == []
         assert artifacts_out[0].defines == []
+
+    def test_cache(self, mocker, tmp_path: Path):
+        source = tmp_path / 'flintstone.f90'
+        source.write_text('module flintstone\nend module flintstone\n')
+        artifact = Artifact(source, FortranSource, Analysed)
+        artifact.add_definition('flintstone')
+        cache = ObjectCache(tmp_path / 'cache', 1024 ** 2)
+
+        def fake_compiler(command, cwd=None):
+            Path(command[-1]).write_text('object')
+            (Path(command[-1]).parent / 'flintstone.mod') \
+                .write_text('module')
+
+        mocker.patch('subprocess.run',
+                     return_value=mocker.Mock(stdout='fred 1.0'))
+        patched_run = mocker.patch('fab.tasks.fortran.run_command',
+                                   side_effect=fake_compiler)
+
+        # Compiling in one workspace fills the cache for another
+        #
+        for workspace in [tmp_path / 'first', tmp_path / 'second']:
+            workspace.mkdir()
+            compiler = FortranCompiler('fred',
+                                       ['-J', str(workspace)],
+                                       workspace,
+                                       cache)
+            artifacts_out = compiler.run([artifact])
+            assert artifacts_out[0].location == workspace / 'flintstone.o'
+            assert artifacts_out[0].defines == ['flintstone']
+            assert (workspace / 'flintstone.o').read_text() == 'object'
+            assert (workspace / 'flintstone.mod').read_text() == 'module'
+
+        assert patched_run.call_count == 1
+        assert cache.statistics().hits == 1
+        assert cache.statistics().misses == 1
+
+    def test_fingerprints(self, mocker, tmp_path: Path):
+        workspace = tmp_path / 'working'
+        workspace.mkdir()
+        compiler = FortranCompiler('fred', [], workspace)
+        artifact = Artifact(tmp_path / 'flintstone.f90',
+                            FortranSource,
+                            Analysed)
+        artifact.add_definition('flintstone')
+        artifact.add_definition('bedrock')
+
+        interface = 'module interface'
+
+        def fake_compiler(command, cwd=None):
+            Path(command[-1]).write_text('object')
+            (workspace / 'flintstone.mod').write_text(interface)
+
+        patched_run = mocker.patch('fab.tasks.fortran.run_command',
+                                   side_effect=fake_compiler)
+        compiler.run([artifact])
+        fingerprints = compiler.fingerprints(artifact)
+        assert fingerprints is not None
+        assert fingerprints['bedrock'] == ''
+        assert fingerprints['flintstone'] != ''
+
+        # A different implementation with the same interface looks the same
+        #
+        compiler.run([artifact])
+        assert compiler.fingerprints(artifact) == fingerprints
+
+        # Unless the interface changes
+        #
+        interface = 'changed interface'
+        compiler.run([artifact])
+        changed = compiler.fingerprints(artifact)
+        assert changed is not None
+        assert changed['flintstone'] != fingerprints['flintstone']
+        fingerprints = changed
+        assert patched_run.call_count == 3
+
+        # Results may be restored while the module file is as compiled
+        #
+        previous = [Artifact(workspace / 'flintstone.o',
+                             BinaryObject,
+                             Compiled)]
+        restored = compiler.restore(artifact, previous)
+        assert restored[0].defines == ['flintstone', 'bedrock']
+        assert patched_run.call_count == 3
+
+        (workspace / 'flintstone.mod').write_text('tampered with')
+        compiler.restore(artifact, previous)
+        assert patched_run.call_count == 4
+        assert compiler.fingerprints(artifact) == fingerprints
+
+    def test_run_batch(self, mocker, tmp_path: Path):
+        workspace = tmp_path / 'working'
+        workspace.mkdir()
+        compiler = FortranCompiler('fred', ['-c'], workspace)
+        artifacts = [Artifact(tmp_path / 'flintstone.f90',
+                              FortranSource,
+                              Analysed),
+                     Artifact(tmp_path / 'rubble.f90',
+                              FortranSource,
+                              Analysed)]
+        artifacts[1].add_definition('rubble')
+
+        patched_run = mocker.patch('fab.tasks.fortran.run_command')
+        artifacts_out = compiler.run(artifacts)
+
+        # The compiler is called once and names the objects for itself
+        #
+        patched_run.assert_called_once_with(['fred',
+                                             '-c',
+                                             str(tmp_path / 'flintstone.f90'),
+                                             str(tmp_path / 'rubble.f90')],
+                                            workspace)
+        assert [artifact.location for artifact in artifacts_out] \
+            == [workspace / 'flintstone.o', workspace / 'rubble.o']
+        assert artifacts_out[1].defines == ['rubble']
+
+        # Unless that would see one object overwrite another
+        #
+        patched_run.reset_mock()
+        clash = Artifact(tmp_path / 'other' / 'rubble.f90',
+                         FortranSource,
+                         Analysed)
+        compiler.run(artifacts + [clash])
+        assert patched_run.call_count == 3
+
+        with pytest.raises(TaskException):
+            compiler.run([])
+
+    def test_run_batch_relative(self, mocker, monkeypatch, tmp_path: Path):
+        monkeypatch.chdir(tmp_path)
+        workspace = Path('working')
+        workspace.mkdir()
+        compiler = FortranCompiler('fred',
+                                   ['-c', '-J', 'working', '-Iinclude'],
+                                   workspace)
+        artifacts = [Artifact(Path('src/flintstone.f90'),
+                              FortranSource,
+                              Analysed),
+                     Artifact(Path('src/rubble.f90'),
+                              FortranSource,
+                              Analysed)]
+
+        patched_run = mocker.patch('fab.tasks.fortran.run_command')
+        compiler.run(artifacts)
+
+        # Being run in the workspace everything is found from anywhere
+        #
+        patched_run.assert_called_once_with(
+            ['fred',
+             '-c',
+             '-J', str(tmp_path / 'working'),
+             '-I' + str(tmp_path / 'include'),
+             str(tmp_path / 'src/flintstone.f90'),
+             str(tmp_path / 'src/rubble.f90')],
+            workspace)
+
+    def test_run_remote(self, mocker, tmp_path: Path):
+        workspace = tmp_path / 'working'
+        workspace.mkdir()
+        (workspace / 'rubble.mod').write_text('Module file')
+        compiler = FortranCompiler('fred', ['-c', '-J', str(workspace)],
+                                   workspace)
+        artifact = Artifact(tmp_path / 'flintstone.f90',
+                            FortranSource,
+                            Analysed)
+        artifact.add_definition('flintstone')
+        artifact.add_dependency('rubble')
+        artifact.add_dependency('iso_c_binding')
+
+        remote = RemoteWorker(('localhost', 1), b'key')
+        mocker.patch.object(remote, '_connection')
+        patched_remote = mocker.patch.object(remote, 'run')
+        patched_run = mocker.patch('fab.tasks.fortran.run_command')
+        with remote:
+            compiler.run([artifact])
+
+        # The worker is sent the source and the module files it uses which
+        # exist, and asked for whatever could come back
+        #
+        patched_run.assert_not_called()
+        patched_remote.assert_called_once_with(
+            ['fred', '-c', '-J', str(workspace),
+             str(tmp_path / 'flintstone.f90'),
+             '-o', str(workspace / 'flintstone.o')],
+            workspace,
+            [tmp_path / 'flintstone.f90', workspace / 'rubble.mod'],
+            [workspace / 'flintstone.o', workspace / 'flintstone.mod'])
+
+        # Without the worker the compiler is run here
+        #
+        patched_remote.side_effect = RemoteUnavailable('Gone away')
+        with remote:
+            compiler.run([artifact])
+        patched_run.assert_called_once()
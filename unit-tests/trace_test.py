@@ -0,0 +1,51 @@
+##############################################################################
+# (c) Crown copyright Met Office. All rights reserved.
+# For further details please refer to the file COPYRIGHT
+# which you should have received as part of this distribution
+##############################################################################
+import json
+from pathlib import Path
+
+from fab.tasks import subprocess_time, timed_subprocess
+from fab.trace import Span, Trace
+
+
+class TestTrace(object):
+    def test_write(self, tmp_path: Path):
+        trace = Trace()
+        trace.name_worker(2, 'Thread 1')
+        trace.add(Span('FortranCompiler',
+                       [Path('/test/first.f90'), Path('/test/second.f90')],
+                       trace._origin + 1.5,
+                       0.25,
+                       0.2),
+                  2,
+                  0.125)
+        trace.write(tmp_path / 'trace.json')
+
+        events = json.loads((tmp_path / 'trace.json').read_text())
+        assert events['traceEvents'] == [
+            {'name': 'thread_name',
+             'ph': 'M',
+             'pid': 0,
+             'tid': 2,
+             'args': {'name': 'Thread 1'}},
+            {'name': 'FortranCompiler',
+             'cat': 'task',
+             'ph': 'X',
+             'ts': 1500000,
+             'dur': 250000,
+             'pid': 0,
+             'tid': 2,
+             'args': {'paths': ['/test/first.f90', '/test/second.f90'],
+                      'queue_wait_ms': 125.0,
+                      'subprocess_ms': 200.0}}]
+
+
+def test_timed_subprocess():
+    before = subprocess_time()
+    with timed_subprocess():
+        pass
+    with timed_subprocess():
+        pass
+    assert subprocess_time() > before